@@ -1,9 +1,15 @@
 import time
 from structures.sw import SW_n_of_N
 from structures.gk import GK
-from tqdm import tqdm
 import numpy as np
 
+try:
+    from tqdm import tqdm
+except ImportError:
+    # progress bar is optional
+    def tqdm(iterable):
+        return iterable
+
 
 def main():
     data = np.random.normal(0, 1/12, 10000)
@@ -17,7 +23,7 @@ def main():
         sw.add(p, time.time())
 
     nmp_quantile = [np.quantile(data, q/10) for q in range(1, 10)]
-    gk_quantile = [gk.get_quantile(q/10) for q in range(1, 10)]
+    gk_quantile = [gk.query(q/10) for q in range(1, 10)]
     sw_quantile = [sw.query(q/10) for q in range(1, 10)]
 
     print(nmp_quantile)
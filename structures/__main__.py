@@ -0,0 +1,188 @@
+"""
+Streaming quantiles from the command line
+
+Numbers are read from a file or stdin in large chunks, as text (numbers
+separated by any whitespace) or as raw little-endian values of --dtype.
+Every chunk goes to SW n-of-N add_batch, and every --every points
+the quantiles of the last n points are written to stdout as one JSON line:
+
+    {"count": 20000, "quantiles": {"0.5": 0.01, "0.99": 2.31}, "error_bound": 0.01}
+
+    seq 1 100000 | python -m structures -N 10000 --every 20000 -q 0.5 0.99
+    python -m structures points.bin --format binary --dtype float32 -N 100000
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from typing import BinaryIO, Iterator, TextIO
+import numpy as np
+from structures.sw import SW_n_of_N, SUFFIX_MODE, MODES
+from structures.sketches.backends import BACKENDS, GK_BACKEND
+from structures.sketches.sketch import VALUE_DTYPES
+
+TEXT_FORMAT = 'text'
+BINARY_FORMAT = 'binary'
+FORMATS = (TEXT_FORMAT, BINARY_FORMAT)
+
+CHUNK_SIZE = 1 << 20
+WHITESPACE = (b' ', b'\n', b'\t', b'\r')
+
+
+def read_chunks(
+    stream: BinaryIO,
+    input_format: str = TEXT_FORMAT,
+    dtype=np.float64,
+    chunk_size: int = CHUNK_SIZE
+) -> Iterator[np.ndarray]:
+    """Parse points of binary stream chunk by chunk,
+    a number split between two reads is carried over to the next chunk
+
+    :param stream: binary file object
+    :param input_format: 'text' or 'binary'
+    :param dtype: dtype of points
+    :param chunk_size: bytes read at once
+    :raises Exception: If text contains something else than numbers of dtype
+    :return: iterator over arrays of points
+    """
+    dtype = np.dtype(dtype)
+    tail = b''
+    while True:
+        data = stream.read(chunk_size)
+        if not data:
+            break
+
+        data = tail + data
+        if input_format == BINARY_FORMAT:
+            end = len(data) - len(data) % dtype.itemsize
+        else:
+            # the last number can continue in the next read
+            end = max(data.rfind(c) for c in WHITESPACE) + 1
+
+        tail = data[end:]
+        points = _parse(data[:end], input_format, dtype)
+        if len(points) > 0:
+            yield points
+
+    if len(tail) > 0:
+        if input_format == BINARY_FORMAT:
+            raise Exception(
+                f'Binary input ends with {len(tail)} bytes of incomplete {dtype} value.'
+            )
+        yield _parse(tail, input_format, dtype)
+
+
+def _parse(data: bytes, input_format: str, dtype: np.dtype) -> np.ndarray:
+    """Points of one chunk
+
+    :param data: chunk that does not end inside a number
+    :param input_format: 'text' or 'binary'
+    :param dtype: dtype of points
+    :raises Exception: If text contains something else than numbers of dtype
+    :return: points
+    """
+    if input_format == BINARY_FORMAT:
+        return np.frombuffer(data, dtype=dtype.newbyteorder('<')).astype(dtype)
+
+    try:
+        return np.array(data.split(), dtype=dtype)
+    except ValueError as e:
+        raise Exception(f'Input should contain only {dtype} numbers. {e}')
+
+
+def _report(sw: SW_n_of_N, count: int, args, out: TextIO) -> None:
+    """Write quantiles of the last n points as JSON line
+
+    :param sw: structure, its current rank error bound is written as well
+    :param count: number of points read so far
+    :param args: parsed command line arguments
+    :param out: output stream
+    """
+    values = sw.query_many(args.quantiles, n=args.last)
+    quantiles = {str(q): value for q, value in zip(args.quantiles, values.tolist())}
+    out.write(json.dumps({
+        'count': count,
+        'quantiles': quantiles,
+        'error_bound': sw.error_bound()
+    }) + '\n')
+    out.flush()
+
+
+def _main(args, source: BinaryIO, out: TextIO) -> int:
+    """Feed points of source to SW n-of-N and report quantiles
+
+    :param args: parsed command line arguments
+    :param source: binary input stream
+    :param out: output stream
+    :return: number of points read
+    """
+    sw = SW_n_of_N(
+        n=args.number,
+        epsilon=args.epsilon,
+        mode=args.mode,
+        window_seconds=args.window_seconds,
+        backend=args.backend,
+        dtype=args.dtype,
+        max_tuples=args.max_tuples,
+        max_bytes=args.max_bytes
+    )
+    every = args.every or args.number
+
+    count = 0
+    for points in read_chunks(source, args.format, args.dtype, args.chunk_size):
+        start = 0
+        # chunk is split at report boundaries
+        while start < len(points):
+            end = min(len(points), start + every - count % every)
+            sw.add_batch(points[start:end], time.time())
+            count += end - start
+            start = end
+            if count % every == 0:
+                _report(sw, count, args, out)
+
+    if count % every != 0:
+        _report(sw, count, args, out)
+
+    return count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        prog='python -m structures',
+        description='Windowed quantiles of a stream of numbers'
+    )
+    parser.add_argument('input', nargs='?', default='-', help='Input file, stdin by default')
+    parser.add_argument('--format', choices=FORMATS, default=TEXT_FORMAT, help='Input format')
+    parser.add_argument('--dtype', choices=[str(t) for t in VALUE_DTYPES], default='float64', help='Dtype of points')
+    parser.add_argument('-N', '--number', type=int, default=10000, help='Window N')
+    parser.add_argument('-n', '--last', type=int, default=None, help='Report quantiles of the last n points, N by default')
+    parser.add_argument('-e', '--epsilon', type=float, default=0.01, help='Approximation coefficient')
+    parser.add_argument('-q', '--quantiles', type=float, nargs='+', default=[0.5, 0.9, 0.99], help='Reported quantiles')
+    parser.add_argument('--every', type=int, default=None, help='Report every this many points, N by default')
+    parser.add_argument('--mode', choices=MODES, default=SUFFIX_MODE, help='SW ingestion engine')
+    parser.add_argument('--backend', choices=tuple(BACKENDS), default=GK_BACKEND, help='Sketch of buckets')
+    parser.add_argument('--window-seconds', type=float, default=None, help='Time window of arrival times')
+    parser.add_argument('--max-tuples', type=int, default=None, help='Memory budget in sketch tuples, coarsens epsilon')
+    parser.add_argument('--max-bytes', type=int, default=None, help='Memory budget in bytes of the structure, coarsens epsilon')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Bytes read at once')
+    parser.add_argument('--log-level', default='WARNING', help='Logging level of stderr log')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level.upper(), stream=sys.stderr)
+
+    try:
+        if args.input == '-':
+            _main(args, sys.stdin.buffer, sys.stdout)
+        else:
+            with open(args.input, 'rb') as source:
+                _main(args, source, sys.stdout)
+    except KeyboardInterrupt:
+        pass
+    except BrokenPipeError:
+        # reader of output went away (e.g. head), silence flush at exit
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
+    except Exception as e:
+        parser.exit(1, f'{parser.prog}: error: {e}\n')
@@ -1,29 +1,50 @@
 """
 Bucket implementation
 """
-from structures.sketches.sketch import Sketch
-from structures.summaries.summary_nn import SummaryNn
-from typing import List
+from structures.sketches.backends import BACKENDS, GK_BACKEND
+from typing import List, Tuple
 import numpy as np
 
 
 class Bucket():
+    __slots__ = (
+        'Nb', 'timestamp', 'start', 'epsilon', 'backend', 'sketch',
+        'compressing_interval', '_lifted', '_lifted_key',
+        'lift_hits', 'lift_misses', 'compressions'
+    )
+
     def __init__(
         self,
         ts: float,
-        epsilon: float
+        epsilon: float,
+        start: int = 0,
+        backend: str = GK_BACKEND,
+        dtype=np.float64,
+        rank_dtype=np.int64
     ) -> None:
         """Class constructor
 
         :param ts: record timestamp
         :param epsilon: possible approximation error
+        :param start: sequence number of the first point in bucket
+        :param backend: sketch backend, one of BACKENDS
+        :param dtype: dtype of sketch values
+        :param rank_dtype: integer dtype of sketch gaps and deltas
         """
         self.Nb = 0
         self.timestamp = ts
+        self.start = start
         self.epsilon = epsilon
+        self.backend = backend
         # preserve epsilon/2 approximate
-        self.sketch = Sketch(self.epsilon/2)
+        self.sketch = BACKENDS[backend](self.epsilon/2, dtype=dtype, rank_dtype=rank_dtype)
         self.compressing_interval = np.floor(1/(self.epsilon))
+        # LIFTed sketch is reused until sketch version or Nb changes
+        self._lifted = None
+        self._lifted_key = None
+        self.lift_hits = 0
+        self.lift_misses = 0
+        self.compressions = 0
 
     def add(self, point) -> None:
         """Add new point to bucket
@@ -34,14 +55,122 @@ class Bucket():
         self.Nb += 1
 
         if self.Nb % self.compressing_interval == 0:
-            self.sketch.compress(self.Nb)
+            self._compress()
+
+    def add_batch(self, points) -> None:
+        """Add sorted batch of points to bucket
+
+        :param points: sorted data values
+        """
+        if len(points) == 0:
+            return
+
+        seen = self.Nb
+        self.sketch.add_batch(points, seen)
+        self.Nb += len(points)
+
+        # compress once if batch crossed compressing boundary
+        if self.Nb // self.compressing_interval > seen // self.compressing_interval:
+            self._compress()
+
+    def merge(self, other: 'Bucket') -> None:
+        """Absorb newer bucket with disjoint points
+
+        :param other: bucket that follows this one in time
+        """
+        if other.Nb == 0:
+            return None
+
+        self.sketch.merge(other.sketch)
+        self.Nb += other.Nb
+        # merged summary is only as precise as the coarser one
+        if other.epsilon > self.epsilon:
+            self.coarsen(other.epsilon)
+        else:
+            self._compress()
+
+    @classmethod
+    def merge_all(cls, buckets: List['Bucket']) -> 'Bucket':
+        """Merge consecutive buckets with disjoint points into new bucket
+        carrying the oldest timestamp
+
+        :param buckets: buckets from oldest to newest
+        :return: bucket covering points of all buckets
+        """
+        oldest = buckets[0]
+        # merged summary is only as precise as the coarsest one
+        epsilon = max(b.epsilon for b in buckets)
+        bucket = cls(oldest.timestamp, epsilon, oldest.start, oldest.backend)
+        bucket.Nb = sum(b.Nb for b in buckets)
+        bucket.sketch = type(oldest.sketch).merge_all([b.sketch for b in buckets])
+        bucket.sketch.epsilon = epsilon / 2
+        bucket._compress()
+
+        return bucket
+
+    def coarsen(self, epsilon: float) -> None:
+        """Raise approximation error of bucket and compress sketch for it,
+        an epsilon/2-approximate sketch stays valid for larger epsilon
 
-    def lift(self) -> List[SummaryNn]:
-        """Apply LIFT algorithm to sketch
+        :param epsilon: new approximation error, not smaller than current one
+        """
+        self.epsilon = epsilon
+        self.sketch.epsilon = epsilon / 2
+        self.compressing_interval = np.floor(1 / epsilon)
+        self._compress()
+
+    def _compress(self) -> None:
+        """Compress sketch for current number of points
+        """
+        self.sketch.compress(self.Nb)
+        self.compressions += 1
+
+    def shrink(self, receiving: bool = True) -> None:
+        """Release LIFT cache, python lists and spare capacity of sketch buffers
+
+        :param receiving: bucket receives single points, keep room for them
+            until the next compression, otherwise buffers double on the next add
+        """
+        self._lifted = None
+        self._lifted_key = None
+        spare = 0
+        if receiving:
+            spare = int(self.compressing_interval - self.Nb % self.compressing_interval)
+        self.sketch.shrink(spare)
+
+    def copy(self) -> 'Bucket':
+        """Independent copy of bucket
 
-        :return: LIFTed sketch
+        :return: new bucket with copied sketch
         """
-        return self.sketch.lift(self.epsilon, self.Nb)
+        bucket = Bucket(self.timestamp, self.epsilon, self.start, self.backend)
+        bucket.Nb = self.Nb
+        bucket.sketch = self.sketch.copy()
+
+        return bucket
+
+    def lift(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Apply LIFT algorithm to sketch, result is cached
+        until the bucket is modified
+
+        :return: LIFTed sketch as read-only values, rmin and rmax columns
+        """
+        # waiting points change version when they are inserted
+        self.sketch.flush()
+        key = (id(self.sketch), self.sketch.version, self.Nb, self.epsilon)
+        if self._lifted_key == key:
+            self.lift_hits += 1
+            return self._lifted
+
+        self.lift_misses += 1
+        lifted = self.sketch.lift(self.epsilon, self.Nb)
+        for column in lifted:
+            column.flags.writeable = False
+
+        self._lifted = lifted
+        self._lifted_key = key
+
+        return lifted
 
     def __repr__(self) -> str:
         """Readable format for Bucket
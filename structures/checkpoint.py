@@ -0,0 +1,123 @@
+"""
+Binary checkpoint container for structures state
+
+Layout:
+    magic (8 bytes) | format version (uint32) | header length (uint32) |
+    header (utf-8 JSON) | arrays, every one aligned to ALIGNMENT bytes
+
+Header keeps kind of structure, its scalar parameters and
+name, dtype, shape and offset of every array. Arrays are stored raw
+(little-endian), so loading can memory-map the file and give numpy
+views into it without parsing tuples
+"""
+import json
+import struct
+from typing import Any, Dict, Tuple
+import numpy as np
+
+MAGIC = b'SWNNCKPT'
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+_PREFIX = struct.Struct('<8sII')
+
+
+def save_checkpoint(
+    path: str,
+    kind: str,
+    meta: Dict[str, Any],
+    arrays: Dict[str, np.ndarray]
+) -> None:
+    """Write structure state to file
+
+    :param path: file path
+    :param kind: name of structure class
+    :param meta: JSON serializable scalar parameters
+    :param arrays: named 1-d arrays
+    """
+    entries = []
+    offset = 0
+    prepared = []
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        array = array.astype(array.dtype.newbyteorder('<'), copy=False)
+        offset = _align(offset)
+        entries.append({
+            'name': name,
+            'dtype': array.dtype.str,
+            'shape': list(array.shape),
+            'offset': offset
+        })
+        prepared.append((offset, array))
+        offset += array.nbytes
+
+    header = json.dumps({
+        'kind': kind,
+        'meta': meta,
+        'arrays': entries
+    }).encode('utf-8')
+    data_start = _align(_PREFIX.size + len(header))
+
+    with open(path, 'wb') as f:
+        f.write(_PREFIX.pack(MAGIC, FORMAT_VERSION, len(header)))
+        f.write(header)
+        for array_offset, array in prepared:
+            f.seek(data_start + array_offset)
+            f.write(array.tobytes())
+        # keep the file as long as the aligned data area
+        f.truncate(data_start + _align(offset))
+
+
+def load_checkpoint(
+    path: str,
+    kind: str,
+    mmap: bool = True
+) -> Tuple[Dict[str, Any], Dict[str, np.ndarray]]:
+    """Read structure state from file
+
+    :param path: file path
+    :param kind: expected name of structure class
+    :param mmap: map file into memory (copy-on-write) instead of reading it,
+        arrays are then views into the mapping
+    :raises Exception: If file is not a checkpoint of given kind or version
+    :return: scalar parameters and named arrays
+    """
+    with open(path, 'rb') as f:
+        magic, version, header_length = _PREFIX.unpack(f.read(_PREFIX.size))
+        if magic != MAGIC:
+            raise Exception(f'{path} is not a checkpoint file')
+        if version != FORMAT_VERSION:
+            raise Exception(
+                f'Unsupported checkpoint version {version}. Expected {FORMAT_VERSION}.'
+            )
+        header = json.loads(f.read(header_length).decode('utf-8'))
+
+    if header['kind'] != kind:
+        raise Exception(
+            f'Checkpoint contains {header["kind"]}. Expected {kind}.'
+        )
+
+    if mmap:
+        # plain ndarray view of mapping, memmap slicing is slow
+        data = np.memmap(path, dtype=np.uint8, mode='c').view(np.ndarray)
+    else:
+        data = np.fromfile(path, dtype=np.uint8)
+    data_start = _align(_PREFIX.size + header_length)
+
+    arrays = {}
+    for entry in header['arrays']:
+        dtype = np.dtype(entry['dtype'])
+        count = int(np.prod(entry['shape'], dtype=np.int64))
+        start = data_start + entry['offset']
+        array = data[start:start + count * dtype.itemsize].view(dtype)
+        arrays[entry['name']] = array.reshape(entry['shape'])
+
+    return header['meta'], arrays
+
+
+def _align(offset: int) -> int:
+    """Round offset up to ALIGNMENT
+
+    :param offset: bytes offset
+    :return: aligned offset
+    """
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
@@ -0,0 +1,204 @@
+"""
+Exact quantiles over the most recent N points
+
+Window is kept twice: arrival order in a FIFO (to know which point expires)
+and value order in a blocked sorted list. The sorted list is a list of
+sorted blocks of at most 2 * BLOCK_SIZE points with the maximum of every
+block, so insert and delete are a bisect over block maxima plus
+a short list insert inside one block.
+"""
+import bisect
+import logging
+from collections import deque
+from typing import Any, Dict, List
+import numpy as np
+from structures.memory import deep_sizeof
+
+logger = logging.getLogger(__name__)
+
+BLOCK_SIZE = 512
+
+
+class SortedBlocks():
+    __slots__ = ('blocks', 'maxes', 'size')
+
+    def __init__(self, values: List = None):
+        """Class constructor
+
+        :param values: initial values, any order
+        """
+        self.blocks: List[List] = []
+        self.maxes: List = []
+        self.size = 0
+        if values:
+            self.reset(values)
+
+    def reset(self, values: List) -> None:
+        """Replace content with given values
+
+        :param values: values, any order
+        """
+        values = sorted(values)
+        self.blocks = [
+            values[i:i + BLOCK_SIZE] for i in range(0, len(values), BLOCK_SIZE)
+        ]
+        self.maxes = [block[-1] for block in self.blocks]
+        self.size = len(values)
+
+    def insert(self, value) -> None:
+        """Insert value keeping order
+
+        :param value: value
+        """
+        self.size += 1
+        if len(self.blocks) == 0:
+            self.blocks.append([value])
+            self.maxes.append(value)
+            return None
+
+        i = bisect.bisect_left(self.maxes, value)
+        if i == len(self.blocks):
+            # new maximum goes to the last block
+            i -= 1
+            self.blocks[i].append(value)
+            self.maxes[i] = value
+        else:
+            bisect.insort(self.blocks[i], value)
+
+        block = self.blocks[i]
+        if len(block) > 2 * BLOCK_SIZE:
+            self.blocks[i:i + 1] = [block[:BLOCK_SIZE], block[BLOCK_SIZE:]]
+            self.maxes[i:i + 1] = [block[BLOCK_SIZE - 1], block[-1]]
+
+    def remove(self, value) -> None:
+        """Remove one occurrence of value
+
+        :param value: value present in the list
+        """
+        i = bisect.bisect_left(self.maxes, value)
+        block = self.blocks[i]
+        del block[bisect.bisect_left(block, value)]
+        self.size -= 1
+
+        if len(block) == 0:
+            del self.blocks[i]
+            del self.maxes[i]
+            return None
+
+        self.maxes[i] = block[-1]
+        # join small block with its neighbour
+        if len(block) < BLOCK_SIZE // 2 and len(self.blocks) > 1:
+            j = i - 1 if i > 0 else i
+            self.blocks[j:j + 2] = [self.blocks[j] + self.blocks[j + 1]]
+            self.maxes[j:j + 2] = [self.maxes[j + 1]]
+            if len(self.blocks[j]) > 2 * BLOCK_SIZE:
+                block = self.blocks[j]
+                self.blocks[j:j + 1] = [block[:BLOCK_SIZE], block[BLOCK_SIZE:]]
+                self.maxes[j:j + 1] = [block[BLOCK_SIZE - 1], block[-1]]
+
+    def select(self, indexes) -> List:
+        """Values at given positions of sorted order
+
+        :param indexes: 0-based positions
+        :return: values in order of 'indexes'
+        """
+        ends = np.cumsum([len(block) for block in self.blocks])
+        result = []
+        for index in indexes:
+            i = int(np.searchsorted(ends, index, side='right'))
+            begin = ends[i - 1] if i > 0 else 0
+            result.append(self.blocks[i][index - begin])
+
+        return result
+
+
+class ExactQuantile():
+
+    def __init__(self, n: int):
+        """Class constructor
+
+        :param n: number of most recent points in window
+        """
+        self.n = n
+        self._fifo = deque()
+        self._sorted = SortedBlocks()
+        logger.info(
+            'Init Exact Quantile System.\n'
+            '\tn: %s (window size)', self.n
+        )
+
+    def add(self, point, *args, **kwargs):
+        """Add new data point, the oldest one leaves full window
+
+        :param point: data point, should be Comparable
+        """
+        self._fifo.append(point)
+        self._sorted.insert(point)
+        if len(self._fifo) > self.n:
+            self._sorted.remove(self._fifo.popleft())
+
+    def add_batch(self, points, *args, **kwargs):
+        """Add chunk of data points at once. Chunks comparable with
+        window size rebuild sorted list instead of point updates
+
+        :param points: 1-d array of data points
+        """
+        points = np.asarray(points).ravel()[-self.n:].tolist()
+        if len(points) < self.n // 8:
+            for point in points:
+                self.add(point)
+            return None
+
+        self._fifo.extend(points)
+        while len(self._fifo) > self.n:
+            self._fifo.popleft()
+        self._sorted.reset(list(self._fifo))
+
+    def query(self, q: float, *args, **kwargs):
+        """Retrieve φ-quantile of window
+
+        :param q: φ-quantile
+        :return: point of rank ⌈φn⌉
+        """
+        return self.query_many([q])[0]
+
+    def query_many(self, qs, *args, **kwargs) -> np.ndarray:
+        """Retrieve several φ-quantiles of window, the answer for φ is
+        the point of rank ⌈φn⌉ (numpy 'inverted_cdf' method)
+
+        :param qs: sequence of φ-quantiles
+        :raises Exception: If any 'q' not in (0, 1] or no points were added
+        :return: calculated values in order of 'qs'
+        """
+        qs = np.asarray(qs, dtype=float).ravel()
+        for q in qs:
+            if q <= 0 or q > 1:
+                raise Exception(
+                    f'Quantile fraction should be in (0, 1]. Got {q}.'
+                )
+
+        size = self._sorted.size
+        if size == 0:
+            raise Exception('No elements')
+
+        ranks = np.ceil(qs * size).astype(np.int64)
+        return np.array(self._sorted.select((ranks - 1).tolist()))
+
+    def stats(self) -> Dict[str, Any]:
+        """Estimator statistics
+
+        :return: dictionary with number of points in window, sorted blocks
+            and memory_bytes (see memory_usage)
+        """
+        return {
+            'count': len(self._fifo),
+            'blocks': len(self._sorted.blocks),
+            'memory_bytes': self.memory_usage()
+        }
+
+    def memory_usage(self) -> int:
+        """Deep size of window
+
+        :return: bytes
+        """
+        return deep_sizeof(self)
@@ -2,75 +2,170 @@
 Greenwald-Khanna quantile estimator
 Implementation is taken from the link below for test purposes
 https://aakinshin.net/posts/greenwald-khanna-quantile-estimator/#post-title
+
+Summaries are kept in a columnar Sketch, so prefix ranks are available
+after one cumsum and quantile lookup is a binary search
 """
+import logging
 import numpy as np
-from typing import List
+from typing import Any, Dict, List
 from structures.summaries.summary import Summary
-import bisect
+from structures.sketches.sketch import Sketch, VALUE_DTYPES, coerce_value, coerce_values
+from structures.checkpoint import save_checkpoint, load_checkpoint
+from structures.memory import deep_sizeof
+
+logger = logging.getLogger(__name__)
+
 
 class GK():
-    def __init__(self, epsilon):
+    def __init__(self, epsilon, dtype=np.float64):
+        """Class constructor
+
+        :param epsilon: rank error coefficient
+        :param dtype: dtype of stored values, float32, float64, int32 or int64
+        :raises Exception: If dtype is not supported
+        """
+        if np.dtype(dtype) not in VALUE_DTYPES:
+            raise Exception(
+                f'Value dtype should be one of {[str(t) for t in VALUE_DTYPES]}. Got {dtype}.'
+            )
+
         self.epsilon = epsilon
+        self.dtype = np.dtype(dtype)
         self.compressing_interval = np.floor(1 / (2 * epsilon))
-        self.summaries: List[Summary] = []
+        self.sketch = Sketch(epsilon, dtype=self.dtype)
         self.n = 0
-        print('Init GK system.')
-        print(f'\tepsilon: {self.epsilon} (rank error coefficient)')
-        print(f'\tcompressing_interval: {self.compressing_interval} (limit for storing)')
+        self.compressions = 0
+        logger.info(
+            'Init GK system.\n'
+            '\tepsilon: %s (rank error coefficient)\n'
+            '\tcompressing_interval: %s (limit for storing)\n'
+            '\tdtype: %s (stored values)',
+            self.epsilon, self.compressing_interval, self.dtype
+        )
+
+    @property
+    def summaries(self) -> List[Summary]:
+        return self.sketch.summaries
 
     def add(self, point, *args, **kwargs):
+        # delta = 2 * epsilon * n, zero for new minimum or maximum
+        self.sketch.add(coerce_value(point, self.dtype), self.n)
+        self.n += 1
+
+        if self.n % self.compressing_interval == 0:
+            self.sketch.compress(self.n)
+            self.compressions += 1
+
+    def add_batch(self, points, *args, **kwargs):
+        """Add chunk of data points as one sorted merge
+
+        :param points: 1-d array of data points, converted to dtype once
+        :raises Exception: If points do not fit dtype
+        """
+        points = np.sort(coerce_values(points, self.dtype))
+        seen = self.n
+        self.sketch.add_batch(points, seen)
+        self.n += len(points)
+
+        # compress once if batch crossed compressing boundary
+        if self.n // self.compressing_interval > seen // self.compressing_interval:
+            self.sketch.compress(self.n)
+            self.compressions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Estimator statistics
 
-        delta = 2 * self.epsilon * self.n
-        new_summary = Summary(point, delta)
-        
-        insert_index = bisect.bisect_right(
-            self.summaries,
-            new_summary
+        :return: dictionary with number of points, tuples,
+            compressions and memory_bytes (see memory_usage)
+        """
+        return {
+            'count': self.n,
+            'tuples': self.sketch.len(),
+            'compressions': self.compressions,
+            'memory_bytes': self.memory_usage()
+        }
+
+    def memory_usage(self) -> int:
+        """Deep size of estimator including spare sketch capacity
+
+        :return: bytes
+        """
+        return deep_sizeof(self)
+
+    def save(self, path: str) -> None:
+        """Write summaries to binary checkpoint file
+
+        :param path: file path
+        """
+        values, gaps, deltas = self.sketch._columns()
+        save_checkpoint(
+            path,
+            'GK',
+            {'epsilon': self.epsilon, 'n': self.n},
+            {'values': values, 'gaps': gaps, 'deltas': deltas}
         )
 
-        if insert_index == 0 or insert_index == len(self.summaries):
-            new_summary.delta = 0
-        
-        self.summaries.insert(insert_index, new_summary)
-        self.n += 1
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> 'GK':
+        """Restore estimator from checkpoint file
 
-        if self.n % self.compressing_interval == 0:
-            self.compress()
-    
-    def _compress(self):
-        for i in range(len(self.summaries) - 2, 1, -1):
-            while (i < len(self.summaries) - 1 and self.delete_if_needed(i)):
-                pass
-    
-    def _delete_if_needed(self, i):
-        s1 = self.summaries[i]
-        s2 = self.summaries[i + 1]
-        if s1.delta >= s2.delta and s1.gap + s2.delta < 2 * self.epsilon * self.n:
-            self.summaries.pop(i)
-            s2.gap += s1.gap
-            return True
-        return False
+        :param path: file path
+        :param mmap: map file into memory instead of reading it
+        :return: restored estimator
+        """
+        meta, arrays = load_checkpoint(path, 'GK', mmap)
+        gk = cls.__new__(cls)
+        gk.epsilon = meta['epsilon']
+        gk.dtype = arrays['values'].dtype
+        gk.compressing_interval = np.floor(1 / (2 * gk.epsilon))
+        gk.n = meta['n']
+        gk.compressions = 0
+        # checkpoints before integer deltas are converted once
+        gk.sketch = Sketch.from_columns(
+            gk.epsilon, arrays['values'], arrays['gaps'],
+            arrays['deltas'].astype(arrays['gaps'].dtype, copy=False)
+        )
+
+        return gk
 
     def query(self, q: float, *args, **kargs):
-        assert len(self.summaries) != 0, 'No elements'
+        return self.query_many([q])[0]
+
+    def query_many(self, qs, *args, **kwargs) -> np.ndarray:
+        """Retrieve several quantiles
+
+        Among tuples with rank - margin <= rmin and rmax <= rank + margin
+        the one with rank bounds centered closest to the rank is chosen.
+        rmin is increasing, so candidates are found by binary search
 
-        rank = q * (self.n - 1) + 1
+        :param qs: sequence of quantiles
+        :raises Exception: If no points were added or no tuple fits the rank
+        :return: values in order of 'qs'
+        """
+        if self.sketch.len() == 0:
+            raise Exception('No elements')
+
+        values, rmin, rmax = self.sketch.get_rmin_rmax()
         margin = np.ceil(self.epsilon * self.n)
 
-        best_index = -1
-        best_dist = float('inf')
-        rmin = 0
-        for i in range(len(self.summaries)):
-            summary = self.summaries[i]
-            rmin += summary.gap
-            rmax = rmin + summary.delta
-            if rank - margin <= rmin and rmax <= rank + margin:
-                current_dist = abs(rank - (rmin + rmax) / 2)
-                if current_dist < best_dist:
-                    best_dist = current_dist
-                    best_index = i
-        
-        assert best_index != -1
-
-        return self.summaries[best_index].value
+        result = []
+        for q in qs:
+            rank = q * (self.n - 1) + 1
+            lo = np.searchsorted(rmin, rank - margin, side='left')
+            hi = np.searchsorted(rmin, rank + margin, side='right')
+
+            fits = rmax[lo:hi] <= rank + margin
+            if not fits.any():
+                # compress keeps gap + delta within 2 * epsilon * n, so the sketch itself is broken
+                raise Exception(
+                    f'No summary tuple fits rank {rank:g} ± {margin:g} of '
+                    f'{q}-quantile over {self.n} points, epsilon guarantee is violated.'
+                )
+
+            dist = np.where(
+                fits, np.abs(rank - (rmin[lo:hi] + rmax[lo:hi]) / 2), np.inf
+            )
+            result.append(values[lo + np.argmin(dist)])
 
+        return np.array(result)
@@ -0,0 +1,47 @@
+"""
+Deep memory accounting of structures
+"""
+import sys
+from collections import deque
+from typing import Any, Set
+import numpy as np
+
+
+def deep_sizeof(obj: Any, seen: Set[int] = None) -> int:
+    """Number of bytes of object and everything reachable from it
+    (dicts, lists, tuples, sets, deques, attributes and slots).
+    Every object is counted once.
+
+    numpy arrays count their data buffer only if they own it,
+    views (e.g. into memory-mapped checkpoint) count header only
+
+    :param obj: object to measure
+    :param seen: ids of already counted objects
+    :return: bytes
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    # includes data buffer of arrays owning it
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (np.ndarray, str, bytes, int, float, type)):
+        return size
+
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += deep_sizeof(key, seen) + deep_sizeof(value, seen)
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        for item in obj:
+            size += deep_sizeof(item, seen)
+
+    if hasattr(obj, '__dict__'):
+        size += deep_sizeof(obj.__dict__, seen)
+    for klass in type(obj).__mro__:
+        for name in getattr(klass, '__slots__', ()):
+            if hasattr(obj, name):
+                size += deep_sizeof(getattr(obj, name), seen)
+
+    return size
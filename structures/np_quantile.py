@@ -1,18 +1,159 @@
+"""
+Exact quantiles over a fixed-capacity ring buffer of the latest points
+"""
+import logging
 import numpy as np
-from typing import List
+from typing import Any, Dict
+from structures.memory import deep_sizeof
+
+logger = logging.getLogger(__name__)
+
 
 class NumpyQuantile():
 
-    def __init__(self, n: int):
-        self.points: List = []
+    def __init__(self, n: int, capacity: int = None, cache: bool = False):
+        """Class constructor
+
+        :param n: number of most recent points for last_n queries
+        :param capacity: number of stored points (n by default),
+            older points are overwritten
+        :param cache: keep sorted window between queries. Repeated queries
+            without new points are lookups. Window is updated incrementally
+            if its expired points are still in buffer (capacity ≥ n + new points)
+            and only a few points were added
+        :raises Exception: If capacity is less than n
+        """
+        if capacity is None:
+            capacity = n
+        if capacity < n:
+            raise Exception(
+                f'Capacity should be at least n = {n}. Got {capacity}.'
+            )
+
         self.n = n
-        print('Init Numpy Quantile System.')
+        self.capacity = capacity
+        self.cache = cache
+        self._buffer = np.empty(capacity, dtype=np.float64)
+        # number of points added so far, next position is count % capacity
+        self._count = 0
+        self._sorted = None
+        self._sorted_count = 0
+        logger.info('Init Numpy Quantile System.')
 
     def add(self, point, *args, **kwargs):
-        self.points.append(point)
+        self._buffer[self._count % self.capacity] = point
+        self._count += 1
+
+    def add_batch(self, points, *args, **kwargs):
+        """Add chunk of data points at once
+
+        :param points: 1-d array of data points
+        """
+        points = np.asarray(points, dtype=np.float64).ravel()
+        size = len(points)
+        # only the latest capacity points survive
+        if size > self.capacity:
+            points = points[-self.capacity:]
+        positions = (self._count + size - len(points) + np.arange(len(points))) % self.capacity
+        self._buffer[positions] = points
+        self._count += size
+
+    def query(self, q: float, last_n: bool = False):
+        """Retrieve φ-quantile with linear interpolation as np.quantile
 
-    def query(self, q: float, last_n: False):
-        if last_n:
-            return np.quantile(self.points[-self.n:], q)
+        :param q: φ-quantile
+        :param last_n: answer for the latest n points instead of whole buffer
+        :return: calculated value
+        """
+        return self.query_many([q], last_n)[0]
+
+    def query_many(self, qs, last_n: bool = False) -> np.ndarray:
+        """Retrieve several φ-quantiles. Order statistics around all
+        requested ranks are found with one np.partition (or cached sorted window)
+
+        :param qs: sequence of φ-quantiles
+        :param last_n: answer for the latest n points instead of whole buffer
+        :raises Exception: If no points were added
+        :return: calculated values in order of 'qs'
+        """
+        size = min(self.n if last_n else self.capacity, self._count)
+        if size == 0:
+            raise Exception('No elements')
+
+        # virtual index of np.quantile 'linear' method
+        index = np.asarray(qs, dtype=float).ravel() * (size - 1)
+        lo = np.floor(index).astype(np.int64)
+        hi = np.minimum(lo + 1, size - 1)
+
+        if self.cache:
+            window = self._sorted_window(size)
         else:
-            return np.quantile(self.points, q)
+            window = np.partition(self._window(size), np.union1d(lo, hi))
+
+        return window[lo] + (index - lo) * (window[hi] - window[lo])
+
+    def _window(self, size: int) -> np.ndarray:
+        """Copy of the latest points
+
+        :param size: number of points
+        :return: points in arrival order
+        """
+        end = self._count % self.capacity
+        if size <= end:
+            return self._buffer[end - size:end].copy()
+
+        return np.concatenate((
+            self._buffer[self.capacity - (size - end):], self._buffer[:end]
+        ))
+
+    def _sorted_window(self, size: int) -> np.ndarray:
+        """Sorted latest points, kept between queries
+
+        :param size: number of points
+        :return: sorted points
+        """
+        added = self._count - self._sorted_count
+        reusable = self._sorted is not None and len(self._sorted) == size
+
+        if reusable and added == 0:
+            return self._sorted
+
+        # expired points are still in buffer and update is cheaper than sort
+        if reusable and self._count - self._sorted_count + size <= self.capacity \
+                and added <= size // 4:
+            positions = np.arange(self._sorted_count - size, self._count - size)
+            expired = np.sort(self._buffer[positions % self.capacity])
+            positions = np.arange(self._sorted_count, self._count)
+            new = np.sort(self._buffer[positions % self.capacity])
+
+            # equal expired values take consecutive positions
+            repeats = np.arange(len(expired)) - np.searchsorted(expired, expired)
+            positions = np.searchsorted(self._sorted, expired) + repeats
+            window = np.delete(self._sorted, positions)
+            window = np.insert(window, np.searchsorted(window, new), new)
+        else:
+            window = np.sort(self._window(size))
+
+        self._sorted = window
+        self._sorted_count = self._count
+
+        return window
+
+    def stats(self) -> Dict[str, Any]:
+        """Estimator statistics
+
+        :return: dictionary with number of added and stored points
+            and memory_bytes (see memory_usage)
+        """
+        return {
+            'count': self._count,
+            'stored': min(self._count, self.capacity),
+            'memory_bytes': self.memory_usage()
+        }
+
+    def memory_usage(self) -> int:
+        """Deep size of ring buffer and cached window
+
+        :return: bytes
+        """
+        return deep_sizeof(self)
@@ -0,0 +1,433 @@
+"""
+Registry of SW n-of-N structures for many independent streams (keys)
+that share one configuration
+
+A live key is a SW_n_of_N with bucket and sketch objects. Keys loaded from
+a checkpoint, and keys beyond max_live_keys least recently used ones, are
+kept packed instead: parameters and a few flat arrays of their state
+(SW_n_of_N._state), several times smaller. They become live on next use
+"""
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Tuple
+import numpy as np
+from structures.sw import SW_n_of_N, SUFFIX_MODE
+from structures.sketches.backends import GK_BACKEND
+from structures.sketches.sketch import coerce_values
+from structures.checkpoint import save_checkpoint, load_checkpoint
+from structures.memory import deep_sizeof
+
+# approximate size of parameters and array headers of one packed key
+STATE_OVERHEAD = 3000
+
+
+class SWRegistry():
+
+    def __init__(
+        self,
+        n: int,
+        epsilon: float,
+        mode: str = SUFFIX_MODE,
+        window_seconds: float = None,
+        memory_budget: int = None,
+        backend: str = GK_BACKEND,
+        dtype=np.float64,
+        max_tuples: int = None,
+        max_live_keys: int = None
+    ):
+        """Class constructor
+
+        :param n: number of most recent points of every key
+        :param epsilon: approximate coefficient
+        :param mode: ingestion engine of SW n-of-N, 'suffix' or 'segment'
+        :param window_seconds: time window of every key, see SW_n_of_N
+        :param memory_budget: approximate limit of bytes for all keys,
+            least recently updated keys are evicted when it is exceeded
+        :param backend: sketch of buckets, see SW_n_of_N
+        :param dtype: dtype of stored values, see SW_n_of_N
+        :param max_tuples: memory budget of every key, see SW_n_of_N
+        :param max_live_keys: number of most recently used keys kept live,
+            other keys are packed until their next use. All keys are live by default
+        :raises Exception: If max_live_keys is not positive
+        """
+        if max_live_keys is not None and max_live_keys <= 0:
+            raise Exception(
+                f'Number of live keys should be positive. Got {max_live_keys}.'
+            )
+
+        self.n = n
+        self.epsilon = epsilon
+        self.mode = mode
+        self.window_seconds = window_seconds
+        self.memory_budget = memory_budget
+        self.backend = backend
+        self.dtype = np.dtype(dtype)
+        self.max_tuples = max_tuples
+        self.max_live_keys = max_live_keys
+
+        # least recently updated key first, None for packed keys
+        self._streams: Dict[Hashable, SW_n_of_N] = OrderedDict()
+        self._sizes: Dict[Hashable, int] = {}
+        self._last_seen: Dict[Hashable, float] = {}
+        # packed states of keys, restored on first use
+        self._pending: Dict[Hashable, Tuple[Dict[str, Any], Dict[str, np.ndarray]]] = {}
+        # live keys, least recently used (updated or queried) first
+        self._live: Dict[Hashable, None] = OrderedDict()
+        self._memory = 0
+        self.evicted = 0
+
+    def _stream(self, key: Hashable) -> SW_n_of_N:
+        """Get structure of key, create it on first use
+
+        :param key: stream key
+        :return: SW n-of-N of key
+        """
+        stream = self._streams.get(key)
+        if key in self._pending:
+            stream = SW_n_of_N._restore(*self._pending.pop(key))
+            self._streams[key] = stream
+            self._resize(key, stream._approximate_bytes())
+        elif stream is None:
+            stream = SW_n_of_N(
+                n=self.n,
+                epsilon=self.epsilon,
+                mode=self.mode,
+                window_seconds=self.window_seconds,
+                verbose=False,
+                backend=self.backend,
+                dtype=self.dtype,
+                max_tuples=self.max_tuples
+            )
+            self._streams[key] = stream
+            self._sizes[key] = 0
+
+        self._live[key] = None
+        self._live.move_to_end(key)
+
+        return stream
+
+    def _resize(self, key: Hashable, size: int):
+        """Update memory accounting of key
+
+        :param key: stream key
+        :param size: approximate bytes of key
+        """
+        self._memory += size - self._sizes[key]
+        self._sizes[key] = size
+
+    def _pack_idle(self):
+        """Pack least recently used live keys above max_live_keys"""
+        if self.max_live_keys is None:
+            return None
+
+        while len(self._live) > self.max_live_keys:
+            key, _ = self._live.popitem(last=False)
+            meta, arrays = self._streams[key]._state()
+            self._streams[key] = None
+            self._pending[key] = (meta, arrays)
+            self._resize(key, _packed_size(arrays))
+
+    def add(self, key: Hashable, point, ts: float = None):
+        """Add new data point to stream of key
+
+        :param key: stream key
+        :param point: data point
+        :param ts: point recieve timestamp, current time by default
+        """
+        if ts is None:
+            ts = time.time()
+
+        self._stream(key).add(point, ts)
+        self._touch([key], [ts])
+
+    def add_batch(self, keys, points, timestamps=None):
+        """Add chunk of (key, point, timestamp) records.
+        Records are grouped by key and every group goes to add_batch
+        of its structure in arrival order
+
+        :param keys: key of every point, array or sequence. Sequences
+            and object arrays are grouped as python objects, so keys of
+            different types (1 and '1') stay different
+        :param points: 1-d array of data points
+        :param timestamps: points recieve timestamps (array or scalar),
+            current time by default
+        :raises Exception: If points do not fit dtype, no key is changed then
+        """
+        if isinstance(keys, np.ndarray):
+            keys = keys.ravel()
+        else:
+            # np.asarray would coerce mixed keys to one type
+            keys = np.fromiter(keys, dtype=object, count=len(keys))
+        points = coerce_values(points, self.dtype)
+        if len(points) == 0:
+            return None
+
+        if timestamps is None:
+            timestamps = time.time()
+        timestamps = np.broadcast_to(
+            np.asarray(timestamps, dtype=float), points.shape
+        )
+
+        touched = []
+        last_seen = []
+        for key, indexes in _group(keys):
+            self._stream(key).add_batch(points[indexes], timestamps[indexes])
+            touched.append(key)
+            last_seen.append(timestamps[indexes[-1]])
+
+        self._touch(touched, last_seen)
+
+    def _touch(self, keys: List[Hashable], last_seen: List[float]):
+        """Update recency and memory of updated keys, evict if needed
+
+        :param keys: updated keys
+        :param last_seen: latest timestamp of every key
+        """
+        for key, ts in zip(keys, last_seen):
+            self._streams.move_to_end(key)
+            self._last_seen[key] = ts
+            self._resize(key, self._streams[key]._approximate_bytes())
+        self._pack_idle()
+
+        if self.memory_budget is None:
+            return None
+
+        # never evict the most recently updated key
+        while self._memory > self.memory_budget and len(self._streams) > 1:
+            self.remove(next(iter(self._streams)))
+            self.evicted += 1
+
+    def query(self, key: Hashable, q: float, n: int = None, window_seconds: float = None):
+        """Retrieve φ-quantile of key
+
+        :param key: stream key
+        :param q: φ-quantile
+        :param n: number of most recent points, see SW_n_of_N.query
+        :param window_seconds: time span, see SW_n_of_N.query
+        :return: calculated value
+        """
+        return self._existing(key).query(q, n, window_seconds)
+
+    def query_many(self, key: Hashable, qs, n: int = None, window_seconds: float = None) -> np.ndarray:
+        """Retrieve several φ-quantiles of key
+
+        :param key: stream key
+        :param qs: sequence of φ-quantiles
+        :param n: number of most recent points, see SW_n_of_N.query
+        :param window_seconds: time span, see SW_n_of_N.query
+        :return: calculated values in order of 'qs'
+        """
+        return self._existing(key).query_many(qs, n, window_seconds)
+
+    def rank_many(self, key: Hashable, points, n: int = None, window_seconds: float = None) -> np.ndarray:
+        """Estimate fraction of points of key not greater than given values
+
+        :param key: stream key
+        :param points: values to rank
+        :param n: number of most recent points, see SW_n_of_N.query
+        :param window_seconds: time span, see SW_n_of_N.query
+        :return: fractions in order of 'points'
+        """
+        return self._existing(key).rank_many(points, n, window_seconds)
+
+    def _existing(self, key: Hashable) -> SW_n_of_N:
+        """Get structure of known key
+
+        :param key: stream key
+        :raises KeyError: If key has no points
+        :return: SW n-of-N of key
+        """
+        if key not in self._streams:
+            raise KeyError(key)
+
+        stream = self._stream(key)
+        self._pack_idle()
+
+        return stream
+
+    def evict_idle(self, max_idle_seconds: float, now: float = None) -> int:
+        """Remove keys without points for given time
+
+        :param max_idle_seconds: allowed time since the latest point of key
+        :param now: current timestamp, current time by default
+        :return: number of removed keys
+        """
+        if now is None:
+            now = time.time()
+
+        idle = [
+            key for key, ts in self._last_seen.items()
+            if now - ts > max_idle_seconds
+        ]
+        for key in idle:
+            self.remove(key)
+        self.evicted += len(idle)
+
+        return len(idle)
+
+    def remove(self, key: Hashable):
+        """Drop structure of key
+
+        :param key: stream key
+        """
+        del self._streams[key]
+        self._pending.pop(key, None)
+        self._live.pop(key, None)
+        self._memory -= self._sizes.pop(key)
+        self._last_seen.pop(key, None)
+
+    def save(self, path: str) -> None:
+        """Write all keys to one binary checkpoint file,
+        keys should be JSON serializable (str or int)
+
+        :param path: file path
+        """
+        keys = []
+        states = []
+        arrays = {}
+        for i, (key, stream) in enumerate(self._streams.items()):
+            if key in self._pending:
+                meta, stream_arrays = self._pending[key]
+            else:
+                meta, stream_arrays = stream._state()
+            keys.append(key)
+            states.append(meta)
+            for name, array in stream_arrays.items():
+                arrays[f'{i}.{name}'] = array
+
+        meta = {
+            'n': self.n,
+            'epsilon': self.epsilon,
+            'mode': self.mode,
+            'window_seconds': self.window_seconds,
+            'memory_budget': self.memory_budget,
+            'backend': self.backend,
+            'dtype': str(self.dtype),
+            'max_tuples': self.max_tuples,
+            'max_live_keys': self.max_live_keys,
+            'keys': keys,
+            'states': states,
+            'last_seen': [self._last_seen.get(key) for key in keys]
+        }
+        save_checkpoint(path, 'SWRegistry', meta, arrays)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> 'SWRegistry':
+        """Restore registry from checkpoint file.
+        Structure of every key is built on its first use
+
+        :param path: file path
+        :param mmap: map file into memory, sketches then keep views
+            into the mapping until they are modified
+        :return: restored registry
+        """
+        meta, arrays = load_checkpoint(path, 'SWRegistry', mmap)
+        registry = cls(
+            n=meta['n'],
+            epsilon=meta['epsilon'],
+            mode=meta['mode'],
+            window_seconds=meta['window_seconds'],
+            memory_budget=meta['memory_budget'],
+            backend=meta.get('backend', GK_BACKEND),
+            dtype=meta.get('dtype', 'float64'),
+            max_tuples=meta.get('max_tuples'),
+            max_live_keys=meta.get('max_live_keys')
+        )
+
+        # arrays are named '<key index>.<array name>'
+        grouped = [{} for _ in meta['keys']]
+        for name, array in arrays.items():
+            index, array_name = name.split('.', 1)
+            grouped[int(index)][array_name] = array
+
+        items = zip(meta['keys'], meta['states'], meta['last_seen'], grouped)
+        for key, state, last_seen, stream_arrays in items:
+            registry._streams[key] = None
+            registry._pending[key] = (state, stream_arrays)
+            registry._sizes[key] = _packed_size(stream_arrays)
+            registry._memory += registry._sizes[key]
+            if last_seen is not None:
+                registry._last_seen[key] = last_seen
+
+        return registry
+
+    def stats(self) -> Dict[str, Any]:
+        """Registry statistics
+
+        :return: dictionary with number of keys, packed keys ('pending'),
+            evicted keys, buckets and tuples of live keys, approximate
+            memory (budget accounting) and memory_bytes (see memory_usage), lift_hits and lift_misses
+            of live keys (see SW_n_of_N.stats)
+        """
+        streams = [s for s in self._streams.values() if s is not None]
+        return {
+            'keys': len(self._streams),
+            'pending': len(self._pending),
+            'evicted': self.evicted,
+            'buckets': sum(len(s._ordered) for s in streams),
+            'tuples': sum(b.sketch.len() for s in streams for b in s._ordered),
+            'lift_hits': sum(s._lift_hits for s in streams),
+            'lift_misses': sum(s._lift_misses for s in streams),
+            'approximate_bytes': self._memory,
+            'memory_bytes': self.memory_usage()
+        }
+
+    def memory_usage(self) -> int:
+        """Deep size of registry and all structures
+
+        :return: bytes
+        """
+        return deep_sizeof(self)
+
+    def keys(self) -> List[Hashable]:
+        """Keys from least to most recently updated
+
+        :return: list of keys
+        """
+        return list(self._streams.keys())
+
+    @property
+    def memory(self) -> int:
+        """Approximate number of bytes used by all keys
+
+        :return: bytes
+        """
+        return self._memory
+
+    def __len__(self) -> int:
+        return len(self._streams)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._streams
+
+
+def _group(keys: np.ndarray) -> List[Tuple[Hashable, np.ndarray]]:
+    """Positions of every key in arrival order
+
+    :param keys: key of every point
+    :return: key and its positions, for every distinct key
+    """
+    if keys.dtype == object:
+        groups = {}
+        for i, key in enumerate(keys.tolist()):
+            groups.setdefault(key, []).append(i)
+
+        return [(key, np.array(indexes)) for key, indexes in groups.items()]
+
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    order = np.argsort(inverse, kind='stable')
+    ends = np.cumsum(np.bincount(inverse, minlength=len(unique_keys)))
+
+    return [
+        (key.item(), indexes)
+        for key, indexes in zip(unique_keys, np.split(order, ends[:-1]))
+    ]
+
+
+def _packed_size(arrays: Dict[str, np.ndarray]) -> int:
+    """Approximate bytes of packed SW n-of-N state
+
+    :param arrays: named arrays of state
+    :return: bytes
+    """
+    return sum(array.nbytes for array in arrays.values()) + STATE_OVERHEAD
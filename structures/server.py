@@ -0,0 +1,490 @@
+"""
+asyncio server around SWRegistry, to run keyed SW n-of-N as a sidecar process
+
+Protocols (one per listener):
+    'line'   - every request and response is one JSON object per line
+    'binary' - every frame is uint32 length (little-endian) and body,
+               body of request is uint32 header length, JSON header and,
+               for 'add', raw little-endian float64 points
+               (and the same number of float64 timestamps if header has
+               "timestamps": true), body of response is JSON
+
+Requests:
+    {"op": "add", "key": k, "points": [...], "timestamps": [...] | ts}
+    {"op": "query", "key": k, "qs": [...], "n": n, "window_seconds": w}
+    {"op": "rank", "key": k, "points": [...], "n": n, "window_seconds": w}
+    {"op": "flush"}
+    {"op": "stats"}
+Responses are {"ok": true, ...} or {"ok": false, "error": message},
+in request order of every connection.
+
+Points are not added one by one: they are coalesced per server and
+flushed as one registry add_batch when batch_size points are pending or
+flush_interval passes. Registry is touched only from one worker thread,
+so the event loop is not blocked by sketch maintenance and queries see
+the registry between flushes, never in the middle of one. Queries flush
+pending points first, so a connection reads its own writes. If more than
+max_pending points wait for flush, 'add' requests wait as well and the
+connection stops reading, which pushes back on clients.
+
+Keys are str or int ('add' with other keys is refused), 1 and "1" are
+different keys. If registry fails to add a flushed batch, its points are
+dropped and counted and the server keeps flushing later points. The next
+'flush' request answers with an error naming the points dropped since the
+previous 'flush' request (also by background flushes), 'stats' keeps the
+totals and the last error.
+
+Lines of line protocol are limited to max_line bytes, a longer request
+is answered with an error and skipped, the connection stays open.
+
+    python -m structures.server --port 7777 -n 10000 -e 0.01
+"""
+import argparse
+import asyncio
+import json
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Hashable, List
+import numpy as np
+from structures.registry import SWRegistry
+from structures.sw import SUFFIX_MODE, MODES
+from structures.sketches.backends import BACKENDS, GK_BACKEND
+from structures.sketches.sketch import VALUE_DTYPES, coerce_values
+
+LINE_PROTOCOL = 'line'
+BINARY_PROTOCOL = 'binary'
+PROTOCOLS = (LINE_PROTOCOL, BINARY_PROTOCOL)
+
+_LENGTH = struct.Struct('<I')
+# default limit of request line, 'add' of a million points fits
+MAX_LINE = 2 ** 25
+
+
+class SWServer():
+
+    def __init__(
+        self,
+        registry: SWRegistry,
+        batch_size: int = 10000,
+        max_pending: int = 100000,
+        flush_interval: float = 0.05,
+        max_line: int = MAX_LINE
+    ):
+        """Class constructor
+
+        :param registry: keyed structures to serve
+        :param batch_size: pending points that trigger flush
+        :param max_pending: pending points after which 'add' waits for flush
+        :param flush_interval: maximal seconds points wait for flush
+        :param max_line: limit of request line of line protocol in bytes
+        """
+        self.registry = registry
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.flush_interval = flush_interval
+        self.max_line = max_line
+
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._keys: List[Hashable] = []
+        self._points: List[np.ndarray] = []
+        self._timestamps: List[np.ndarray] = []
+        self._pending = 0
+        self._flush_needed = None
+        self._drained = None
+        self._flusher = None
+        self._servers = []
+        # points of batches registry failed to add
+        self.dropped = 0
+        self.flush_errors = 0
+        self.last_flush_error = None
+        # dropped points not reported by 'flush' request yet
+        self._unreported = 0
+
+    async def start(
+        self,
+        host: str = None,
+        port: int = None,
+        path: str = None,
+        protocol: str = LINE_PROTOCOL
+    ) -> asyncio.AbstractServer:
+        """Start listening on TCP host/port or Unix socket path.
+        Can be called several times for several listeners
+
+        :param host: TCP host
+        :param port: TCP port
+        :param path: Unix socket path, used instead of host and port if set
+        :param protocol: 'line' or 'binary'
+        :raises Exception: If protocol is unknown
+        :return: asyncio server
+        """
+        if protocol not in PROTOCOLS:
+            raise Exception(
+                f'Protocol should be one of {PROTOCOLS}. Got {protocol}.'
+            )
+
+        if self._flusher is None:
+            self._flush_needed = asyncio.Event()
+            self._drained = asyncio.Event()
+            self._drained.set()
+            self._flusher = asyncio.ensure_future(self._flush_loop())
+
+        if protocol == LINE_PROTOCOL:
+            handler = self._serve_lines
+        else:
+            handler = self._serve_frames
+
+        # binary frames are read by length, limit bounds request lines only
+        if path is not None:
+            server = await asyncio.start_unix_server(handler, path=path, limit=self.max_line)
+        else:
+            server = await asyncio.start_server(
+                handler, host=host, port=port, limit=self.max_line
+            )
+        self._servers.append(server)
+
+        return server
+
+    async def close(self) -> None:
+        """Stop listeners, flush pending points and stop worker
+        """
+        for server in self._servers:
+            server.close()
+            await server.wait_closed()
+        self._servers = []
+
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        await self.flush()
+        self._executor.shutdown(wait=True)
+
+    async def _serve_lines(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Handle connection of line protocol
+
+        :param reader: connection reader
+        :param writer: connection writer
+        """
+        try:
+            while True:
+                try:
+                    line = await reader.readuntil(b'\n')
+                except asyncio.IncompleteReadError as e:
+                    # connection is closed, the last line may lack newline
+                    line = e.partial
+                    if not line:
+                        break
+                except asyncio.LimitOverrunError as e:
+                    if not await _skip_line(reader, e.consumed):
+                        break
+                    line = None
+                if line is not None and not line.strip():
+                    continue
+
+                if line is None:
+                    response = {
+                        'ok': False,
+                        'error': f'Request line is longer than {self.max_line} bytes'
+                    }
+                else:
+                    try:
+                        response = await self.handle(json.loads(line))
+                    except Exception as e:
+                        response = {'ok': False, 'error': str(e)}
+
+                writer.write(json.dumps(response).encode('utf-8') + b'\n')
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def _serve_frames(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Handle connection of binary length-prefixed protocol
+
+        :param reader: connection reader
+        :param writer: connection writer
+        """
+        try:
+            while True:
+                try:
+                    prefix = await reader.readexactly(_LENGTH.size)
+                except asyncio.IncompleteReadError:
+                    break
+                body = await reader.readexactly(_LENGTH.unpack(prefix)[0])
+
+                try:
+                    response = await self.handle(*decode_frame(body))
+                except Exception as e:
+                    response = {'ok': False, 'error': str(e)}
+
+                writer.write(encode_frame(response))
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def handle(self, request: Dict[str, Any], points: np.ndarray = None) -> Dict[str, Any]:
+        """Execute one request
+
+        :param request: decoded request
+        :param points: points of binary 'add' request
+        :raises Exception: If operation is unknown
+        :return: response
+        """
+        op = request.get('op')
+        if op == 'add':
+            if points is None:
+                points = request['points']
+                timestamps = request.get('timestamps')
+            elif request.get('timestamps'):
+                # binary payload keeps timestamps after points
+                if len(points) % 2 != 0:
+                    raise Exception(
+                        f'Payload with timestamps should have even number of values. Got {len(points)}.'
+                    )
+                half = len(points) // 2
+                points, timestamps = points[:half], points[half:]
+            else:
+                timestamps = None
+            accepted = await self.add(request['key'], points, timestamps)
+            return {'ok': True, 'accepted': accepted}
+
+        if op == 'query':
+            values = await self._run(
+                self.registry.query_many, request['key'], request['qs'],
+                request.get('n'), request.get('window_seconds')
+            )
+            return {'ok': True, 'values': values.tolist()}
+
+        if op == 'rank':
+            ranks = await self._run(
+                self.registry.rank_many, request['key'], request['points'],
+                request.get('n'), request.get('window_seconds')
+            )
+            return {'ok': True, 'ranks': ranks.tolist()}
+
+        if op == 'flush':
+            await self.flush()
+            dropped, self._unreported = self._unreported, 0
+            if dropped > 0:
+                return {
+                    'ok': False,
+                    'error': f'{dropped} points dropped: {self.last_flush_error}'
+                }
+            return {'ok': True}
+
+        if op == 'stats':
+            stats = await self._run(self.registry.stats)
+            stats['dropped'] = self.dropped
+            stats['flush_errors'] = self.flush_errors
+            stats['last_flush_error'] = self.last_flush_error
+            return {'ok': True, 'stats': stats}
+
+        raise Exception(f'Unknown operation {op}')
+
+    async def add(self, key: Hashable, points, timestamps=None) -> int:
+        """Queue points of key for the next flush, waits while
+        too many points are pending
+
+        :param key: stream key, str or int
+        :param points: data points
+        :param timestamps: points timestamps (sequence or scalar),
+            time of arrival by default
+        :raises Exception: If key is not str or int, or points
+            do not fit dtype of registry
+        :return: number of queued points
+        """
+        # bool is int, but true and 1 would be one key
+        if not isinstance(key, (str, int)) or isinstance(key, bool):
+            raise Exception(
+                f'Key should be str or int. Got {type(key).__name__}.'
+            )
+        points = coerce_values(points, self.registry.dtype)
+        if timestamps is None:
+            timestamps = time.time()
+        timestamps = np.broadcast_to(
+            np.asarray(timestamps, dtype=np.float64), points.shape
+        )
+
+        while self._pending >= self.max_pending:
+            # drained could be set by flush of older points
+            self._drained.clear()
+            self._flush_needed.set()
+            await self._drained.wait()
+
+        self._keys.append(key)
+        self._points.append(points)
+        self._timestamps.append(timestamps)
+        self._pending += len(points)
+
+        if self._pending >= self.batch_size:
+            self._flush_needed.set()
+
+        return len(points)
+
+    async def flush(self) -> int:
+        """Add all pending points to registry as one batch.
+        If registry fails, points of the batch are dropped
+
+        :return: number of dropped points
+        """
+        if self._pending == 0:
+            return 0
+
+        keys, points, timestamps = self._keys, self._points, self._timestamps
+        self._keys, self._points, self._timestamps = [], [], []
+        pending, self._pending = self._pending, 0
+
+        counts = [len(chunk) for chunk in points]
+        # object array keeps keys as they are, np.asarray would make 1 and '1' equal
+        key_column = np.repeat(np.fromiter(keys, dtype=object, count=len(keys)), counts)
+        try:
+            await self._call(
+                self.registry.add_batch,
+                key_column,
+                np.concatenate(points),
+                np.concatenate(timestamps)
+            )
+        except Exception as e:
+            self.dropped += pending
+            self._unreported += pending
+            self.flush_errors += 1
+            self.last_flush_error = f'{type(e).__name__}: {e}'
+            return pending
+        finally:
+            # waiting 'add' requests go on even if batch is lost
+            self._drained.set()
+
+        return 0
+
+    async def _flush_loop(self) -> None:
+        """Flush when batch is full or interval passes
+        """
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_needed.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_needed.clear()
+            await self.flush()
+
+    async def _run(self, function, *args):
+        """Run registry call in worker thread after pending points
+
+        :param function: registry method
+        :return: result of call
+        """
+        await self.flush()
+        return await self._call(function, *args)
+
+    async def _call(self, function, *args):
+        """Run registry call in worker thread
+
+        :param function: registry method
+        :return: result of call
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, function, *args)
+
+
+async def _skip_line(reader: asyncio.StreamReader, consumed: int) -> bool:
+    """Drop the rest of a line longer than reader limit
+
+    :param reader: connection reader
+    :param consumed: bytes of the line already in reader buffer
+    :return: False if connection was closed before the end of line
+    """
+    while True:
+        try:
+            await reader.readexactly(consumed)
+            await reader.readuntil(b'\n')
+            return True
+        except asyncio.LimitOverrunError as e:
+            consumed = e.consumed
+        except asyncio.IncompleteReadError:
+            return False
+
+
+def encode_frame(message: Dict[str, Any], points: np.ndarray = None) -> bytes:
+    """Frame of binary protocol
+
+    :param message: JSON header
+    :param points: float64 payload (points, then timestamps if any)
+    :return: length-prefixed frame
+    """
+    header = json.dumps(message).encode('utf-8')
+    payload = b'' if points is None else np.asarray(points, dtype='<f8').tobytes()
+    body = _LENGTH.pack(len(header)) + header + payload
+
+    return _LENGTH.pack(len(body)) + body
+
+
+def decode_frame(body: bytes):
+    """Split frame body into JSON header and float64 payload
+
+    :param body: frame without length prefix
+    :return: header and points (None if frame has no payload)
+    """
+    size = _LENGTH.unpack_from(body)[0]
+    start = _LENGTH.size
+    header = json.loads(body[start:start + size].decode('utf-8'))
+    payload = body[start + size:]
+    points = np.frombuffer(payload, dtype='<f8') if payload else None
+
+    return header, points
+
+
+async def _main(args):
+    registry = SWRegistry(
+        n=args.number,
+        epsilon=args.epsilon,
+        mode=args.mode,
+        window_seconds=args.window_seconds,
+        memory_budget=args.memory_budget,
+        backend=args.backend,
+        dtype=args.dtype,
+        max_tuples=args.max_tuples
+    )
+    server = SWServer(
+        registry,
+        batch_size=args.batch_size,
+        max_pending=args.max_pending,
+        flush_interval=args.flush_interval,
+        max_line=args.max_line
+    )
+    if args.unix is not None:
+        await server.start(path=args.unix, protocol=args.protocol)
+    else:
+        await server.start(host=args.host, port=args.port, protocol=args.protocol)
+
+    print(f'Serving {args.protocol} protocol on {args.unix or f"{args.host}:{args.port}"}')
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Serve keyed SW n-of-N structures'
+    )
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='TCP host')
+    parser.add_argument('--port', type=int, default=7777, help='TCP port')
+    parser.add_argument('--unix', type=str, default=None, help='Unix socket path instead of TCP')
+    parser.add_argument('--protocol', choices=PROTOCOLS, default=LINE_PROTOCOL, help='Wire protocol')
+    parser.add_argument('-n', '--number', type=int, default=10000, help='Window N of every key')
+    parser.add_argument('-e', '--epsilon', type=float, default=0.01, help='Approximation coefficient')
+    parser.add_argument('--mode', choices=MODES, default=SUFFIX_MODE, help='SW ingestion engine')
+    parser.add_argument('--backend', choices=tuple(BACKENDS), default=GK_BACKEND, help='Sketch of buckets')
+    parser.add_argument('--dtype', choices=[str(t) for t in VALUE_DTYPES], default='float64', help='Dtype of stored values')
+    parser.add_argument('--window-seconds', type=float, default=None, help='Time window of every key')
+    parser.add_argument('--memory-budget', type=int, default=None, help='Approximate bytes for all keys')
+    parser.add_argument('--max-tuples', type=int, default=None, help='Sketch tuples of every key, coarsens epsilon')
+    parser.add_argument('--batch-size', type=int, default=10000, help='Pending points that trigger flush')
+    parser.add_argument('--max-pending', type=int, default=100000, help='Pending points that block ingest')
+    parser.add_argument('--flush-interval', type=float, default=0.05, help='Seconds between flushes')
+    parser.add_argument('--max-line', type=int, default=MAX_LINE, help='Bytes of request line of line protocol')
+
+    args = parser.parse_args()
+    try:
+        asyncio.run(_main(args))
+    except KeyboardInterrupt:
+        pass
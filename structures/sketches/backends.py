@@ -0,0 +1,25 @@
+"""
+Sketch backends of buckets
+
+    'gk'       - GK tuples with deterministic rank error (default)
+    'kll'      - KLL-style compactors, estimated ranks, size ~ 3/epsilon
+    'ddsketch' - log buckets, relative value error epsilon
+
+Every backend keeps value-ordered (value, gap, delta) columns, so LIFT,
+queries, rank estimates and checkpoints work the same way for all of them.
+Backends with rank_bounds = False give rank estimates instead of bounds.
+"""
+
+from structures.sketches.sketch import Sketch
+from structures.sketches.kll import KLLSketch
+from structures.sketches.ddsketch import DDSketch
+
+GK_BACKEND = 'gk'
+KLL_BACKEND = 'kll'
+DDSKETCH_BACKEND = 'ddsketch'
+
+BACKENDS = {
+    GK_BACKEND: Sketch,
+    KLL_BACKEND: KLLSketch,
+    DDSKETCH_BACKEND: DDSketch
+}
@@ -0,0 +1,186 @@
+"""
+Log-bucketed sketch with relative value error (DDSketch-style)
+
+Value v is counted in bucket k = ⌈log_γ |v|⌉, γ = (1 + α) / (1 - α),
+represented by sign(v) * 2γ^k / (γ + 1), which is within relative
+distance α of every value of the bucket. Buckets are kept in the same
+value-ordered columns as GK tuples, the gap column holds counts and
+deltas are zero, so rmin = rmax = cumsum of counts. Merge sums counts
+of equal buckets, size depends on the range of values
+(about log_γ(max / min) buckets per sign), not on the number of points.
+
+The error is relative to the value, not to the rank: an answer is
+within α of a point of requested rank. Values closer to zero than
+MIN_VALUE share the zero bucket. Representatives computed by scalar
+and vectorized math or stored as float32 can differ in the last bits,
+so representatives closer than SAME_BUCKET (relative) are one bucket.
+Representatives of integer values are rounded, buckets that round to
+the same integer are one bucket. Above MAX_BUCKETS buckets the lowest
+ones are collapsed, as in DDSketch collapsing store.
+"""
+
+import math
+from structures.sketches.sketch import Sketch, DEFAULT_CAPACITY
+from typing import List, Tuple
+import numpy as np
+
+MIN_VALUE = 1e-9
+MAX_BUCKETS = 2048
+SAME_BUCKET = 1e-6
+
+
+class DDSketch(Sketch):
+    __slots__ = ('gamma', '_log_gamma', '_integral')
+    rank_bounds = False
+
+    def __init__(
+        self,
+        epsilon: float,
+        capacity: int = DEFAULT_CAPACITY,
+        dtype=np.float64,
+        rank_dtype=np.int64
+    ) -> None:
+        """Class constructor
+
+        :param epsilon: relative accuracy α of values, in (0, 1)
+        :param capacity: initial number of preallocated buckets
+        :param dtype: dtype of values, representatives are rounded
+            for integer dtypes
+        :param rank_dtype: integer dtype of counts
+        :raises Exception: If epsilon not in (0, 1)
+        """
+        if epsilon <= 0 or epsilon >= 1:
+            raise Exception(
+                f'Relative accuracy should be in (0, 1). Got {epsilon}.'
+            )
+
+        super().__init__(epsilon, capacity, dtype, rank_dtype)
+        self.gamma = (1 + epsilon) / (1 - epsilon)
+        self._log_gamma = np.log(self.gamma)
+        self._integral = self.values.dtype.kind == 'i'
+
+    def _representatives(self, points) -> np.ndarray:
+        """Representative value of bucket of every point,
+        non-decreasing in point
+
+        :param points: data points
+        :return: representatives
+        """
+        points = np.asarray(points, dtype=np.float64)
+        magnitudes = np.abs(points)
+        small = magnitudes < MIN_VALUE
+        keys = np.ceil(np.log(np.where(small, 1, magnitudes)) / self._log_gamma)
+        representatives = np.sign(points) * 2 * self.gamma ** keys / (self.gamma + 1)
+        if self._integral:
+            representatives = np.rint(representatives)
+
+        return np.where(small, 0, representatives)
+
+    def add(
+        self,
+        point,
+        nb: int
+    ) -> None:
+        """Count point in its bucket
+
+        :param point: data point
+        :param nb: number of seen points in bucket (not used)
+        """
+        magnitude = abs(point)
+        value = 0.0
+        if magnitude >= MIN_VALUE:
+            key = math.ceil(math.log(magnitude) / self._log_gamma)
+            value = math.copysign(2 * self.gamma ** key / (self.gamma + 1), point)
+            if self._integral:
+                value = float(round(value))
+
+        size = self.size
+        index = int(np.searchsorted(self.values[:size], value))
+        # bucket is the closest representative on either side
+        for i in (index - 1, index):
+            if 0 <= i < size and abs(self.values[i] - value) <= SAME_BUCKET * abs(value):
+                self.gaps[i] += 1
+                self.version += 1
+                return None
+
+        self._insert(value, 0)
+
+    def add_batch(
+        self,
+        points,
+        nb: int
+    ) -> None:
+        """Count batch of points in their buckets
+
+        :param points: data points
+        :param nb: number of seen points in bucket (not used)
+        """
+        if len(points) == 0:
+            return None
+
+        values, counts = np.unique(self._representatives(points), return_counts=True)
+        self._replace(*_combine(
+            [self.values[:self.size], values], [self.gaps[:self.size], counts]
+        ))
+
+    @classmethod
+    def merge_all(
+        cls,
+        sketches: List['DDSketch']
+    ) -> 'DDSketch':
+        """Merge sketches with the same accuracy by summing
+        counts of equal buckets
+
+        :param sketches: sketches to merge, at least one
+        :return: new sketch with epsilon and dtypes of the first sketch
+        """
+        first = sketches[0]
+        sketches = [s for s in sketches if s.size > 0]
+        if len(sketches) == 0:
+            return first._empty()
+
+        columns = _combine(
+            [s.values[:s.size] for s in sketches],
+            [s.gaps[:s.size] for s in sketches]
+        )
+        sketch = first._empty(len(columns[0]))
+        sketch._replace(*columns)
+
+        return sketch
+
+    def compress(self, nb) -> None:
+        """Collapse the lowest buckets into one if there are too many
+
+        :param nb: number of seen points in bucket (not used)
+        """
+        excess = self.size - MAX_BUCKETS
+        if excess <= 0:
+            return None
+
+        values, gaps, deltas = self._columns()
+        gaps = gaps[excess:].copy()
+        gaps[0] += self.gaps[:excess].sum()
+        self._replace(values[excess:].copy(), gaps, deltas[excess:].copy())
+
+
+def _combine(
+    values: List[np.ndarray],
+    counts: List[np.ndarray]
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Sum counts of representatives of the same bucket
+
+    :param values: representatives of every part
+    :param counts: counts of every part
+    :return: values, gaps and deltas columns
+    """
+    values = np.concatenate(values)
+    counts = np.concatenate(counts)
+    order = np.argsort(values, kind='stable')
+    values = values[order]
+    counts = counts[order]
+
+    starts = np.flatnonzero(np.concatenate((
+        [True], np.diff(values) > SAME_BUCKET * np.abs(values[1:])
+    )))
+
+    return values[starts], np.add.reduceat(counts, starts), np.zeros(len(starts), dtype=counts.dtype)
@@ -0,0 +1,141 @@
+"""
+KLL-style compactor sketch
+
+Every stored item has weight 2^h, where h is its compactor level. Items are
+kept in the same value-ordered columns as GK tuples, the gap column holds
+the weight and deltas are zero, so rmin = rmax = cumsum of weights is
+the estimated rank. When level h holds more items than its capacity
+k * (2/3)^(H - 1 - h) (H is number of levels), its items are paired in
+value order, one item of every pair is promoted to level h + 1 with
+doubled weight and the other one is dropped. Total size stays about 3k
+whatever the number of points.
+
+Pairs are split with alternating offset instead of a random coin, so
+results are reproducible and errors of consecutive compactions cancel.
+"""
+
+from structures.sketches.sketch import Sketch, DEFAULT_CAPACITY
+from typing import List
+import numpy as np
+
+MIN_LEVEL_CAPACITY = 2
+CAPACITY_DECAY = 2 / 3
+
+
+class KLLSketch(Sketch):
+    __slots__ = ('k', 'compactions')
+    rank_bounds = False
+
+    def __init__(
+        self,
+        epsilon: float,
+        capacity: int = DEFAULT_CAPACITY,
+        dtype=np.float64,
+        rank_dtype=np.int64
+    ) -> None:
+        """Class constructor
+
+        :param epsilon: target rank error, capacity of the top level is ⌈1/epsilon⌉
+        :param capacity: initial number of preallocated items
+        :param dtype: dtype of values
+        :param rank_dtype: integer dtype of weights
+        """
+        super().__init__(epsilon, capacity, dtype, rank_dtype)
+        self.k = max(int(np.ceil(1 / epsilon)), MIN_LEVEL_CAPACITY)
+        self.compactions = 0
+
+    def add(
+        self,
+        point,
+        nb: int
+    ) -> None:
+        """Put point with weight 1 to level 0
+
+        :param point: data point
+        :param nb: number of seen points in bucket (not used)
+        """
+        # items never carry rank uncertainty
+        super().add(point, 0)
+
+    def add_batch(
+        self,
+        points,
+        nb: int
+    ) -> None:
+        """Put sorted batch of points with weight 1 to level 0
+
+        :param points: sorted data points
+        :param nb: number of seen points in bucket (not used)
+        """
+        super().add_batch(points, 0)
+
+    @classmethod
+    def merge_all(
+        cls,
+        sketches: List['KLLSketch']
+    ) -> 'KLLSketch':
+        """Merge sketches over disjoint sets of points: items of all
+        sketches keep their levels, overfull levels are compacted
+        by the next compress
+
+        :param sketches: sketches to merge, at least one
+        :return: new sketch with epsilon and dtypes of the first sketch
+        """
+        first = sketches[0]
+        for s in sketches:
+            s.flush()
+        sketches = [s for s in sketches if s.size > 0]
+        if len(sketches) == 0:
+            return first._empty()
+
+        values = np.concatenate([s.values[:s.size] for s in sketches])
+        gaps = np.concatenate([s.gaps[:s.size] for s in sketches])
+        order = np.argsort(values, kind='stable')
+
+        sketch = first._empty(len(values))
+        sketch._replace(values[order], gaps[order], np.zeros(len(values), dtype=gaps.dtype))
+
+        return sketch
+
+    def compress(self, nb) -> None:
+        """Compact the lowest overfull level until all levels fit
+
+        :param nb: number of seen points in bucket (not used)
+        """
+        self.flush()
+        while self.size > MIN_LEVEL_CAPACITY:
+            # weights are powers of two, exponent is the level
+            levels = np.frexp(self.gaps[:self.size])[1] - 1
+            counts = np.bincount(levels)
+            height = len(counts)
+            capacities = np.maximum(
+                np.ceil(self.k * CAPACITY_DECAY ** np.arange(height - 1, -1, -1)),
+                MIN_LEVEL_CAPACITY
+            )
+            full = np.flatnonzero(counts > capacities)
+            if len(full) == 0:
+                break
+            self._compact(levels, full[0])
+
+    def _compact(
+        self,
+        levels: np.ndarray,
+        level: int
+    ) -> None:
+        """Promote every other item of level, drop the rest.
+        With odd number of items the largest one stays
+
+        :param levels: level of every item
+        :param level: level to compact
+        """
+        members = np.flatnonzero(levels == level)
+        members = members[:len(members) // 2 * 2]
+        offset = self.compactions % 2
+        self.compactions += 1
+
+        values, gaps, deltas = self._columns()
+        gaps = gaps.copy()
+        gaps[members[offset::2]] *= 2
+        keep = np.ones(self.size, dtype=bool)
+        keep[members[1 - offset::2]] = False
+        self._replace(values[keep], gaps[keep], deltas[keep])
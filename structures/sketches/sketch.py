@@ -2,25 +2,222 @@
 Sketch that contains information about Summaries in batch
 Actually, this is another GK implementation, but more or less
 connected with other classes
+
+Tuples (value_i, gap_i, delta_i) are stored column-wise in parallel
+numpy buffers with spare capacity, ordered by value. Values have one of
+VALUE_DTYPES, gaps and deltas are integers (delta = ⌊2εn⌋ as in GK01)
+
+While points arrive one by one, a small sketch keeps its tuples in three
+python lists instead: a bisect insert and a compress pass over a few dozen
+tuples are much cheaper in pure python than the same number of small numpy
+calls. Lists are written back to the columns (flush) before the columns are
+read (ranks, merges, copies, checkpoints) or when the sketch grows
 """
 
 from structures.summaries.summary import Summary
-from structures.summaries.summary_nn import SummaryNn
+from typing import List, Tuple
 import bisect
-from typing import List
 import numpy as np
 
+# buffers of new sketches, single points are inserted into python lists
+# first (see LIST_CAPACITY), so small buffers cost no add throughput and
+# keep keys with few points small (SWRegistry)
+DEFAULT_CAPACITY = 2
+# sketches with more tuples keep them in numpy columns between adds. A tuple
+# in lists takes about 5x the bytes of a tuple in columns (python float, int
+# objects and list slots), compress writes lists back to the columns, so the
+# lists only hold points added since the last compress and small sketches
+LIST_CAPACITY = 64
+VALUE_DTYPES = tuple(np.dtype(t) for t in (np.float32, np.float64, np.int32, np.int64))
+
+
+def coerce_values(points, dtype) -> np.ndarray:
+    """Validate points and convert them to value dtype of sketches,
+    without copy if they already have it
+
+    :param points: data point or sequence of data points
+    :param dtype: one of VALUE_DTYPES
+    :raises Exception: If dtype is not supported, points are not numeric,
+        not finite or do not fit into integer dtype
+    :return: 1-d array of dtype
+    """
+    dtype = np.dtype(dtype)
+    if dtype not in VALUE_DTYPES:
+        raise Exception(
+            f'Value dtype should be one of {[str(t) for t in VALUE_DTYPES]}. Got {dtype}.'
+        )
+
+    points = np.asarray(points).ravel()
+    if points.dtype.kind not in 'iuf':
+        raise Exception(f'Points should be numeric. Got {points.dtype}.')
+    if points.dtype == dtype and dtype.kind == 'i':
+        return points
+
+    if dtype.kind == 'i' and len(points) > 0:
+        info = np.iinfo(dtype)
+        if points.dtype.kind == 'f' and not np.array_equal(points, np.floor(points)):
+            raise Exception(f'Points should be integers for {dtype}.')
+        if points.min() < info.min or points.max() > info.max:
+            raise Exception(f'Points should be in [{info.min}, {info.max}] for {dtype}.')
+
+    # NaN breaks value order, float32 overflows to inf
+    with np.errstate(over='ignore'):
+        points = points.astype(dtype, copy=False)
+    if dtype.kind == 'f' and not np.isfinite(points).all():
+        raise Exception(f'Points should be finite {dtype} numbers.')
+
+    return points
+
+
+def coerce_value(point, dtype):
+    """Validate one point and convert it to value dtype of sketches,
+    scalar counterpart of coerce_values for per-point adds
+
+    :param point: data point
+    :param dtype: one of VALUE_DTYPES
+    :raises Exception: If point is not finite or does not fit into integer dtype
+    :return: python number with exact value of dtype, it is stored in lists
+        of sketches without boxing into numpy scalar
+    """
+    try:
+        value = dtype.type(point)
+    except (TypeError, ValueError, OverflowError):
+        raise Exception(f'Point should be a {dtype} number. Got {point!r}.')
+
+    if dtype.kind == 'f':
+        if not np.isfinite(value):
+            raise Exception(f'Points should be finite {dtype} numbers.')
+    elif value != point:
+        raise Exception(f'Point should be a {dtype} number. Got {point!r}.')
+
+    return value.item()
+
+
+def _bands(deltas: np.ndarray, p: int) -> np.ndarray:
+    """GK band of every delta for p = floor(2 * epsilon * n).
+    Band 0 is delta = p, band a >= 1 is
+    p - 2^a - (p mod 2^a) < delta <= p - 2^(a-1) - (p mod 2^(a-1)),
+    older tuples (smaller delta) get higher bands
+
+    :param deltas: deltas of tuples
+    :param p: current error capacity
+    :return: band of every tuple
+    """
+    deltas = np.floor(deltas)
+    bands = np.zeros(len(deltas), dtype=np.int64)
+    a = 1
+    while True:
+        upper = p - 2 ** (a - 1) - p % 2 ** (a - 1)
+        lower = p - 2 ** a - p % 2 ** a
+        bands[(lower < deltas) & (deltas <= upper)] = a
+        if lower < 0:
+            break
+        a += 1
+
+    return bands
+
+
+def _band(delta: int, p: int) -> int:
+    """Scalar counterpart of _bands for tuples kept in lists.
+    Lower end of band a is 2^a * (p // 2^a - 1), so band a is the smallest
+    one with (p >> a) - ((delta - 1) >> a) <= 1. Above the highest bit
+    where p and delta - 1 differ this always holds, below it p has to be
+    all zeros and delta - 1 all ones
+
+    :param delta: delta of tuple
+    :param p: current error capacity
+    :return: band of tuple
+    """
+    if delta >= p:
+        return 0
+    if delta == 0:
+        return max(1, p.bit_length())
+
+    e = delta - 1
+    mask = (1 << ((p ^ e).bit_length() - 1)) - 1
+
+    return max(1, (p & mask).bit_length(), (~e & mask).bit_length())
+
+
 class Sketch():
+    __slots__ = (
+        'epsilon', 'size', 'version', '_ranks', '_ranks_version',
+        'values', 'gaps', 'deltas', '_lists', 'list_capacity'
+    )
+    # rmin and rmax are guaranteed rank bounds (not estimates)
+    rank_bounds = True
+
     def __init__(
         self,
-        epsilon: float
+        epsilon: float,
+        capacity: int = DEFAULT_CAPACITY,
+        dtype=np.float64,
+        rank_dtype=np.int64
     ) -> None:
         """Class constructor
 
         :param epsilon: possible rank error
+        :param capacity: initial number of preallocated tuples
+        :param dtype: dtype of values, one of VALUE_DTYPES
+        :param rank_dtype: integer dtype of gaps and deltas
         """
-        self.summaries: List[Summary] = []
         self.epsilon = epsilon
+        self.size = 0
+        # modification counter, changes whenever tuples change
+        self.version = 0
+        # prefix ranks, rebuilt lazily when version changes
+        self._ranks = None
+        self._ranks_version = -1
+        self.values = np.empty(capacity, dtype=dtype)
+        self.gaps = np.empty(capacity, dtype=rank_dtype)
+        self.deltas = np.empty(capacity, dtype=rank_dtype)
+        # values, gaps and deltas lists while points are added one by one,
+        # None when tuples are in the columns
+        self._lists = None
+        # sketches with more tuples insert single points into the columns
+        self.list_capacity = LIST_CAPACITY
+
+    @classmethod
+    def from_columns(
+        cls,
+        epsilon: float,
+        values: np.ndarray,
+        gaps: np.ndarray,
+        deltas: np.ndarray
+    ) -> 'Sketch':
+        """Wrap existing columns without copying them,
+        buffers are reallocated on the first insert.
+        Dtypes of the sketch are dtypes of values and gaps
+
+        :param epsilon: possible rank error
+        :param values: ordered values column
+        :param gaps: gaps column
+        :param deltas: deltas column
+        :return: sketch over given columns
+        """
+        sketch = cls(epsilon, capacity=0, dtype=values.dtype, rank_dtype=gaps.dtype)
+        sketch.values = values
+        sketch.gaps = gaps
+        sketch.deltas = deltas
+        sketch.size = len(values)
+
+        return sketch
+
+    def _reserve(self, extra: int) -> None:
+        """Grow buffers so that 'extra' more tuples fit
+
+        :param extra: number of tuples to be inserted
+        """
+        capacity = len(self.values)
+        if self.size + extra <= capacity:
+            return
+
+        capacity = max(2 * capacity, self.size + extra, DEFAULT_CAPACITY)
+        for name in ('values', 'gaps', 'deltas'):
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
 
     def add(
         self,
@@ -32,109 +229,390 @@ class Sketch():
         :param point: data point
         :param nb: number of seen points in bucket
         """
-        delta = 2 * self.epsilon * nb
-        new_summary = Summary(point, delta)
+        if self._lists is None:
+            if self.size >= self.list_capacity:
+                self._insert(point, nb)
+                return
+            self._lists = (
+                self.values[:self.size].tolist(),
+                self.gaps[:self.size].tolist(),
+                self.deltas[:self.size].tolist()
+            )
+        values, gaps, deltas = self._lists
+
+        # find place for new summary in ordered list
+        insert_index = bisect.bisect_right(values, point)
+
+        # points outside of current range have exact rank
+        delta = int(2 * self.epsilon * nb)
+        if insert_index == 0 or insert_index == len(values):
+            delta = 0
+
+        values.insert(insert_index, point)
+        gaps.insert(insert_index, 1)
+        deltas.insert(insert_index, delta)
+        self.version += 1
+
+        if len(values) > self.list_capacity:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write tuples kept in lists to the columns"""
+        if self._lists is None:
+            return
+
+        values, gaps, deltas = self._lists
+        self._lists = None
+        self._replace(
+            np.array(values, dtype=self.values.dtype),
+            np.array(gaps, dtype=self.gaps.dtype),
+            np.array(deltas, dtype=self.deltas.dtype)
+        )
+
+    def _insert(
+        self,
+        point,
+        nb: int
+    ) -> None:
+        """Put summary of point in right order immediately
+
+        :param point: data point
+        :param nb: number of seen points in bucket
+        """
+        self.flush()
+        self._reserve(1)
+        size = self.size
+
+        # find place for new summary in ordered buffer
+        insert_index = int(np.searchsorted(
+            self.values[:size], point, side='right'
+        ))
+
+        # points outside of current range have exact rank
+        delta = int(2 * self.epsilon * nb)
+        if insert_index == 0 or insert_index == size:
+            delta = 0
+
+        # shift tail by one
+        for column in (self.values, self.gaps, self.deltas):
+            column[insert_index + 1:size + 1] = column[insert_index:size]
+
+        self.values[insert_index] = point
+        self.gaps[insert_index] = 1
+        self.deltas[insert_index] = delta
+        self.size += 1
+        self.version += 1
+
+    def add_batch(
+        self,
+        points,
+        nb: int
+    ) -> None:
+        """Merge sorted batch of points into summaries in one pass
+
+        :param points: sorted data points
+        :param nb: number of seen points in bucket before the batch
+        """
+        if len(points) == 0:
+            return
+
+        self.flush()
+
+        size = self.size
+        positions = np.searchsorted(self.values[:size], points, side='right')
+
+        # points outside of current range have exact rank
+        deltas = np.full(len(points), int(2 * self.epsilon * nb), dtype=self.deltas.dtype)
+        deltas[(positions == 0) | (positions == size)] = 0
+
+        values = np.insert(self.values[:size], positions, points)
+        gaps = np.insert(self.gaps[:size], positions, 1)
+        deltas = np.insert(self.deltas[:size], positions, deltas)
+        self._replace(values, gaps, deltas)
+
+    def _replace(
+        self,
+        values: np.ndarray,
+        gaps: np.ndarray,
+        deltas: np.ndarray
+    ) -> None:
+        """Replace content of buffers keeping spare capacity
+
+        :param values: new values column
+        :param gaps: new gaps column
+        :param deltas: new deltas column
+        """
+        self.size = 0
+        # batches leave large buffers behind, give spare capacity back
+        if 4 * len(values) < len(self.values):
+            capacity = max(2 * len(values), DEFAULT_CAPACITY)
+            for name in ('values', 'gaps', 'deltas'):
+                setattr(self, name, np.empty(capacity, dtype=getattr(self, name).dtype))
+        self._reserve(len(values))
+        self.values[:len(values)] = values
+        self.gaps[:len(values)] = gaps
+        self.deltas[:len(values)] = deltas
+        self.size = len(values)
+        self.version += 1
+
+    def shrink(self, spare: int = 0) -> None:
+        """Write tuples kept in lists to the columns, release cached ranks
+        and spare capacity of buffers
+
+        :param spare: number of tuples to keep room for
+        """
+        self.flush()
+        self._ranks = None
+        self._ranks_version = -1
+        capacity = max(self.size + spare, DEFAULT_CAPACITY)
+        if len(self.values) <= capacity:
+            return
+
+        for name in ('values', 'gaps', 'deltas'):
+            setattr(self, name, getattr(self, name)[:capacity].copy())
+
+    def merge(
+        self,
+        other: 'Sketch'
+    ) -> None:
+        """Absorb summaries of another sketch (GK merge)
+
+        :param other: sketch built over disjoint set of points
+        """
+        merged = type(self).merge_all([self, other])
+        self._replace(*merged._columns())
+
+    @classmethod
+    def merge_all(
+        cls,
+        sketches: List['Sketch']
+    ) -> 'Sketch':
+        """Merge sketches over disjoint sets of points in one pass
+
+        Tuples of all sketches are ordered by value (ties by sketch order).
+        rmin of a tuple in the union is the sum of rmin of its predecessors
+        in every sketch, which is the cumsum of gaps in merged order, so gaps
+        are kept. rmax additionally grows by gap + delta - 1 of the successor
+        in every other sketch. If sketch i is e_i-approximate for n_i points
+        (gap + delta <= 2 * e_i * n_i), the result keeps
+        gap + delta <= 2 * sum(e_i * n_i), i.e. it is max(e_i)-approximate
+        for the union
+
+        :param sketches: sketches to merge, at least one
+        :return: new sketch with epsilon and dtypes of the first sketch
+        """
+        first = sketches[0]
+        for s in sketches:
+            s.flush()
+        sketches = [s for s in sketches if s.size > 0]
+        if len(sketches) == 0:
+            return first._empty()
+
+        values = np.concatenate([s.values[:s.size] for s in sketches])
+        gaps = np.concatenate([s.gaps[:s.size] for s in sketches])
+        deltas = np.concatenate([s.deltas[:s.size] for s in sketches])
+        owners = np.repeat(
+            np.arange(len(sketches)), [s.size for s in sketches]
+        )
+
+        order = np.argsort(values, kind='stable')
+        values = values[order]
+        gaps = gaps[order]
+        deltas = deltas[order]
+        owners = owners[order]
+
+        # position of the next tuple of the same sketch in merged order
+        by_owner = np.argsort(owners, kind='stable')
+        current = by_owner[:-1]
+        following = by_owner[1:]
+        same = owners[current] == owners[following]
+        next_same = np.full(len(values), -1)
+        next_same[current[same]] = following[same]
+
+        # successor of a tuple in its own sketch bounds rmax by gap + delta - 1,
+        # 'above' sums this bound over all sketches for tuples after position
+        bound = gaps + deltas - 1
+        next_bound = np.where(next_same >= 0, bound[next_same], 0)
+        change = bound - next_bound
+        above = np.cumsum(change[::-1])[::-1] - change
+
+        sketch = first._empty(len(values))
+        sketch._replace(values, gaps, deltas + above - next_bound)
+
+        return sketch
+
+    def copy(self) -> 'Sketch':
+        """Independent copy of sketch
+
+        :return: new sketch with the same summaries
+        """
+        self.flush()
+        sketch = self._empty(max(self.size, 1))
+        sketch._replace(*self._columns())
+
+        return sketch
 
-        # find place for new summary in ordered list 
-        insert_index = bisect.bisect_right(
-            self.summaries,
-            new_summary
+    def _empty(self, capacity: int = DEFAULT_CAPACITY) -> 'Sketch':
+        """Empty sketch of the same type, epsilon and dtypes
+
+        :param capacity: initial number of preallocated tuples
+        :return: new sketch
+        """
+        return type(self)(
+            self.epsilon, capacity=capacity,
+            dtype=self.values.dtype, rank_dtype=self.gaps.dtype
         )
 
-        if insert_index == 0 or insert_index == self.len:
-            new_summary.delta = 0
+    def _columns(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Used part of buffers
 
-        self.summaries.insert(insert_index, new_summary)
+        :return: values, gaps and deltas columns
+        """
+        self.flush()
+        return (
+            self.values[:self.size],
+            self.gaps[:self.size],
+            self.deltas[:self.size]
+        )
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes of column buffers including spare capacity
+
+        :return: bytes
+        """
+        return self.values.nbytes + self.gaps.nbytes + self.deltas.nbytes
 
     def len(self) -> int:
         """Number of summaries in sketch
 
         :return: length of summaries
         """
-        return len(self.summaries)
+        if self._lists is not None:
+            return len(self._lists[0])
+
+        return self.size
+
+    @property
+    def summaries(self) -> List[Summary]:
+        """Tuples of sketch as Summary objects
+
+        :return: list of summaries
+        """
+        self.flush()
+        summaries = []
+        for value, gap, delta in zip(self.values[:self.size],
+                                     self.gaps[:self.size],
+                                     self.deltas[:self.size]):
+            summary = Summary(value.item(), int(delta))
+            summary.gap = int(gap)
+            summaries.append(summary)
+
+        return summaries
 
     def compress(self, nb) -> None:
-        """Merge summaries together
+        """Merge summaries together in one backward pass into new buffers.
+
+        A tuple is merged into its right neighbour when its band is not
+        higher and gap_i + gap_i+1 + delta_i+1 < 2 * epsilon * nb, so every
+        tuple keeps gap + delta within the error bound. Kept tuples are
+        collected on a stack, each tuple is pushed and popped at most once.
+        The minimum and the maximum are never merged
 
         :param nb: number of seen points in bucket
         """
-        for i in range(self.len() - 2, 1, -1):
-            while (i < self.len() - 1):
-                status = self.delete_if_needed(i, nb)
-                if not status:
-                    break
+        if self.len() < 3:
+            return
 
-    def delete_if_needed(self, index, nb) -> bool:
-        """Merge two summaries together
+        threshold = 2 * self.epsilon * nb
+        p = int(np.floor(threshold))
+        # the pass is scalar, python lists index much faster than arrays
+        if self._lists is not None:
+            values, gaps, deltas = self._lists
+            bands = [_band(delta, p) for delta in deltas]
+        else:
+            bands = _bands(self.deltas[:self.size], p).tolist()
+            gaps = self.gaps[:self.size].tolist()
+            deltas = self.deltas[:self.size].tolist()
 
-        :param i: index of left summary
-        :param nb: number of seeen points
-        :return: if was merged or not
-        """
-        left = self.summaries[index]
-        right = self.summaries[index + 1]
-        if left.delta >= right.delta and left.gap + right.delta < 2 * self.epsilon * nb:
-            self.summaries.pop(index)
-            right.gap += left.gap
-            return True
+        # kept tuples as (index, accumulated gap), top is the left-most one
+        kept = [(len(gaps) - 1, gaps[-1])]
+        for i in range(len(gaps) - 2, 0, -1):
+            index, gap = i, gaps[i]
+            while kept:
+                top, top_gap = kept[-1]
+                if bands[index] > bands[top] or \
+                        gap + top_gap + deltas[top] >= threshold:
+                    break
+                # right neighbour absorbs current tuple
+                kept.pop()
+                index, gap = top, top_gap + gap
+            kept.append((index, gap))
+        kept.append((0, gaps[0]))
 
-        return False
+        if len(kept) == len(gaps):
+            # lists are not kept between compressions
+            self.flush()
+            return
+
+        kept.reverse()
+        new_gaps = [gap for _, gap in kept]
+        if self._lists is not None:
+            self._lists = None
+            self._replace(
+                np.array([values[index] for index, _ in kept], dtype=self.values.dtype),
+                np.array(new_gaps, dtype=self.gaps.dtype),
+                np.array([deltas[index] for index, _ in kept], dtype=self.deltas.dtype)
+            )
+        else:
+            indexes = np.fromiter((index for index, _ in kept), dtype=np.int64)
+            self._replace(
+                self.values[indexes],
+                np.array(new_gaps, dtype=self.gaps.dtype),
+                self.deltas[indexes]
+            )
 
     def get_rmin_rmax(
         self
-    ) -> List[SummaryNn]:
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
         """Reconstruct the summaries
-        to get rank limit for data points
+        to get rank limit for data points.
+        Prefix sums are cached until the sketch changes
 
-        :return: restructured summaries
+        :return: read-only values, rmin and rmax columns
         """
-        assert len(self.summaries) != 0, 'No elements in sketch'
+        self.flush()
+        assert self.size != 0, 'No elements in sketch'
 
-        summaries: List[SummaryNn] = []
+        if self._ranks_version != self.version:
+            rmin = np.cumsum(self.gaps[:self.size])
+            rmax = rmin + self.deltas[:self.size]
+            ranks = (self.values[:self.size].copy(), rmin, rmax)
+            for column in ranks:
+                column.flags.writeable = False
 
-        v0 = self.summaries[0].value
-        rmin0 = 1
-        rmax0 = self.summaries[0].gap + rmin0
+            self._ranks = ranks
+            self._ranks_version = self.version
 
-        first = SummaryNn(
-            point=v0,
-            rmin=rmin0,
-            rmax=rmax0
-        )
-        summaries.append(first)
-        for i in range(1, len(self.summaries)):
-            v = self.summaries[i].value
-            rmin = summaries[i-1].rmin + self.summaries[i].gap
-            rmax = self.summaries[i].delta + rmin
-
-            new_summary = SummaryNn(
-                point=v,
-                rmin=rmin,
-                rmax=rmax
-            )
-
-            summaries.append(new_summary)
+        return self._ranks
 
-        return summaries
-    
     def lift(
         self,
         ksi: float,
         n: int
-    ) -> List[SummaryNn]:
-        """Apply LIFT to sketch 
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Apply LIFT to sketch
 
         :param ksi: quantile value
         :param n: numbre of points to observe
-        :return: LIFTed summaries in rmin - rmax format
+        :return: LIFTed summaries as values, rmin and rmax columns
         """
         assert 0 < ksi <= 1, f'Quantile value should be between (0, 1]. Got {ksi}'
 
-        rmin_rmax = self.get_rmin_rmax()
-        for summary in rmin_rmax:
-            summary.rmax += np.floor(ksi * n / 2)
+        values, rmin, rmax = self.get_rmin_rmax()
+        rmax = rmax + np.floor(ksi * n / 2)
 
-        return rmin_rmax
+        return values, rmin, rmax
 
     def __repr__(self) -> str:
         """Readable format for sketch
@@ -145,4 +623,4 @@ class Sketch():
         for s in self.summaries:
             out += str(s) + ", "
 
-        return out
\ No newline at end of file
+        return out
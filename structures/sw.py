@@ -4,12 +4,43 @@ Implementation of SW n-of-N alorithm from
 https://citeseerx.ist.psu.edu/viewdoc/download?doi=10.1.1.72.6192&rep=rep1&type=pdf
 """
 
+import sys
 import time
-from collections import defaultdict
+import bisect
+import logging
+from collections import deque
 from structures.buckets.bucket import Bucket
-from typing import List, Dict
+from structures.sketches.backends import BACKENDS, GK_BACKEND
+from structures.sketches.sketch import VALUE_DTYPES, coerce_value, coerce_values
+from structures.checkpoint import save_checkpoint, load_checkpoint
+from structures.memory import deep_sizeof
+from typing import Any, Deque, List, Dict, Tuple
 import numpy as np
-from structures.summaries.summary_nn import SummaryNn
+
+
+logger = logging.getLogger(__name__)
+
+SUFFIX_MODE = 'suffix'
+SEGMENT_MODE = 'segment'
+MODES = (SUFFIX_MODE, SEGMENT_MODE)
+
+# coarsest sketch epsilon of memory budget mode, ranks are still bounded
+MAX_EPSILON = 1.0
+# budget mode coarsens sketches above this share of budget
+# and makes new buckets finer again below RELAX_SHARE
+COARSEN_SHARE = 0.75
+RELAX_SHARE = 0.25
+# single points skip budget checks while share could not reach budget
+# growing this many times faster than the fastest growth seen so far
+BUDGET_GROWTH_MARGIN = 4
+# approximate size of python objects of one bucket outside of sketch
+# buffers (bucket, sketch, array headers, counters), see _approximate_bytes
+BUCKET_OVERHEAD = 750
+# value and integer objects of a tuple while points are added one by one,
+# lists themselves are measured (many objects are shared or cached small ints)
+LIST_TUPLE_BYTES = 20
+# structure itself: levels, index lists and counters
+STRUCTURE_OVERHEAD = 2700
 
 
 class SW_n_of_N():
@@ -17,37 +48,215 @@ class SW_n_of_N():
     def __init__(
         self,
         n: int,
-        epsilon: float
+        epsilon: float,
+        mode: str = SUFFIX_MODE,
+        window_seconds: float = None,
+        verbose: bool = True,
+        backend: str = GK_BACKEND,
+        dtype=np.float64,
+        max_tuples: int = None,
+        max_bytes: int = None
     ):
         """Class constructor
 
         :param n: number of most recent points that will be considered for quantile query
         :param epsilon: approximate coefficient
+        :param mode: ingestion engine, 'suffix' - every bucket covers all points
+            since its timestamp (cheap query), 'segment' - every bucket covers
+            points until the next bucket and suffixes are merged at query time (cheap add)
+        :param window_seconds: if set, buckets whose points are all older than
+            this time span (relative to the latest timestamp) are dropped as
+            well, the oldest bucket may straddle the border, see query_many.
+            Timestamps are expected to be non-decreasing
+        :param verbose: log configuration on init (INFO level)
+        :param backend: sketch of buckets, 'gk' (deterministic rank error),
+            'kll' (compactors, estimated ranks) or 'ddsketch'
+            (epsilon is relative error of values instead of ranks)
+        :param dtype: dtype of stored values, float32, float64, int32 or int64,
+            points are validated and converted on add
+        :param max_tuples: memory budget mode, limit of tuples in all sketches.
+            When it is exceeded, query caches and spare buffer capacity are
+            released, then sketches are compressed with larger epsilon
+            (doubled each time) and new buckets get finer again once usage drops,
+            see error_bound for the guarantee that holds. Every bucket keeps
+            at least its minimum and maximum, so a budget below two tuples for
+            each of the most buckets N can need is refused. If the budget is
+            still exceeded at the coarsest epsilon, a warning is logged and
+            stats()['over_budget'] is set. Only 'gk' backend
+        :param max_bytes: memory budget in bytes of the whole structure as
+            measured by memory_usage, enforced against its approximation
+            (see _approximate_bytes): sketch buffers with spare capacity,
+            tuples in python lists, caches and fixed overhead of every bucket.
+            A budget below the overhead and two tuples of every bucket is refused
+        :raises Exception: If mode, backend or dtype is unknown,
+            or memory budget cannot be met or is set for other backend than 'gk'
         """
+        if mode not in MODES:
+            raise Exception(
+                f'Mode should be one of {MODES}. Got {mode}.'
+            )
+        if backend not in BACKENDS:
+            raise Exception(
+                f'Backend should be one of {tuple(BACKENDS)}. Got {backend}.'
+            )
+        if np.dtype(dtype) not in VALUE_DTYPES:
+            raise Exception(
+                f'Value dtype should be one of {[str(t) for t in VALUE_DTYPES]}. Got {dtype}.'
+            )
+        if (max_tuples is not None or max_bytes is not None) and backend != GK_BACKEND:
+            raise Exception(
+                f'Memory budget needs rank bounds of {GK_BACKEND} backend. Got {backend}.'
+            )
+
         self._n = n
         self._epsilon = epsilon
         self._lambda = self._epsilon / (self._epsilon + 2)
-        self._buckets: Dict[List[Bucket]] = defaultdict(list)
+        # buckets at level are merged when there are ⌈ 1/λ ⌉ + 2 of them
+        self._capacity = int(np.ceil(1 / self._lambda)) + 2
+        self._mode = mode
+        self._window = window_seconds
+        self._backend = backend
+        self._dtype = np.dtype(dtype)
+        # gaps and deltas of a bucket never exceed number of its points (< N)
+        self._rank_dtype = np.dtype(np.int32 if n < np.iinfo(np.int32).max else np.int64)
+        self._max_tuples = None if max_tuples is None else int(max_tuples)
+        self._max_bytes = None if max_bytes is None else int(max_bytes)
+        self._budgeted = max_tuples is not None or max_bytes is not None
+        if self._budgeted:
+            self._check_budget()
+        # epsilon of new buckets, raised above epsilon by memory budget
+        self._sketch_epsilon = epsilon
+        # i-th deque keeps 2^i-buckets from oldest to newest
+        self._levels: List[Deque[Bucket]] = []
+        # number of points added so far
+        self._count = 0
+        # all live buckets from oldest to newest and their start numbers,
+        # start numbers are increasing, so bucket lookup is a bisect
+        self._ordered: List[Bucket] = []
+        self._starts: List[int] = []
+        self._timestamps: List[float] = []
+        # merged suffix buckets of segment mode by start of the oldest one,
+        # valid while no point is added
+        self._suffix_cache: Dict[int, Bucket] = {}
+        self._suffix_cache_count = 0
+        # operation counters, see stats
+        self._merges = 0
+        self._expired = 0
+        self._outdated = 0
+        self._dropped_compressions = 0
+        self._coarsenings = 0
+        self._over_budget = False
+        self._budget_warned = False
+        # new buckets insert single points into the columns of sketches
+        # instead of python lists, set over memory budget
+        self._columns_only = False
+        # points added since the last budget check, the ones to add before
+        # the next check, share after the last check and its fastest growth
+        # per point, see _enforce_budget
+        self._unchecked = 0
+        self._budget_skip = 0
+        self._checked_share = 0.0
+        self._share_growth = 0.0
+        # LIFT cache use of queried buckets, merged suffixes
+        # of segment mode live only until the next point
+        self._lift_hits = 0
+        self._lift_misses = 0
 
-        print('Init SW n-of-N system.')
-        print(f'\tepsilon: {self._epsilon} (rank error coefficient)')
-        print(f'\tlambda: {self._lambda} (bucket limit at i-th level)')
-        print(f'\tn: {self._n} (number of last desired points)')
+        if not verbose:
+            return None
+
+        logger.info(
+            'Init SW n-of-N system.\n'
+            '\tepsilon: %s (rank error coefficient)\n'
+            '\tlambda: %s (bucket limit at i-th level)\n'
+            '\tn: %s (number of last desired points)\n'
+            '\tmode: %s (ingestion engine)\n'
+            '\twindow_seconds: %s (time window)\n'
+            '\tbackend: %s (bucket sketch)\n'
+            '\tdtype: %s (stored values)\n'
+            '\tmax_tuples: %s (memory budget)\n'
+            '\tmax_bytes: %s (memory budget)',
+            self._epsilon, self._lambda, self._n, self._mode,
+            self._window, self._backend, self._dtype, self._max_tuples,
+            self._max_bytes
+        )
 
-    def add(self, point, ts: float = time.time()):
+    def add(self, point, ts: float = None):
         """Add new data point
 
-        :param point: data point, should be Comparable
-        :param ts: point recieve timestamp
+        :param point: data point, number convertible to dtype
+        :param ts: point recieve timestamp, current time by default
+        :raises Exception: If point does not fit dtype
         """
+        point = coerce_value(point, self._dtype)
+        if ts is None:
+            ts = time.time()
+
         # Step 1: create a new sketch
         self._create_new_sketch(ts)
 
         # Step 2: drop sketches
         self._drop_sketches()
+        self._drop_outdated()
 
         # Step 3: maintain sketches
         self._maintain_sketches(point)
+        self._count += 1
+
+        if self._budgeted:
+            self._enforce_budget()
+
+    def add_batch(self, points, timestamps=None):
+        """Add chunk of data points at once
+
+        Produces the same EH-partition (levels, timestamps and Nb of buckets)
+        as calling `add` for every point, but every surviving bucket receives
+        its part of the chunk as one sorted merge into its sketch.
+
+        :param points: 1-d array of data points, converted to dtype once
+        :param timestamps: points recieve timestamps (array or scalar),
+            current time by default
+        :raises Exception: If points do not fit dtype
+        """
+        points = coerce_values(points, self._dtype)
+        size = len(points)
+        if size == 0:
+            return None
+
+        if timestamps is None:
+            timestamps = time.time()
+        timestamps = np.broadcast_to(np.asarray(timestamps, dtype=float), (size,))
+
+        # Step 1 and 2 for every point: only bucket bookkeeping
+        count = self._count
+        for step in range(size):
+            self._create_new_sketch(timestamps[step])
+            self._drop_sketches()
+            self._drop_outdated()
+            self._count += 1
+
+        # Step 3: each remaining sketch gets its part of the chunk,
+        # chunk offset of bucket is the first point it has to receive
+        buckets = self._ordered
+        if self._mode == SUFFIX_MODE:
+            order = np.argsort(points, kind='stable')
+            sorted_points = points[order]
+            for bucket in buckets:
+                offset = bucket.start - count
+                if offset <= 0:
+                    bucket.add_batch(sorted_points)
+                else:
+                    bucket.add_batch(sorted_points[order >= offset])
+        else:
+            ends = [bucket.start - count for bucket in buckets[1:]] + [size]
+            for bucket, end in zip(buckets, ends):
+                offset = max(bucket.start - count, 0)
+                if end > offset:
+                    bucket.add_batch(np.sort(points[offset:end]))
+
+        # budget may be exceeded inside of chunk, but not after it
+        if self._budgeted:
+            self._enforce_budget(size)
 
     def _create_new_sketch(self, ts: float):
         """Record a new 1-bucket, its timestamp ts, and number of data = 0.
@@ -55,91 +264,831 @@ class SW_n_of_N():
 
         :param ts: point timestamp
         """
-        new_bucket = Bucket(ts, self._epsilon)
-        self._buckets[1].append(new_bucket)
+        new_bucket = Bucket(
+            ts, self._sketch_epsilon, start=self._count, backend=self._backend,
+            dtype=self._dtype, rank_dtype=self._rank_dtype
+        )
+        if self._columns_only:
+            new_bucket.sketch.list_capacity = 0
+        self._level(0).append(new_bucket)
+        self._ordered.append(new_bucket)
+        self._starts.append(new_bucket.start)
+        self._timestamps.append(ts)
 
     def _drop_sketches(self):
         """Remove expired and filled buckets
         """
+        levels = self._levels
         # If the number of 1-buckets is full (i.e., ⌈ 1/λ ⌉ + 2)
-        if len(self._buckets[1]) < (np.ceil(1 / self._lambda) + 2):
+        if len(levels[0]) < self._capacity:
             return None
 
         # iteratively from i = 1 till j
-        for i in range(len(self._buckets)):
-            level = 2 ** i
+        for i in range(len(levels)):
             # where the current number (before this new element arrives) of j-buckets is not greater than ⌈ 1/λ ⌉
-            if len(self._buckets[level]) != np.ceil(1/self._lambda) + 2:
-                # no enough buckets to merge
-                continue
+            if len(levels[i]) != self._capacity:
+                # no enough buckets to merge, levels above grow
+                # only by merges from this one, so they are not full either
+                break
 
             # get the two oldest buckets b1 and b2 among the i-buckets
             # drop b1 and b2 from the i-th bucket list
-            b1 = self._buckets[level].pop(0)
-            b2 = self._buckets[level].pop(0)
+            b1 = levels[i].popleft()
+            b2 = levels[i].popleft()
+
+            # b1 covers points of b2 only if buckets store suffixes
+            if self._mode == SEGMENT_MODE:
+                b1.merge(b2)
 
             # add b1 together with its time stamp into (i+1) - buckets list
-            self._buckets[2 ** (i + 1)].append(b1)
+            self._level(i + 1).append(b1)
+            self._merges += 1
+            self._dropped_compressions += b2.compressions
+
+            index = bisect.bisect_left(self._starts, b2.start)
+            del self._ordered[index]
+            del self._starts[index]
+            del self._timestamps[index]
 
         # Scan the sketch list from oldest to delete the expired buckets b - (Sb, Nb, tb); that is Nb ≥ N.
-        for i in range(len(self._buckets), 0, -1):
-            level = 2 ** (i - 1)
-            new_buckets = []
-            for bucket in self._buckets[level]:
-                # choose only not expired buckets
-                if bucket.Nb < self._n:
-                    new_buckets.append(bucket)
+        # Buckets are ordered by age, so scan stops at the first live one
+        for buckets in reversed(levels):
+            expired = 0
+            while len(buckets) > 0 and \
+                    self._count - buckets[0].start >= self._n:
+                self._dropped_compressions += buckets.popleft().compressions
+                expired += 1
             # delete expired buckets
-            self._buckets[level] = new_buckets
+            self._expired += expired
+            del self._ordered[:expired]
+            del self._starts[:expired]
+            del self._timestamps[:expired]
+            if len(buckets) > 0:
+                break
+
+    def _drop_outdated(self):
+        """Remove buckets with all points outside of time window.
+        Points of a bucket arrive before the next bucket starts, so a bucket
+        is outdated when the next one starts before the border as well.
+        The bucket straddling the border is kept, otherwise its points
+        inside the window would be lost. Only the oldest buckets are checked
+        """
+        if self._window is None:
+            return None
+
+        border = self._timestamps[-1] - self._window
+        while len(self._timestamps) > 1 and self._timestamps[1] < border:
+            self._drop_oldest()
+
+    def _drop_oldest(self):
+        """Remove the oldest live bucket
+        """
+        for buckets in reversed(self._levels):
+            if len(buckets) > 0:
+                buckets.popleft()
+                break
+
+        self._outdated += 1
+        self._dropped_compressions += self._ordered[0].compressions
+        del self._ordered[0]
+        del self._starts[0]
+        del self._timestamps[0]
 
     def _maintain_sketches(self, point):
-        """Add point to every sketch
+        """Add point to every sketch (suffix mode) or the newest one (segment mode)
 
         :param point: data point
         """
+        if self._mode == SEGMENT_MODE:
+            self._levels[0][-1].add(point)
+            return None
+
         # for each remaining sketch Sb
-        for i in range(len(self._buckets)):
-            level = 2 ** i
-            for bucket in self._buckets[level]:
-                # add e into Sb by GK-algorithm for epsilon/2 - approximation and Nb := Nb + 1
-                bucket.add(point)
+        for bucket in self._ordered:
+            # add e into Sb by GK-algorithm for epsilon/2 - approximation and Nb := Nb + 1
+            bucket.add(point)
+
+    def _tuples(self) -> int:
+        """Number of tuples in all sketches
+
+        :return: tuples
+        """
+        return sum(bucket.sketch.len() for bucket in self._ordered)
+
+    def _approximate_bytes(self) -> int:
+        """Approximate memory_usage without traversing objects: sketch
+        buffers including spare capacity, tuples kept in python lists,
+        cached ranks and LIFTed columns, merged suffixes of segment mode
+        and fixed overhead of every bucket
+
+        :return: bytes
+        """
+        size = STRUCTURE_OVERHEAD + sum(_bucket_bytes(bucket) for bucket in self._ordered)
+        # index containers grow in blocks, they are measured
+        size += sum(sys.getsizeof(buckets) for buckets in self._levels)
+        size += sys.getsizeof(self._ordered) + sys.getsizeof(self._starts)
+        size += sys.getsizeof(self._timestamps)
+        # suffix of the newest bucket alone is that bucket
+        newest = self._ordered[-1] if len(self._ordered) > 0 else None
+        for bucket in self._suffix_cache.values():
+            if bucket is not newest:
+                size += _bucket_bytes(bucket)
+
+        return size
+
+    def _check_budget(self):
+        """Refuse memory budget that cannot be met even at the coarsest
+        sketch epsilon, see _min_bytes, for the most buckets N can need:
+        up to (capacity - 1) buckets on every level
 
-    def query(self, q: float, *args, **kwargs):
+        :raises Exception: If max_tuples or max_bytes is below that minimum
+        """
+        buckets = _max_buckets(self._n, self._capacity)
+        min_tuples = 2 * buckets
+        min_bytes = self._min_bytes(buckets)
+
+        if self._max_tuples is not None and self._max_tuples < min_tuples:
+            raise Exception(
+                f'Memory budget of {self._max_tuples} tuples cannot be met: up to {buckets} buckets '
+                f'keep at least {min_tuples} tuples. Raise max_tuples or epsilon, or lower n.'
+            )
+        if self._max_bytes is not None and self._max_bytes < min_bytes:
+            raise Exception(
+                f'Memory budget of {self._max_bytes} bytes cannot be met: up to {buckets} buckets '
+                f'take at least {min_bytes} bytes. Raise max_bytes or epsilon, or lower n.'
+            )
+
+    def _min_bytes(self, buckets: int) -> int:
+        """Bytes no sketch epsilon can release: every bucket keeps at least
+        its minimum and maximum and fixed overhead
+
+        :param buckets: number of buckets
+        :return: bytes
+        """
+        tuple_bytes = self._dtype.itemsize + 2 * self._rank_dtype.itemsize
+        bucket_bytes = BUCKET_OVERHEAD + 2 * tuple_bytes
+
+        return STRUCTURE_OVERHEAD + buckets * bucket_bytes
+
+    def _budget_share(self) -> float:
+        """Used share of memory budget above the part no sketch epsilon
+        can release (two tuples and overhead of every live bucket),
+        the larger one of tuples and bytes
+
+        :return: share, above 1 if budget is exceeded
+        """
+        buckets = len(self._ordered)
+        share = 0.0
+        if self._max_tuples is not None:
+            share = _share(self._tuples(), 2 * buckets, self._max_tuples)
+        if self._max_bytes is not None:
+            share = max(share, _share(
+                self._approximate_bytes(), self._min_bytes(buckets), self._max_bytes
+            ))
+
+        return share
+
+    def _enforce_budget(self, points: int = 1):
+        """Keep tuples and bytes of the structure within memory budget
+
+        Over budget, python lists of sketches are written to the columns
+        (under byte budget later points of all buckets go to the columns too),
+        merged suffixes and LIFT caches are dropped, pending compressions of
+        all buckets are done and spare buffer capacity is released first.
+        While more than COARSEN_SHARE of budget is used, sketch epsilon is
+        doubled and every finer bucket is coarsened to it, so the next
+        enforcement waits until the buckets grow back over budget. Below
+        RELAX_SHARE of budget sketch epsilon is halved back towards epsilon
+        and then python lists are allowed again, which affects new buckets
+        only. Shares are taken of budget above the part no epsilon can
+        release, see _budget_share. After single points they are checked
+        again only when the budget could be exceeded, see
+        _schedule_budget_check, batches are always checked
+
+        :param points: number of points added since the previous call
+        """
+        self._unchecked += points
+        if points == 1 and self._unchecked <= self._budget_skip:
+            return None
+
+        share = self._budget_share()
+        self._share_growth = max(
+            self._share_growth, (share - self._checked_share) / self._unchecked
+        )
+        self._unchecked = 0
+        if share <= 1:
+            if share < RELAX_SHARE:
+                if self._sketch_epsilon > self._epsilon:
+                    self._sketch_epsilon = max(self._sketch_epsilon / 2, self._epsilon)
+                    logger.info('Sketch epsilon is relaxed to %s', self._sketch_epsilon)
+                else:
+                    self._columns_only = False
+            self._over_budget = False
+            if share < COARSEN_SHARE:
+                self._budget_warned = False
+            self._schedule_budget_check(share)
+            return None
+
+        # tuples in lists take several times the bytes of tuples in columns
+        self._columns_only = self._max_bytes is not None
+        self._suffix_cache = {}
+        # single points go to the newest bucket only in segment mode,
+        # batches outgrow any room kept in buffers
+        newest = self._ordered[-1]
+        single = points == 1
+        for bucket in self._ordered:
+            if self._columns_only:
+                bucket.sketch.list_capacity = 0
+            bucket._compress()
+            bucket.shrink(single and (self._mode == SUFFIX_MODE or bucket is newest))
+        share = self._budget_share()
+
+        while share > COARSEN_SHARE and self._sketch_epsilon < MAX_EPSILON:
+            self._sketch_epsilon = min(2 * self._sketch_epsilon, MAX_EPSILON)
+            for bucket in self._ordered:
+                if bucket.epsilon < self._sketch_epsilon:
+                    bucket.coarsen(self._sketch_epsilon)
+                    bucket.shrink(single and (self._mode == SUFFIX_MODE or bucket is newest))
+            self._coarsenings += 1
+            share = self._budget_share()
+            logger.info(
+                'Sketch epsilon is coarsened to %s, %.0f%% of memory budget headroom is used',
+                self._sketch_epsilon, 100 * share
+            )
+            if self._sketch_epsilon >= MAX_EPSILON and not self._budget_warned:
+                self._budget_warned = True
+                logger.warning(
+                    'Memory budget (%s tuples, %s bytes) coarsened sketches to epsilon %s, '
+                    'answers are only bounded by the window',
+                    self._max_tuples, self._max_bytes, self._sketch_epsilon
+                )
+
+        # warned once until usage drops below COARSEN_SHARE again
+        self._over_budget = share > 1
+        if self._over_budget and not self._budget_warned:
+            logger.warning(
+                'Memory budget (%s tuples, %s bytes) is exceeded by %s buckets '
+                'at the coarsest sketch epsilon %s',
+                self._max_tuples, self._max_bytes, len(self._ordered),
+                self._sketch_epsilon
+            )
+        self._budget_warned = self._budget_warned or self._over_budget
+        self._schedule_budget_check(share)
+
+    def _schedule_budget_check(self, share: float):
+        """Skip budget checks for the points that cannot exceed the budget
+        while share grows at most BUDGET_GROWTH_MARGIN times as fast per point
+        as it has grown between any two checks so far
+
+        :param share: used share of budget after the check
+        """
+        self._checked_share = share
+        self._budget_skip = 0
+        if self._share_growth > 0 and share < 1:
+            growth = BUDGET_GROWTH_MARGIN * self._share_growth
+            self._budget_skip = int((1 - share) / growth)
+
+    def _level(self, i: int) -> Deque[Bucket]:
+        """Buckets of i-th level (2^i-buckets), missing levels are created
+
+        :param i: level index
+        :return: deque of buckets from oldest to newest
+        """
+        while len(self._levels) <= i:
+            self._levels.append(deque())
+
+        return self._levels[i]
+
+    def _suffix_bucket(self, buckets: List[Bucket]) -> Bucket:
+        """Merge consecutive segment buckets into one suffix bucket
+
+        :param buckets: segment buckets from oldest to newest
+        :return: bucket covering all points of given buckets
+        """
+        if len(buckets) == 1:
+            return buckets[0]
+
+        return Bucket.merge_all(buckets)
+
+    def _cached_suffix_bucket(self, index: int) -> Bucket:
+        """Merged suffix starting at given bucket, reused between queries
+        until the next point is added
+
+        :param index: position of the oldest bucket in ordered buckets
+        :return: bucket covering all points of the suffix
+        """
+        if self._suffix_cache_count != self._count:
+            self._suffix_cache = {}
+            self._suffix_cache_count = self._count
+
+        start = self._starts[index]
+        if start not in self._suffix_cache:
+            self._suffix_cache[start] = self._suffix_bucket(self._ordered[index:])
+
+        return self._suffix_cache[start]
+
+    def _find_bucket(self, n: int) -> int:
+        """Find the oldest bucket such that Nb ≤ n
+
+        :param n: number of most recent points
+        :return: position of bucket in ordered buckets
+        """
+        # Nb = count - start, so Nb ≤ n is start ≥ count - n
+        return bisect.bisect_left(self._starts, self._count - n)
+
+    def _find_bucket_by_time(self, window_seconds: float) -> int:
+        """Find the oldest bucket inside the time window
+
+        :param window_seconds: time span before the latest timestamp
+        :return: position of bucket in ordered buckets
+        """
+        if self._window is not None and window_seconds > self._window:
+            raise Exception(
+                f'Time window should be in (0, {self._window}]. Got {window_seconds}.'
+            )
+        if len(self._ordered) == 0:
+            return 0
+
+        return bisect.bisect_left(
+            self._timestamps, self._timestamps[-1] - window_seconds
+        )
+
+    def _queried_bucket(self, n: int, window_seconds: float) -> Tuple[Bucket, int]:
+        """Bucket answering for the last n points or the last time span
+
+        :param n: number of most recent points, N by default
+        :param window_seconds: time span, used instead of 'n' if set
+        :raises Exception: If 'n' not in (0, N] or no points were added
+        :return: bucket (merged suffix in segment mode) and number of points
+            the answer is for
+        """
+        if window_seconds is not None:
+            index = self._find_bucket_by_time(window_seconds)
+            if index == len(self._ordered):
+                raise Exception('No elements')
+            n = self._count - self._starts[index]
+        else:
+            if n is None:
+                n = self._n
+            if n <= 0 or n > self._n:
+                raise Exception(
+                    f'Number of points should be in (0, {self._n}]. Got {n}.'
+                )
+            # answer for all points if less than n were added
+            n = min(n, self._count)
+            # buckets dropped by time window cover no points of the window,
+            # but older points can not be answered for either
+            if self._window is not None and len(self._ordered) > 0:
+                n = min(n, self._count - self._starts[0])
+
+            # For a given n (n ≤ N), find the oldest sketch such that Nb ≤ n
+            index = self._find_bucket(n)
+            if index == len(self._ordered):
+                raise Exception('No elements')
+
+        queried_bucket: Bucket = self._ordered[index]
+
+        # segment buckets are merged into summary of the whole suffix
+        if self._mode == SEGMENT_MODE:
+            queried_bucket = self._cached_suffix_bucket(index)
+
+        return queried_bucket, n
+
+    def query(
+        self,
+        q: float,
+        n: int = None,
+        window_seconds: float = None,
+        *args,
+        **kwargs
+    ):
         """Retrieve φ-quantile
 
         :param q: φ-quantile
-        :raises Exception: If 'q' not in (0, 1]
+        :param n: number of most recent points to answer for,
+            should not be larger than N given to constructor (default)
+        :param window_seconds: answer for points of the last time span instead,
+            should not be larger than window given to constructor
+        :raises Exception: If 'q' not in (0, 1] or 'n' not in (0, N]
         :return: calculated value
         """
-        if q <= 0 or q > 1:
-            raise Exception(
-                f'Quantile fraction should be in (0, 1]. Got {q}.'
-            )
+        return self.query_many([q], n, window_seconds)[0]
+
+    def query_many(
+        self,
+        qs,
+        n: int = None,
+        window_seconds: float = None,
+        *args,
+        **kwargs
+    ) -> np.ndarray:
+        """Retrieve several φ-quantiles with a single LIFT
+
+        φ-quantile of n points is the point of rank ⌈φn⌉ (ranks start
+        at 1, as in GK and the SW n-of-N paper), so φ = 1 is the maximum
+        and φ = 1/n the minimum. The answer has rank ⌈φn⌉ ± epsilon * n.
+        While fewer than n points were added, n is the number of added points.
+
+        For a time window the answer covers the n' points since the timestamp
+        of the oldest bucket inside the window, with rank error at most
+        epsilon * n'. Up to d more points of the window belong to the bucket
+        straddling its border, their number is not kept. Like the points
+        missed by count queries, d <= λ * (n' + d) for the EH partition
+        (λ = epsilon / (epsilon + 2)), so against all points of a window
+        of at most N points the rank error is at most (epsilon + λ) times
+        their number. Larger windows are answered for the last N points at most
+
+        :param qs: sequence of φ-quantiles
+        :param n: number of most recent points to answer for,
+            should not be larger than N given to constructor (default)
+        :param window_seconds: answer for points of the last time span instead,
+            should not be larger than window given to constructor
+        :raises Exception: If any 'q' not in (0, 1] or 'n' not in (0, N],
+            or no points were added
+        :return: calculated values in order of 'qs'
+        """
+        qs = np.asarray(qs, dtype=float).ravel()
+        for q in qs:
+            if q <= 0 or q > 1:
+                raise Exception(
+                    f'Quantile fraction should be in (0, 1]. Got {q}.'
+                )
+
+        queried_bucket, n = self._queried_bucket(n, window_seconds)
+
+        if not queried_bucket.sketch.rank_bounds:
+            # estimated ranks have no bounds to LIFT, answer is the first item
+            # reaching rank ⌈φNb⌉ of points in bucket
+            values, rmin, _ = queried_bucket.sketch.get_rmin_rmax()
+            index = np.searchsorted(rmin, np.ceil(qs * queried_bucket.Nb), side='left')
+            return values[np.minimum(index, len(values) - 1)]
 
-        # For a given n (n ≤ N), scan the sketch list 
-        # from oldest and find the first sketch such that Nb ≤ n
-        queried_bucket: Bucket = None
-        for i in range(len(self._buckets), 0, -1):
-            level = 2 ** (i - 1)
-            for bucket in self._buckets[level]:
-                if bucket.Nb <= self._n:
-                    queried_bucket = bucket
-                    break
-            if queried_bucket is not None:
-                break
-        
         # Apply the algorithm Lift to Sb to generate S_lift where ζ = ǫ
-        lifted: List[SummaryNn] = queried_bucket.lift()
+        misses = queried_bucket.lift_misses
+        values, rmin, rmax = queried_bucket.lift()
+        if queried_bucket.lift_misses == misses:
+            self._lift_hits += 1
+        else:
+            self._lift_misses += 1
 
         # For a given rank 'r', find the first tuple (v, r+, r−) 
         # in S_lift such that r − ǫn ≤ r− ≤ r+ ≤ r + ǫn
-        rank = q * self._n
-        err = self._epsilon * self._n
-        for summary in lifted:
-            if rank - err <= summary.rmin <= summary.rmax <= rank + err:
-                return summary.value
-        
-        raise Exception('smth is not good')
+        # epsilon of bucket is larger if memory budget coarsened it
+        err = queried_bucket.epsilon * n
+        result = np.empty(len(qs), dtype=values.dtype)
+        # rank of φ-quantile is ⌈φn⌉
+        for i, rank in enumerate(np.ceil(qs * n)):
+            # rmin is increasing, so candidates are a contiguous range
+            lo = np.searchsorted(rmin, rank - err, side='left')
+            hi = np.searchsorted(rmin, rank + err, side='right')
+            fits = rmax[lo:hi] <= rank + err
+            if not fits.any():
+                # LIFT keeps ranks within epsilon, so the sketch itself is broken
+                raise Exception(
+                    f'No summary tuple fits rank {rank:.0f} ± {err:g} of '
+                    f'{qs[i]}-quantile over {n} points, epsilon guarantee is violated.'
+                )
+            result[i] = values[lo + np.argmax(fits)]
+
+        return result
+
+    def merge(self, other: 'SW_n_of_N') -> None:
+        """Absorb summaries of another shard of the same stream,
+        see merge_all
+
+        :param other: structure built over disjoint part of the stream
+        """
+        merged = SW_n_of_N.merge_all([self, other])
+        self.__dict__.update(merged.__dict__)
+
+    @classmethod
+    def merge_all(cls, shards: List['SW_n_of_N']) -> 'SW_n_of_N':
+        """Combine structures of shards that received disjoint parts
+        of one stream, e.g. from different processes or hosts
+
+        Buckets are aligned by timestamp: for every bucket of any shard
+        with timestamp t the combined bucket merges the summary of that shard
+        since the bucket and of every other shard since its oldest bucket
+        not older than t. So the result answers last-n and last-T queries
+        for the union of the shards. Points with equal timestamps in
+        different shards are ordered as the shards in 'shards', so every
+        bucket of a shard is a boundary even if other shards have buckets
+        with the same timestamp.
+
+        Error bound: every combined sketch is epsilon/2-approximate for
+        points it covers. Besides the points the LIFT accounts for,
+        every shard can miss its part of one EH bucket at the boundary,
+        which is at most lambda * n points in total.
+        So a merged query is (epsilon + lambda)-approximate,
+        about 1.5 * epsilon for small epsilon. Buckets coarsened by
+        memory budget add their error_bound instead of epsilon.
+
+        The result is a suffix mode structure with N equal to the sum of
+        shards N, points added to it are appended after the points of all shards
+
+        :param shards: structures with the same epsilon, backend and dtype
+        :raises Exception: If shards have different epsilon, backend or dtype
+        :return: combined structure
+        """
+        epsilons = {shard._epsilon for shard in shards}
+        if len(epsilons) != 1:
+            raise Exception(
+                f'Only shards with the same epsilon can be merged. Got {sorted(epsilons)}.'
+            )
+        backends = {shard._backend for shard in shards}
+        if len(backends) != 1:
+            raise Exception(
+                f'Only shards with the same backend can be merged. Got {sorted(backends)}.'
+            )
+        dtypes = {str(shard._dtype) for shard in shards}
+        if len(dtypes) != 1:
+            raise Exception(
+                f'Only shards with the same dtype can be merged. Got {sorted(dtypes)}.'
+            )
+
+        windows = [shard._window for shard in shards if shard._window is not None]
+        budgets = [shard._max_tuples for shard in shards]
+        byte_budgets = [shard._max_bytes for shard in shards]
+        merged = cls(
+            n=sum(shard._n for shard in shards),
+            epsilon=shards[0]._epsilon,
+            mode=SUFFIX_MODE,
+            window_seconds=min(windows) if len(windows) > 0 else None,
+            verbose=False,
+            backend=shards[0]._backend,
+            dtype=shards[0]._dtype,
+            # budget of the whole stream is the sum of budgets of all shards
+            max_tuples=None if None in budgets else sum(budgets),
+            max_bytes=None if None in byte_budgets else sum(byte_budgets)
+        )
+        merged._count = sum(shard._count for shard in shards)
+        merged._sketch_epsilon = max(shard._sketch_epsilon for shard in shards)
+
+        # combined buckets are placed on the highest level of shards,
+        # levels below fill up with new points as usual
+        level_count = max(len(shard._levels) for shard in shards)
+        top_level = merged._level(max(level_count - 1, 0))
+
+        boundaries = sorted(
+            (ts, k, i)
+            for k, shard in enumerate(shards)
+            for i, ts in enumerate(shard._timestamps)
+        )
+        for ts, k, i in boundaries:
+            suffixes = []
+            for j, shard in enumerate(shards):
+                # points at ts of earlier shards are older, of later ones newer
+                if j == k:
+                    index = i
+                elif j < k:
+                    index = bisect.bisect_right(shard._timestamps, ts)
+                else:
+                    index = bisect.bisect_left(shard._timestamps, ts)
+                if index == len(shard._ordered):
+                    continue
+                if shard._mode == SEGMENT_MODE:
+                    suffixes.append(shard._cached_suffix_bucket(index))
+                else:
+                    suffixes.append(shard._ordered[index])
+
+            bucket = Bucket.merge_all(suffixes)
+            bucket.timestamp = ts
+            bucket.start = merged._count - bucket.Nb
+
+            top_level.append(bucket)
+            merged._ordered.append(bucket)
+            merged._starts.append(bucket.start)
+            merged._timestamps.append(ts)
+
+        return merged
+
+    def error_bound(self) -> float:
+        """Rank error coefficient guaranteed now: an answer for the last n
+        points is off by at most error_bound() * n ranks (for 'gk' backend).
+        Equals epsilon unless memory budget coarsened some live bucket,
+        then it is the largest epsilon among them
+
+        :return: effective epsilon
+        """
+        return max((bucket.epsilon for bucket in self._ordered), default=self._epsilon)
+
+    def rank_many(
+        self,
+        points,
+        n: int = None,
+        window_seconds: float = None
+    ) -> np.ndarray:
+        """Estimate fraction of points not greater than given values
+
+        Number of points ≤ v is between rmin of the last tuple with value ≤ v
+        and rmax - 1 of the next tuple, the middle of this range is returned
+
+        :param points: values to rank
+        :param n: number of most recent points, see query
+        :param window_seconds: time span, see query
+        :raises Exception: If 'n' not in (0, N] or no points were added
+        :return: fractions in [0, 1] in order of 'points'
+        """
+        queried_bucket, n = self._queried_bucket(n, window_seconds)
+        values, rmin, rmax = queried_bucket.sketch.get_rmin_rmax()
+        total = queried_bucket.Nb
+
+        points = np.asarray(points, dtype=float).ravel()
+        index = np.searchsorted(values, points, side='right') - 1
+        low = np.where(index >= 0, rmin[np.maximum(index, 0)], 0)
+        following = np.minimum(index + 1, len(values) - 1)
+        high = np.where(index + 1 < len(values), rmax[following] - 1, total)
+
+        return np.clip((low + high) / 2 / total, 0, 1)
+
+    def stats(self) -> Dict[str, Any]:
+        """Structure statistics
+
+        :return: dictionary with
+            count - number of added points,
+            buckets - number of live buckets,
+            tuples - number of tuples in all sketches,
+            tuples_per_bucket - tuples of every bucket from oldest to newest,
+            buckets_per_level, tuples_per_level - the same by level,
+            merges - number of EH merges,
+            expired - buckets dropped as covering N points or more,
+            outdated - buckets dropped as older than time window,
+            compressions - sketch compressions of all buckets so far,
+            lift_hits, lift_misses - queries that reused or computed
+                LIFTed summaries of the queried bucket,
+            max_tuples, max_bytes - memory budget,
+            approximate_bytes - memory_usage approximation the budget is enforced against,
+            over_budget - memory budget is exceeded at the coarsest sketch epsilon,
+            sketch_epsilon - epsilon of new buckets,
+            coarsenings - number of times memory budget raised sketch epsilon,
+            error_bound - see error_bound,
+            memory_bytes - see memory_usage
+        """
+        tuples_per_level = {}
+        buckets_per_level = {}
+        for i, buckets in enumerate(self._levels):
+            level = 2 ** i
+            buckets_per_level[level] = len(buckets)
+            tuples_per_level[level] = sum(b.sketch.len() for b in buckets)
+
+        tuples_per_bucket = [bucket.sketch.len() for bucket in self._ordered]
+
+        return {
+            'count': self._count,
+            'buckets': len(self._ordered),
+            'tuples': sum(tuples_per_bucket),
+            'tuples_per_bucket': tuples_per_bucket,
+            'buckets_per_level': buckets_per_level,
+            'tuples_per_level': tuples_per_level,
+            'merges': self._merges,
+            'expired': self._expired,
+            'outdated': self._outdated,
+            'compressions': self._dropped_compressions + sum(
+                bucket.compressions for bucket in self._ordered
+            ),
+            'lift_hits': self._lift_hits,
+            'lift_misses': self._lift_misses,
+            'max_tuples': self._max_tuples,
+            'max_bytes': self._max_bytes,
+            'approximate_bytes': self._approximate_bytes(),
+            'over_budget': self._over_budget,
+            'sketch_epsilon': self._sketch_epsilon,
+            'coarsenings': self._coarsenings,
+            'error_bound': self.error_bound(),
+            'memory_bytes': self.memory_usage()
+        }
+
+    def memory_usage(self) -> int:
+        """Deep size of structure: buckets, sketch buffers
+        including spare capacity, index lists and query caches
+
+        :return: bytes
+        """
+        return deep_sizeof(self)
+
+    def save(self, path: str) -> None:
+        """Write structure to binary checkpoint file
+
+        :param path: file path
+        """
+        meta, arrays = self._state()
+        save_checkpoint(path, 'SW_n_of_N', meta, arrays)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> 'SW_n_of_N':
+        """Restore structure from checkpoint file
+
+        :param path: file path
+        :param mmap: map file into memory, sketches then keep views
+            into the mapping until they are modified
+        :return: restored structure
+        """
+        meta, arrays = load_checkpoint(path, 'SW_n_of_N', mmap)
+        return cls._restore(meta, arrays)
+
+    def _state(self) -> Tuple[Dict[str, Any], Dict[str, np.ndarray]]:
+        """Structure state as parameters and flat arrays: metadata of
+        buckets from oldest to newest and their sketches one after another
+
+        :return: parameters and named arrays
+        """
+        levels = {}
+        for i, buckets in enumerate(self._levels):
+            for bucket in buckets:
+                levels[id(bucket)] = 2 ** i
+
+        columns = [bucket.sketch._columns() for bucket in self._ordered]
+        meta = {
+            'n': self._n,
+            'epsilon': self._epsilon,
+            'mode': self._mode,
+            'window_seconds': self._window,
+            'backend': self._backend,
+            'dtype': str(self._dtype),
+            'max_tuples': self._max_tuples,
+            'max_bytes': self._max_bytes,
+            'sketch_epsilon': self._sketch_epsilon,
+            'count': self._count,
+            'level_count': len(self._levels)
+        }
+        arrays = {
+            'levels': np.array([levels[id(b)] for b in self._ordered], dtype=np.int64),
+            'timestamps': np.array(self._timestamps, dtype=np.float64),
+            'starts': np.array(self._starts, dtype=np.int64),
+            'nb': np.array([b.Nb for b in self._ordered], dtype=np.int64),
+            'epsilons': np.array([b.epsilon for b in self._ordered], dtype=np.float64),
+            'sizes': np.array([len(c[0]) for c in columns], dtype=np.int64),
+            'values': _concatenate([c[0] for c in columns], self._dtype),
+            'gaps': _concatenate([c[1] for c in columns], self._rank_dtype),
+            'deltas': _concatenate([c[2] for c in columns], self._rank_dtype)
+        }
+
+        return meta, arrays
+
+    @classmethod
+    def _restore(
+        cls,
+        meta: Dict[str, Any],
+        arrays: Dict[str, np.ndarray]
+    ) -> 'SW_n_of_N':
+        """Build structure from state produced by _state
+
+        :param meta: parameters
+        :param arrays: named arrays
+        :return: restored structure
+        """
+        sw = cls(
+            n=meta['n'],
+            epsilon=meta['epsilon'],
+            mode=meta['mode'],
+            window_seconds=meta['window_seconds'],
+            verbose=False,
+            # checkpoints before backends were GK only
+            backend=meta.get('backend', GK_BACKEND),
+            dtype=meta.get('dtype', 'float64'),
+            max_tuples=meta.get('max_tuples'),
+            max_bytes=meta.get('max_bytes')
+        )
+        sw._count = meta['count']
+        sw._sketch_epsilon = meta.get('sketch_epsilon', sw._epsilon)
+        # levels without buckets are kept as well,
+        # number of levels bounds the merge scan
+        if meta['level_count'] > 0:
+            sw._level(meta['level_count'] - 1)
+
+        levels = arrays['levels'].tolist()
+        timestamps = arrays['timestamps'].tolist()
+        starts = arrays['starts'].tolist()
+        nbs = arrays['nb'].tolist()
+        # checkpoints before memory budget have buckets of epsilon only
+        if 'epsilons' in arrays:
+            epsilons = arrays['epsilons'].tolist()
+        else:
+            epsilons = [sw._epsilon] * len(nbs)
+        ends = np.cumsum(arrays['sizes']).tolist()
+        # checkpoints before integer deltas are converted once
+        values = arrays['values'].astype(sw._dtype, copy=False)
+        gaps = arrays['gaps'].astype(sw._rank_dtype, copy=False)
+        deltas = arrays['deltas'].astype(sw._rank_dtype, copy=False)
+        begin = 0
+        for i, end in enumerate(ends):
+            bucket = Bucket(timestamps[i], epsilons[i], start=starts[i], backend=sw._backend)
+            bucket.Nb = nbs[i]
+            bucket.sketch = type(bucket.sketch).from_columns(
+                bucket.sketch.epsilon,
+                values[begin:end],
+                gaps[begin:end],
+                deltas[begin:end]
+            )
+            begin = end
+
+            # level 2^i is kept in i-th deque
+            sw._level(levels[i].bit_length() - 1).append(bucket)
+            sw._ordered.append(bucket)
+            sw._starts.append(bucket.start)
+            sw._timestamps.append(bucket.timestamp)
+
+        return sw
 
     def __str__(self) -> str:
         """Return SW buckets in readable format
@@ -147,9 +1096,71 @@ class SW_n_of_N():
         :return: string representation
         """
         repr = ""
-        for i in range(len(self._buckets)):
-            level = 2 ** i
-            repr += f"level {level}: {self._buckets[level]}"
+        for i, buckets in enumerate(self._levels):
+            repr += f"level {2 ** i}: {list(buckets)}"
             repr += '\n'
 
-        return repr
\ No newline at end of file
+        return repr
+
+
+def _concatenate(columns: List[np.ndarray], dtype) -> np.ndarray:
+    """Concatenate columns, empty array of dtype if there are none
+
+    :param columns: arrays to join
+    :param dtype: result dtype
+    :return: joined array
+    """
+    if len(columns) == 0:
+        return np.empty(0, dtype=dtype)
+
+    return np.concatenate(columns).astype(dtype, copy=False)
+
+
+def _bucket_bytes(bucket: Bucket) -> int:
+    """Approximate bytes of bucket, see SW_n_of_N._approximate_bytes
+
+    :param bucket: bucket to measure
+    :return: bytes
+    """
+    sketch = bucket.sketch
+    size = BUCKET_OVERHEAD + sketch.nbytes
+    if sketch._lists is not None:
+        size += sys.getsizeof(sketch._lists) + LIST_TUPLE_BYTES * len(sketch._lists[0])
+        size += sum(sys.getsizeof(column) for column in sketch._lists)
+    # cached columns are measured with their headers
+    if sketch._ranks is not None:
+        size += sys.getsizeof(sketch._ranks) + sum(sys.getsizeof(c) for c in sketch._ranks)
+    if bucket._lifted is not None:
+        # values and rmin are the cached ranks of sketch
+        size += sys.getsizeof(bucket._lifted) + sys.getsizeof(bucket._lifted[2])
+        size += sum(sys.getsizeof(part) for part in bucket._lifted_key)
+        size += sys.getsizeof(bucket._lifted_key)
+
+    return size
+
+
+def _share(used: int, floor: int, budget: int) -> float:
+    """Used share of budget above floor
+
+    :param used: used amount
+    :param floor: amount that cannot be released
+    :param budget: limit
+    :return: share, above 1 if used exceeds budget
+    """
+    if budget <= floor:
+        # more buckets than budget was checked for (merged shards)
+        return np.inf if used > budget else 0.0
+
+    return (used - floor) / (budget - floor)
+
+
+def _max_buckets(n: int, capacity: int) -> int:
+    """Upper bound of live buckets: at most (capacity - 1) buckets on
+    each of ⌊log2(n / (capacity - 1) + 1)⌋ + 1 levels
+
+    :param n: number of most recent points
+    :param capacity: number of buckets at which a level is merged
+    :return: number of buckets
+    """
+    per_level = capacity - 1
+    return per_level * (int(np.log2(n / per_level + 1)) + 1)
@@ -0,0 +1,436 @@
+"""
+Accuracy and throughput regression harness
+
+Runs long seeded streams through every algorithm and compares the answers
+of last-n queries with the exact sorted window. For every epsilon, N and n
+it reports maximum and percentile rank errors (divided by n) together
+with add throughput and query latency.
+
+A configuration fails if
+    - a rank error exceeds the guarantee of the algorithm
+      (SW n-of-N with GK buckets: epsilon·n, Exact: 0, Numpy: one rank
+      of interpolation), algorithms without deterministic window guarantee
+      are only reported
+    - a query raises
+    - add throughput or median query latency is worse than the stored budget
+
+Exit code is 1 if any configuration failed.
+
+Every configuration is timed --repeat times and the median is taken.
+Throughput and latency are stored and checked relative to the reference
+algorithm (--reference) of the same configuration and repeat, so budgets
+do not depend on the machine. A budget is kept for every algorithm,
+ingest, distribution, epsilon, N and n (the worst seed). Its margin is
+the spread of repeats (upper to lower quartile) times --budget-margin, so
+noisy configurations get looser limits and stable ones catch smaller
+regressions. p99 of a few dozen queries is dominated by timer and
+scheduler noise, so the median is used for latency.
+
+    python -m test.accuracy --budget test/accuracy_budget.json
+    python -m test.accuracy --budget test/accuracy_budget.json --save-budget -r 5
+    python -m test.accuracy -l 100000 -s 1 2 3 -a "SW n-of-N segment"
+"""
+import argparse
+import itertools
+import json
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional
+import numpy as np
+
+from test import streams
+from test.benchmark import ALGORITHMS, QUANTILES, rank_error
+
+POINT_INGEST = 'point'
+BATCH_INGEST = 'batch'
+INGESTS = (POINT_INGEST, BATCH_INGEST)
+
+PERCENTILES = (50, 95, 99)
+
+# name -> maximal allowed rank error divided by n, from (epsilon, n),
+# None if the algorithm has no deterministic guarantee over the window
+GUARANTEES: Dict[str, Optional[Callable[[float, int], float]]] = {
+    'Exact': lambda epsilon, n: 0.0,
+    # linear interpolation returns values between neighbouring points
+    'Numpy': lambda epsilon, n: 1 / n,
+    # GK summarizes the whole stream, not the last n points
+    'GK': None,
+    'SW n-of-N': lambda epsilon, n: epsilon,
+    'SW n-of-N segment': lambda epsilon, n: epsilon,
+    # ranks of KLL and DDSketch buckets are estimates
+    'SW n-of-N kll': None,
+    'SW n-of-N ddsketch': None
+}
+
+# ratios of rank errors are computed in floats
+BOUND_SLACK = 1e-9
+
+# timed metrics, median of repeats is kept
+TIMED_METRICS = ('add_throughput', 'query_p50_ns')
+
+
+def run_case(
+    name: str,
+    points: np.ndarray,
+    N: int,
+    n: int,
+    epsilon: float,
+    query_every: int,
+    ingest: str
+) -> Dict[str, Any]:
+    """Feed stream to one algorithm, query after every 'query_every'
+    points once n points arrived, and check answers against exact window
+
+    :param name: algorithm name from ALGORITHMS
+    :param points: input stream
+    :param N: window size
+    :param n: number of most recent points to query
+    :param epsilon: approximation coefficient
+    :param query_every: number of points between query rounds
+    :param ingest: 'point' - add every point, 'batch' - add_batch between query rounds
+    :return: metrics
+    """
+    factory, query = ALGORITHMS[name]
+    algo = factory(N, n, epsilon)
+    guarantee = GUARANTEES[name]
+    bound = None if guarantee is None else guarantee(epsilon, n)
+
+    add_ns = 0
+    query_ns = []
+    errors = []
+    exceptions = []
+    for start in range(0, len(points), query_every):
+        chunk = points[start:start + query_every]
+
+        if ingest == BATCH_INGEST:
+            begin = time.perf_counter_ns()
+            algo.add_batch(chunk, float(start))
+            add_ns += time.perf_counter_ns() - begin
+        else:
+            for i, point in enumerate(chunk):
+                begin = time.perf_counter_ns()
+                algo.add(point, ts=float(start + i))
+                add_ns += time.perf_counter_ns() - begin
+
+        end = start + len(chunk)
+        if end < n:
+            continue
+
+        begin = time.perf_counter_ns()
+        try:
+            values = np.asarray(query(algo, QUANTILES, n))
+        except Exception as e:
+            exceptions.append(f'after {end} points: {e}')
+            continue
+        query_ns.append(time.perf_counter_ns() - begin)
+
+        window = np.sort(points[end - n:end])
+        errors.append(rank_error(window, QUANTILES, values))
+
+    errors = np.concatenate(errors) if errors else np.zeros(0)
+    metrics = {
+        'queries': len(query_ns) + len(exceptions),
+        'bound': bound,
+        'max_rank_error': float(errors.max()) if len(errors) else 0.0,
+        'violations': 0 if bound is None else int((errors > bound + BOUND_SLACK).sum()),
+        'exceptions': exceptions,
+        'add_throughput': len(points) / max(add_ns / 1e9, 1e-9),
+        'query_p50_ns': float(np.percentile(query_ns, 50)) if query_ns else 0.0
+    }
+    for p in PERCENTILES:
+        metrics[f'p{p}_rank_error'] = float(np.percentile(errors, p)) if len(errors) else 0.0
+
+    return metrics
+
+
+def run_repeated(
+    names: List[str],
+    points: np.ndarray,
+    N: int,
+    n: int,
+    epsilon: float,
+    args,
+    reference: str
+) -> Dict[str, Dict[str, Any]]:
+    """Run configuration of every algorithm args.repeat times
+
+    Answers are deterministic, so errors are taken from the first repeat.
+    Timed metrics are medians over repeats, 'relative' holds median of
+    them divided by the ones of reference in the same repeat and 'spread'
+    the ratio of upper to lower quartile of every relative metric. Single
+    slow repeats (scheduler, GC) do not widen quartiles as they widen
+    the range
+
+    :param names: algorithm names from ALGORITHMS
+    :param points: input stream
+    :param N: window size
+    :param n: number of most recent points to query
+    :param epsilon: approximation coefficient
+    :param args: parsed command line arguments
+    :param reference: name of reference algorithm, measured if not in names
+    :return: metrics of every algorithm of names
+    """
+    measured = names if reference in names else names + [reference]
+    runs = {name: [] for name in measured}
+    for _ in range(args.repeat):
+        for name in measured:
+            runs[name].append(
+                run_case(name, points, N, n, epsilon, args.query_every, args.ingest)
+            )
+
+    metrics = {}
+    for name in names:
+        metrics[name] = dict(runs[name][0])
+        metrics[name]['relative'] = {}
+        metrics[name]['spread'] = {}
+        for metric in TIMED_METRICS:
+            values = np.array([run[metric] for run in runs[name]])
+            metrics[name][metric] = float(np.median(values))
+
+            base = np.array([run[metric] for run in runs[reference]])
+            if not (base > 0).all() or not (values > 0).all():
+                continue
+            relative = values / base
+            metrics[name]['relative'][metric] = float(np.median(relative))
+            low, high = np.percentile(relative, [25, 75])
+            metrics[name]['spread'][metric] = float(high / low)
+
+    return metrics
+
+
+def budget_key(record: Dict[str, Any]) -> str:
+    """Key of configuration in budget
+
+    :param record: result of configuration
+    :return: distribution, epsilon, N and n of configuration
+    """
+    return (
+        f'{record["distribution"]} eps={record["epsilon"]} '
+        f'N={record["N"]} n={record["n"]}'
+    )
+
+
+def check(
+    record: Dict[str, Any],
+    budget: Dict[str, Dict[str, Dict[str, Dict[str, float]]]]
+) -> List[str]:
+    """Reasons for failure of one configuration
+
+    :param record: result of configuration
+    :param budget: algorithm -> ingest -> configuration (see budget_key) ->
+        minimal relative 'add_throughput' and maximal relative 'query_p50_ns'
+    :return: failure descriptions, empty if configuration passed
+    """
+    metrics = record['metrics']
+    failures = [f'query raised {message}' for message in metrics['exceptions']]
+
+    if metrics['violations'] > 0:
+        failures.append(
+            f'{metrics["violations"]} answers exceed rank error bound '
+            f'{metrics["bound"]:.6g}, max {metrics["max_rank_error"]:.6g}'
+        )
+
+    limits = budget.get(record['algorithm'], {}).get(record['ingest'], {}).get(budget_key(record))
+    if limits is not None:
+        relative = metrics['relative']
+        reference = record['reference']
+        if 'add_throughput' in relative and relative['add_throughput'] < limits['add_throughput']:
+            failures.append(
+                f'add throughput {relative["add_throughput"]:.4g} of {reference} '
+                f'is below budget {limits["add_throughput"]:.4g}'
+            )
+        if 'query_p50_ns' in relative and relative['query_p50_ns'] > limits['query_p50_ns']:
+            failures.append(
+                f'query p50 {relative["query_p50_ns"]:.4g} of {reference} '
+                f'is above budget {limits["query_p50_ns"]:.4g}'
+            )
+
+    return failures
+
+
+def make_budget(
+    results: List[Dict[str, Any]],
+    margin: float
+) -> Dict[str, Dict[str, Dict[str, Dict[str, float]]]]:
+    """Budget from measured results: for every algorithm, ingest and
+    configuration the worst seed, loosened by the spread of its repeats
+    times margin
+
+    :param results: records of run_harness
+    :param margin: additional factor of throughput and latency limits
+    :return: algorithm -> ingest -> configuration -> relative
+        'add_throughput' and 'query_p50_ns'
+    """
+    budget = {}
+    for record in results:
+        relative = record['metrics']['relative']
+        spread = record['metrics']['spread']
+        if record['algorithm'] == record['reference'] or set(relative) != set(TIMED_METRICS):
+            continue
+
+        limits = budget.setdefault(record['algorithm'], {}).setdefault(
+            record['ingest'], {}
+        ).setdefault(
+            budget_key(record), {'add_throughput': np.inf, 'query_p50_ns': 0.0}
+        )
+        throughput = relative['add_throughput'] / (spread['add_throughput'] * margin)
+        latency = relative['query_p50_ns'] * spread['query_p50_ns'] * margin
+        limits['add_throughput'] = float(f'{min(limits["add_throughput"], throughput):.4g}')
+        limits['query_p50_ns'] = float(f'{max(limits["query_p50_ns"], latency):.4g}')
+
+    return budget
+
+
+def run_harness(args, budget: Dict[str, Dict[str, Dict[str, Dict[str, float]]]]) -> List[Dict[str, Any]]:
+    """Run all configurations of the sweep
+
+    :param args: parsed command line arguments
+    :param budget: see check
+    :return: one record per configuration and algorithm, with 'failures'
+    """
+    results = []
+    grid = itertools.product(args.distribution, args.seed, args.epsilon, args.window, args.last)
+    for distribution, seed, epsilon, N, n in grid:
+        if n > N:
+            continue
+
+        points = streams.generate(distribution, args.length, seed, args.order)
+        measured = run_repeated(args.algorithm, points, N, n, epsilon, args, args.reference)
+
+        for name in args.algorithm:
+            metrics = measured[name]
+            record = {
+                'algorithm': name,
+                'distribution': distribution,
+                'order': args.order,
+                'seed': seed,
+                'ingest': args.ingest,
+                'epsilon': epsilon,
+                'N': N,
+                'n': n,
+                'reference': args.reference,
+                'metrics': metrics
+            }
+            record['failures'] = check(record, budget)
+            results.append(record)
+
+            bound = '-' if metrics['bound'] is None else f'{metrics["bound"]:.4f}'
+            print(
+                f'{"FAIL" if record["failures"] else "ok":>4} '
+                f'{name:>19} {distribution:>9} seed={seed:<5} eps={epsilon:<6} N={N:<6} n={n:<6} '
+                f'max={metrics["max_rank_error"]:.4f} '
+                f'p99={metrics["p99_rank_error"]:.4f} '
+                f'p50={metrics["p50_rank_error"]:.4f} '
+                f'bound={bound} '
+                f'add/s={metrics["add_throughput"]:>10.0f}'
+            )
+            for failure in record['failures']:
+                print(f'     {failure}')
+
+    return results
+
+
+def main(args):
+    budget = {}
+    if args.budget is not None and not args.save_budget:
+        with open(args.budget) as f:
+            budget = json.load(f)
+
+    results = run_harness(args, budget)
+    failed = [record for record in results if record['failures']]
+    print(f'{len(failed)} of {len(results)} configurations failed')
+
+    with open(args.output, 'w') as f:
+        json.dump({
+            'config': {
+                'length': args.length,
+                'order': args.order,
+                'ingest': args.ingest,
+                'query_every': args.query_every,
+                'repeat': args.repeat,
+                'reference': args.reference,
+                'quantiles': QUANTILES.tolist()
+            },
+            'results': results
+        }, f, indent=2)
+
+    if args.save_budget and args.budget is not None:
+        with open(args.budget, 'w') as f:
+            json.dump(make_budget(results, args.budget_margin), f, indent=2)
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Accuracy and throughput regression harness'
+    )
+
+    parser.add_argument(
+        '-e', '--epsilon', type=float, nargs='+', default=[0.1, 0.05],
+        help='Approximation coefficients to sweep'
+    )
+    parser.add_argument(
+        '-N', '--window', type=int, nargs='+', default=[1000],
+        help='Window sizes N to sweep'
+    )
+    parser.add_argument(
+        '-n', '--last', type=int, nargs='+', default=[100, 1000],
+        help='Query sizes n to sweep, configurations with n > N are skipped'
+    )
+    parser.add_argument(
+        '-d', '--distribution', nargs='+', default=['normal', 'pareto', 'latency'],
+        choices=list(streams.DISTRIBUTIONS), help='Input distributions to sweep'
+    )
+    parser.add_argument(
+        '--order', default='random', choices=streams.ORDERS,
+        help='Order of points in every stream'
+    )
+    parser.add_argument(
+        '-a', '--algorithm', nargs='+', default=list(ALGORITHMS),
+        choices=list(ALGORITHMS), help='Algorithms to check'
+    )
+    parser.add_argument(
+        '-l', '--length', type=int, default=10000,
+        help='Number of points in every stream'
+    )
+    parser.add_argument(
+        '-s', '--seed', type=int, nargs='+', default=[2022],
+        help='Seeds of input streams to sweep'
+    )
+    parser.add_argument(
+        '--ingest', default=BATCH_INGEST, choices=INGESTS,
+        help='Add points one by one or as batches between queries'
+    )
+    parser.add_argument(
+        '--query-every', type=int, default=100,
+        help='Number of points between query rounds'
+    )
+    parser.add_argument(
+        '-r', '--repeat', type=int, default=3,
+        help='Number of timed runs of every configuration'
+    )
+    parser.add_argument(
+        '--reference', default='Numpy', choices=list(ALGORITHMS),
+        help='Algorithm throughput and latency are relative to'
+    )
+    parser.add_argument(
+        '-o', '--output', type=str, default='accuracy.json',
+        help='Path to results file'
+    )
+    parser.add_argument(
+        '-b', '--budget', type=str, default=None,
+        help='Path to throughput and latency budget'
+    )
+    parser.add_argument(
+        '--save-budget', action='store_true',
+        help='Store budget derived from results instead of checking it'
+    )
+    parser.add_argument(
+        '--budget-margin', type=float, default=1.5,
+        help='Factor between measured worst case (with spread of repeats) and saved budget'
+    )
+
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,430 @@
+"""
+Headless benchmark of quantile algorithms
+
+Sweeps epsilon, window N, query size n and input distribution with fixed
+seeds. For every configuration and algorithm it reports add throughput,
+p50/p99 add and query latency (perf_counter_ns), peak deep memory,
+rank error and relative value error of last-n queries against
+exact quantiles.  SW n-of-N is measured with every sketch backend.
+
+Results are written as JSON and, if a baseline is given, compared with it:
+metrics that got worse than the tolerance are reported as regressions
+and the exit code is 1. Timings depend on the machine, so no baseline is
+kept in the repository: store one locally before a change and compare
+after it on the same machine
+
+    python -m test.benchmark --baseline bench_baseline.json --save-baseline
+    python -m test.benchmark --output bench.json --baseline bench_baseline.json
+
+Throughput and latency are compared relative to the reference algorithm
+(--reference, Numpy by default) measured in the same run and configuration,
+so load of the machine and its speed cancel out. Memory and errors do not
+depend on timing and are compared as they are.
+"""
+import argparse
+import itertools
+import json
+import sys
+import time
+from typing import Any, Callable, Dict, List, Tuple
+import numpy as np
+
+from structures.sw import SW_n_of_N, SUFFIX_MODE, SEGMENT_MODE
+from structures.gk import GK
+from structures.np_quantile import NumpyQuantile
+from structures.exact_quantile import ExactQuantile
+from structures.sketches.backends import KLL_BACKEND, DDSKETCH_BACKEND
+from test import streams
+
+QUANTILES = np.arange(1, 20) / 20
+
+# name -> (factory(N, n, epsilon), query(algorithm, qs, n))
+ALGORITHMS: Dict[str, Tuple[Callable, Callable]] = {
+    'Numpy': (
+        lambda N, n, epsilon: NumpyQuantile(n=n),
+        lambda algo, qs, n: algo.query_many(qs, last_n=True)
+    ),
+    'Exact': (
+        lambda N, n, epsilon: ExactQuantile(n=n),
+        lambda algo, qs, n: algo.query_many(qs)
+    ),
+    'GK': (
+        lambda N, n, epsilon: GK(epsilon=epsilon),
+        lambda algo, qs, n: algo.query_many(qs)
+    ),
+    'SW n-of-N': (
+        lambda N, n, epsilon: SW_n_of_N(N, epsilon, mode=SUFFIX_MODE, verbose=False),
+        lambda algo, qs, n: algo.query_many(qs, n=n)
+    ),
+    'SW n-of-N segment': (
+        lambda N, n, epsilon: SW_n_of_N(N, epsilon, mode=SEGMENT_MODE, verbose=False),
+        lambda algo, qs, n: algo.query_many(qs, n=n)
+    ),
+    'SW n-of-N kll': (
+        lambda N, n, epsilon: SW_n_of_N(N, epsilon, verbose=False, backend=KLL_BACKEND),
+        lambda algo, qs, n: algo.query_many(qs, n=n)
+    ),
+    'SW n-of-N ddsketch': (
+        lambda N, n, epsilon: SW_n_of_N(N, epsilon, verbose=False, backend=DDSKETCH_BACKEND),
+        lambda algo, qs, n: algo.query_many(qs, n=n)
+    )
+}
+
+# metric -> True if higher value is better
+METRICS = {
+    'add_throughput': True,
+    'add_p50_ns': False,
+    'add_p99_ns': False,
+    'query_p50_ns': False,
+    'query_p99_ns': False,
+    'peak_memory_bytes': False,
+    'max_rank_error': False,
+    'mean_rank_error': False,
+    'max_value_error': False
+}
+
+# metrics measured with timer, compared relative to reference algorithm
+TIMED_METRICS = {'add_throughput', 'add_p50_ns', 'add_p99_ns', 'query_p50_ns', 'query_p99_ns'}
+
+# latency changes below this are timer noise, not regressions
+NOISE_NS = 1000
+
+
+def rank_error(sorted_window: np.ndarray, qs: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """Relative distance between rank ⌈φn⌉ and ranks of returned values
+
+    :param sorted_window: exact sorted points of the window
+    :param qs: φ-quantiles
+    :param values: answers of algorithm
+    :return: rank error divided by n for every quantile
+    """
+    n = len(sorted_window)
+    target = np.ceil(qs * n)
+    left = np.searchsorted(sorted_window, values, side='left') + 1
+    # values between points (interpolated) take the rank of the next point
+    right = np.maximum(np.searchsorted(sorted_window, values, side='right'), left)
+    error = np.maximum(np.maximum(left - target, target - right), 0)
+
+    return error / n
+
+
+def value_error(sorted_window: np.ndarray, qs: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """Relative distance between returned values and points of rank ⌈φn⌉
+
+    :param sorted_window: exact sorted points of the window
+    :param qs: φ-quantiles
+    :param values: answers of algorithm
+    :return: |value - exact| / |exact| for every quantile
+    """
+    target = np.ceil(qs * len(sorted_window)).astype(np.int64)
+    exact = sorted_window[target - 1]
+
+    return np.abs(values - exact) / np.maximum(np.abs(exact), np.finfo(float).tiny)
+
+
+def run_case(
+    name: str,
+    points: np.ndarray,
+    N: int,
+    n: int,
+    epsilon: float,
+    queries: int
+) -> Dict[str, Any]:
+    """Feed points to one algorithm and measure it
+
+    :param name: algorithm name from ALGORITHMS
+    :param points: input stream
+    :param N: window size
+    :param n: number of most recent points to query
+    :param epsilon: approximation coefficient
+    :param queries: number of query rounds, evenly spaced after n points
+    :return: metrics
+    """
+    factory, query = ALGORITHMS[name]
+    algo = factory(N, n, epsilon)
+
+    query_at = set(np.linspace(n, len(points), queries, dtype=int).tolist())
+    add_ns = np.empty(len(points), dtype=np.int64)
+    query_ns = []
+    errors = []
+    value_errors = []
+    peak_memory = 0
+
+    for i, point in enumerate(points):
+        start = time.perf_counter_ns()
+        algo.add(point, ts=float(i))
+        add_ns[i] = time.perf_counter_ns() - start
+
+        if i + 1 not in query_at:
+            continue
+
+        start = time.perf_counter_ns()
+        values = query(algo, QUANTILES, n)
+        query_ns.append(time.perf_counter_ns() - start)
+
+        window = np.sort(points[i + 1 - n:i + 1])
+        errors.append(rank_error(window, QUANTILES, np.asarray(values)))
+        value_errors.append(value_error(window, QUANTILES, np.asarray(values)))
+        peak_memory = max(peak_memory, algo.memory_usage())
+
+    errors = np.concatenate(errors)
+
+    return {
+        'add_throughput': len(points) / (add_ns.sum() / 1e9),
+        'add_p50_ns': float(np.percentile(add_ns, 50)),
+        'add_p99_ns': float(np.percentile(add_ns, 99)),
+        'query_p50_ns': float(np.percentile(query_ns, 50)),
+        'query_p99_ns': float(np.percentile(query_ns, 99)),
+        'peak_memory_bytes': peak_memory,
+        'max_rank_error': float(errors.max()),
+        'mean_rank_error': float(errors.mean()),
+        'max_value_error': float(np.concatenate(value_errors).max())
+    }
+
+
+def run_benchmark(args) -> List[Dict[str, Any]]:
+    """Run all configurations of the sweep
+
+    :param args: parsed command line arguments
+    :return: one record per configuration and algorithm
+    """
+    results = []
+    grid = itertools.product(args.distribution, args.epsilon, args.window, args.last)
+    for distribution, epsilon, N, n in grid:
+        if n > N:
+            continue
+
+        points = streams.generate(distribution, args.length, args.seed, args.order)
+
+        for name in args.algorithm:
+            metrics = run_case(name, points, N, n, epsilon, args.queries)
+            record = {
+                'algorithm': name,
+                'distribution': distribution,
+                'order': args.order,
+                'epsilon': epsilon,
+                'N': N,
+                'n': n,
+                'metrics': metrics
+            }
+            results.append(record)
+            print(
+                f'{name:>19} {distribution:>9} eps={epsilon:<6} N={N:<6} n={n:<6} '
+                f'add/s={metrics["add_throughput"]:>10.0f} '
+                f'query p50={metrics["query_p50_ns"] / 1e3:>8.1f}us '
+                f'mem={metrics["peak_memory_bytes"]:>9} '
+                f'max err={metrics["max_rank_error"]:.4f}'
+            )
+
+    return results
+
+
+def _key(record: Dict[str, Any]) -> Tuple:
+    return (
+        record['algorithm'], record['distribution'], record.get('order', 'random'),
+        record['epsilon'], record['N'], record['n']
+    )
+
+
+def _relative(records: List[Dict[str, Any]], reference: str) -> Dict[Tuple, Dict[str, float]]:
+    """Timed metrics of every record divided by the ones of reference
+    algorithm in the same configuration
+
+    :param records: records of one run
+    :param reference: name of reference algorithm
+    :return: relative timed metrics by record key,
+        records without reference in their configuration are skipped
+    """
+    references = {
+        _key(record)[1:]: record['metrics']
+        for record in records if record['algorithm'] == reference
+    }
+    relative = {}
+    for record in records:
+        base = references.get(_key(record)[1:])
+        if base is None or record['algorithm'] == reference:
+            continue
+        relative[_key(record)] = {
+            metric: record['metrics'][metric] / base[metric]
+            for metric in TIMED_METRICS if base.get(metric)
+        }
+
+    return relative
+
+
+def compare(
+    results: List[Dict[str, Any]],
+    baseline: List[Dict[str, Any]],
+    tolerance: float,
+    error_tolerance: float,
+    reference: str = 'Numpy'
+) -> List[Dict[str, Any]]:
+    """Diff results against baseline. Timed metrics are compared as ratios
+    to reference algorithm of the same run, see module docstring
+
+    :param results: current records
+    :param baseline: stored records
+    :param tolerance: allowed relative change of time and memory metrics
+    :param error_tolerance: allowed absolute growth of rank and value error
+    :param reference: algorithm timed metrics are divided by
+    :return: one entry per metric of every matching record,
+        with 'regression' flag
+    """
+    stored = {_key(record): record['metrics'] for record in baseline}
+    stored_relative = _relative(baseline, reference)
+    current_relative = _relative(results, reference)
+    diff = []
+    for record in results:
+        before = stored.get(_key(record))
+        if before is None:
+            continue
+
+        for metric, higher_is_better in METRICS.items():
+            # baselines of older runs miss newer metrics
+            if metric not in before:
+                continue
+            old = before[metric]
+            new = record['metrics'][metric]
+            if metric in TIMED_METRICS:
+                old = stored_relative.get(_key(record), {}).get(metric)
+                new = current_relative.get(_key(record), {}).get(metric)
+                # timings without reference are not comparable between runs
+                if old is None or new is None:
+                    continue
+
+            if metric.endswith('_error'):
+                regression = new - old > error_tolerance
+            elif metric.endswith('_ns'):
+                absolute = record['metrics'][metric] - before[metric]
+                regression = new > old * (1 + tolerance) and absolute > NOISE_NS
+            elif higher_is_better:
+                regression = new < old * (1 - tolerance)
+            else:
+                regression = new > old * (1 + tolerance)
+
+            diff.append({
+                'key': list(_key(record)),
+                'metric': metric,
+                'relative_to': reference if metric in TIMED_METRICS else None,
+                'baseline': old,
+                'current': new,
+                'change': (new - old) / old if old else 0.0,
+                'regression': bool(regression)
+            })
+
+    return diff
+
+
+def main(args):
+    results = run_benchmark(args)
+    report = {
+        'config': {
+            'seed': args.seed,
+            'length': args.length,
+            'order': args.order,
+            'queries': args.queries,
+            'quantiles': QUANTILES.tolist()
+        },
+        'results': results
+    }
+
+    if args.baseline is not None and not args.save_baseline:
+        if args.reference not in args.algorithm:
+            print(f'{args.reference} is not measured, timed metrics are not compared')
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        report['diff'] = compare(
+            results, baseline, args.tolerance, args.error_tolerance, args.reference
+        )
+
+        regressions = [entry for entry in report['diff'] if entry['regression']]
+        for entry in regressions:
+            metric = entry['metric']
+            if entry['relative_to'] is not None:
+                metric = f'{metric} / {entry["relative_to"]}'
+            print(
+                f'REGRESSION {entry["key"]} {metric}: '
+                f'{entry["baseline"]:.6g} -> {entry["current"]:.6g} '
+                f'({entry["change"]:+.1%})'
+            )
+        print(f'{len(regressions)} regressions against {args.baseline}')
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    if args.save_baseline and args.baseline is not None:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if any(entry['regression'] for entry in report.get('diff', [])):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Headless benchmark of quantile algorithms'
+    )
+
+    parser.add_argument(
+        '-e', '--epsilon', type=float, nargs='+', default=[0.1, 0.05],
+        help='Approximation coefficients to sweep'
+    )
+    parser.add_argument(
+        '-N', '--window', type=int, nargs='+', default=[1000],
+        help='Window sizes N to sweep'
+    )
+    parser.add_argument(
+        '-n', '--last', type=int, nargs='+', default=[250, 1000],
+        help='Query sizes n to sweep, configurations with n > N are skipped'
+    )
+    parser.add_argument(
+        '-d', '--distribution', nargs='+', default=['normal', 'lognormal'],
+        choices=list(streams.DISTRIBUTIONS), help='Input distributions to sweep'
+    )
+    parser.add_argument(
+        '--order', default='random', choices=streams.ORDERS,
+        help='Order of points in every stream'
+    )
+    parser.add_argument(
+        '-a', '--algorithm', nargs='+', default=list(ALGORITHMS),
+        choices=list(ALGORITHMS), help='Algorithms to measure'
+    )
+    parser.add_argument(
+        '-l', '--length', type=int, default=3000,
+        help='Number of points in every stream'
+    )
+    parser.add_argument(
+        '-q', '--queries', type=int, default=50,
+        help='Number of query rounds per stream'
+    )
+    parser.add_argument(
+        '-s', '--seed', type=int, default=2022,
+        help='Seed of input streams'
+    )
+    parser.add_argument(
+        '-o', '--output', type=str, default='benchmark.json',
+        help='Path to results file'
+    )
+    parser.add_argument(
+        '-b', '--baseline', type=str, default=None,
+        help='Path to baseline results to compare with'
+    )
+    parser.add_argument(
+        '--save-baseline', action='store_true',
+        help='Store results as new baseline instead of comparing'
+    )
+    parser.add_argument(
+        '--reference', default='Numpy', choices=list(ALGORITHMS),
+        help='Algorithm timed metrics are compared relative to'
+    )
+    parser.add_argument(
+        '--tolerance', type=float, default=0.5,
+        help='Allowed relative change of time and memory metrics'
+    )
+    parser.add_argument(
+        '--error-tolerance', type=float, default=0.005,
+        help='Allowed absolute growth of rank and value error'
+    )
+
+    args = parser.parse_args()
+    main(args)
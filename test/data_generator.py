@@ -10,6 +10,8 @@ class Generator():
         seed = 2022
     ):
         self.seed = seed
+        self.rng = np.random.default_rng(seed)
+        self.random = random.Random(seed)
         self.history = []
         self.timestamps = []
 
@@ -23,7 +25,7 @@ class Generator():
         if delay:
             self.delay()
 
-        sample = np.random.normal(mean, std)
+        sample = self.rng.normal(mean, std)
         timestamp = time.time()
 
         self.history.append(sample)
@@ -31,7 +33,28 @@ class Generator():
 
         yield (sample, timestamp)
 
+    def batch_data(
+        self,
+        size,
+        mean=0,
+        std=1/12
+    ):
+        """Generate the whole stream at once without sleeping,
+        timestamps follow the random delays of simple_data.
+        Points are not kept in history
+
+        :param size: number of points
+        :param mean: mean of normal distribution
+        :param std: standard deviation of normal distribution
+        :return: points and their timestamps as float64 arrays
+        """
+        samples = self.rng.normal(mean, std, size)
+        delays = self.rng.integers(0, 4, size) / 10
+        timestamps = time.time() + np.cumsum(delays)
+
+        return samples, timestamps
+
     def delay(self):
         # random delay between 0 and 1 second
-        delay_time = random.randint(0, 3)/10
+        delay_time = self.random.randint(0, 3)/10
         time.sleep(delay_time)
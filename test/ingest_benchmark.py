@@ -0,0 +1,127 @@
+"""
+Ingestion throughput of SW n-of-N sketches
+
+Feeds the same seeded stream point by point, once with small sketches
+kept in python lists between adds and once with every point inserted into
+the numpy columns directly (LIST_CAPACITY = 0). Both variants run in the
+same process one after another, so the speedup does not depend on the
+machine. Batches are always merged into the columns, their throughput
+is reported for comparison.
+
+    python -m test.ingest_benchmark -N 10000 -e 0.05 -l 20000
+"""
+import argparse
+import time
+import numpy as np
+
+from structures.sw import SW_n_of_N, SUFFIX_MODE, SEGMENT_MODE
+from structures.sketches import sketch
+from test import streams
+
+LISTS = 'lists'
+COLUMNS = 'columns'
+
+
+def add_points(
+    points: np.ndarray,
+    N: int,
+    epsilon: float,
+    mode: str
+) -> float:
+    """Add throughput of points added one by one
+
+    :param points: input stream
+    :param N: window size
+    :param epsilon: approximation coefficient
+    :param mode: SW n-of-N mode
+    :return: points per second
+    """
+    sw = SW_n_of_N(N, epsilon, mode=mode, verbose=False)
+    begin = time.perf_counter()
+    for i, point in enumerate(points):
+        sw.add(point, ts=float(i))
+
+    return len(points) / (time.perf_counter() - begin)
+
+
+def add_batches(
+    points: np.ndarray,
+    N: int,
+    epsilon: float,
+    mode: str,
+    batch_size: int
+) -> float:
+    """Add throughput of points added in batches
+
+    :param points: input stream
+    :param N: window size
+    :param epsilon: approximation coefficient
+    :param mode: SW n-of-N mode
+    :param batch_size: number of points in every add_batch
+    :return: points per second
+    """
+    sw = SW_n_of_N(N, epsilon, mode=mode, verbose=False)
+    begin = time.perf_counter()
+    for start in range(0, len(points), batch_size):
+        sw.add_batch(points[start:start + batch_size], float(start))
+
+    return len(points) / (time.perf_counter() - begin)
+
+
+def main(args):
+    points = streams.generate(args.distribution, args.length, args.seed, 'random')
+    list_capacity = sketch.LIST_CAPACITY
+
+    throughput = {}
+    try:
+        for variant, capacity in ((LISTS, list_capacity), (COLUMNS, 0)):
+            sketch.LIST_CAPACITY = capacity
+            throughput[variant] = add_points(points, args.window, args.epsilon, args.mode)
+    finally:
+        sketch.LIST_CAPACITY = list_capacity
+
+    print(
+        f'point add: lists {throughput[LISTS]:.0f}/s, '
+        f'columns {throughput[COLUMNS]:.0f}/s, '
+        f'speedup {throughput[LISTS] / throughput[COLUMNS]:.2f}x'
+    )
+    batches = add_batches(points, args.window, args.epsilon, args.mode, args.batch_size)
+    print(f'batch add: {batches:.0f}/s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Ingestion throughput of SW n-of-N sketches'
+    )
+
+    parser.add_argument(
+        '-N', '--window', type=int, default=10000,
+        help='Window size N'
+    )
+    parser.add_argument(
+        '-e', '--epsilon', type=float, default=0.05,
+        help='Approximation coefficient'
+    )
+    parser.add_argument(
+        '-l', '--length', type=int, default=20000,
+        help='Number of points in stream'
+    )
+    parser.add_argument(
+        '-m', '--mode', default=SUFFIX_MODE, choices=[SUFFIX_MODE, SEGMENT_MODE],
+        help='SW n-of-N mode'
+    )
+    parser.add_argument(
+        '-b', '--batch-size', type=int, default=100,
+        help='Number of points in every add_batch'
+    )
+    parser.add_argument(
+        '-d', '--distribution', default='normal', choices=list(streams.DISTRIBUTIONS),
+        help='Input distribution'
+    )
+    parser.add_argument(
+        '-s', '--seed', type=int, default=2022,
+        help='Seed of input stream'
+    )
+
+    args = parser.parse_args()
+    main(args)
@@ -4,6 +4,7 @@ from test.utils import *
 from structures.sw import SW_n_of_N
 from structures.gk import GK
 from structures.np_quantile import NumpyQuantile
+from structures.exact_quantile import ExactQuantile
 from test.data_generator import Generator
 from test.metric_monitor import Monitor
 
@@ -15,6 +16,9 @@ def main(args):
     N = args.number_of_points
 
     algos = {
+        'Exact': ExactQuantile(
+            n=N//10
+        ),
         'Numpy': NumpyQuantile(
             n=N//10
         ),
@@ -30,11 +34,19 @@ def main(args):
         algorithms=algos,
         data_generator=data_generator,
         N=N,
-        n=N//10
+        n=N//10,
+        trace_memory=args.trace_memory,
+        ground_truth='Exact'
     )
 
-    print('Starting simulation...')
-    monitor.run_simulation()
+    if args.parallel:
+        print('Starting parallel run...')
+        monitor.run_parallel(batch_size=args.batch_size)
+        for algo_name, seconds in monitor.wall_time.items():
+            print(f'{algo_name}: {seconds:.2f}s')
+    else:
+        print('Starting simulation...')
+        monitor.run_simulation()
 
     report = monitor.generate_report()
     with open('report.json', 'w') as f:
@@ -62,6 +74,25 @@ if __name__ == '__main__':
         help='Number of points to simulate'
     )
 
+    parser.add_argument(
+        '--trace-memory',
+        action='store_true',
+        help='Take tracemalloc snapshots of structures package'
+    )
+
+    parser.add_argument(
+        '--parallel',
+        action='store_true',
+        help='Run every algorithm in its own process without visualization'
+    )
+
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=10000,
+        help='Points added at once in parallel run'
+    )
+
     args = parser.parse_args()
 
     main(args)
\ No newline at end of file
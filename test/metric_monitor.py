@@ -1,16 +1,17 @@
 from test.data_generator import Generator
 from typing import List, Dict, Any
-import cv2
 import numpy as np
 from test.utils import id2key
-import sys
+import multiprocessing
+import os
+import queue
 import time
-from tabulate import tabulate
+import traceback
+import tracemalloc
+from multiprocessing import shared_memory
+import structures
 
-import matplotlib
-matplotlib.use('TkAgg')
-
-import matplotlib.pyplot as plt
+QUANTILES = np.arange(1, 11) / 10
 
 
 class Monitor():
@@ -20,7 +21,9 @@ class Monitor():
         data_generator: Generator,
         N: int,
         n: int,
-        plot_limit: int = 40
+        plot_limit: int = 40,
+        trace_memory: bool = False,
+        ground_truth: str = 'Numpy'
     ):
         self.generator = data_generator
         self.algos = algorithms
@@ -28,10 +31,19 @@ class Monitor():
         assert n < N, f'n can only be less than N. Got n = {n}, N = {N}'
         self.N = N
         self.n = n
+        # tracemalloc slows down all allocations, so add and query times
+        # are not comparable with runs without it
+        self.trace_memory = trace_memory
+        # name of algorithm whose answers are taken as true
+        self.ground_truth = ground_truth
         self.memory = {a_name: [] for a_name in algorithms.keys()}
+        # bytes allocated by every source file of structures package
+        self.traced_memory = []
         self.add_time = {a_name: [] for a_name in algorithms.keys()}
         self.query_time = {a_name: [] for a_name in algorithms.keys()}
         self.query_errors = {a_name: [] for a_name in algorithms.keys()}
+        # seconds every worker process took, see run_parallel
+        self.wall_time = {}
 
     def run_simulation(
         self,
@@ -40,9 +52,18 @@ class Monitor():
 
         key = None
         if visualize:
+            # plotting dependencies are needed only for the live view
+            import cv2
+            import matplotlib
+            matplotlib.use('TkAgg')
+            import matplotlib.pyplot as plt
+            from tabulate import tabulate
+
             fig = plt.figure(figsize=(20, 10))
 
         y_original = []
+        if self.trace_memory:
+            tracemalloc.start()
 
         while key != 'esc' and len(y_original) < self.N:
 
@@ -60,26 +81,25 @@ class Monitor():
             # size
             if len(y_original) % 20 == 0:
                 for algo_name, algo in self.algos.items():
-                    mem = sys.getsizeof(algo)
+                    mem = algo.memory_usage()
                     self.memory[algo_name].append(mem)
+                if self.trace_memory:
+                    self.traced_memory.append(self._snapshot())
 
             # query time and errors
             if len(y_original) > self.n:
                 self.queries = {
                     algo_name: [] for algo_name in self.algos.keys()
                 }
+                qs = QUANTILES
                 for algo_name, algo in self.algos.items():
-                    current_time = 0
-                    for q10 in range(1, 11):
-                        q = q10/10
-                        start = time.time()
-                        res = algo.query(q=q, last_n=True)
-                        current_time += time.time() - start
-                        self.queries[algo_name].append(res)
-                
-                    self.query_time[algo_name].append(current_time/10)
-                # take numpy res as true
-                true = np.array(self.queries['Numpy'])
+                    start = time.time()
+                    res = algo.query_many(qs, last_n=True)
+                    current_time = time.time() - start
+                    self.queries[algo_name].extend(res)
+
+                    self.query_time[algo_name].append(current_time/len(qs))
+                true = np.array(self.queries[self.ground_truth])
 
                 for algo_name in self.algos.keys():
                     err = np.power((true - self.queries[algo_name]), 2)
@@ -180,13 +200,202 @@ class Monitor():
 
         if visualize:
             cv2.destroyAllWindows()
+        if self.trace_memory:
+            tracemalloc.stop()
+
+    def run_parallel(self, batch_size: int = 10000):
+        """Run every algorithm in its own worker process over the same stream
+
+        All N points and timestamps are generated at once and placed in
+        shared memory. Every worker adds them in batches, measures memory
+        and queries after every batch once n points arrived, and sends its
+        measurements back. Errors against ground truth are computed when
+        all workers are done. So the run takes the time of the slowest
+        algorithm, and algorithms do not disturb each other's timings.
+        Times are per point (add) and per quantile (query) as in run_simulation
+
+        :param batch_size: number of points added at once
+        :raises Exception: If algorithm failed or its worker process died
+        """
+        points, timestamps = self.generator.batch_data(self.N)
+        memory = shared_memory.SharedMemory(create=True, size=2 * self.N * 8)
+        results = multiprocessing.Queue()
+        workers = {}
+        try:
+            stream = np.ndarray((2, self.N), dtype=np.float64, buffer=memory.buf)
+            stream[0] = points
+            stream[1] = timestamps
+            del stream
 
+            for algo_name, algo in self.algos.items():
+                workers[algo_name] = multiprocessing.Process(
+                    target=_run_worker,
+                    args=(
+                        algo_name, algo, memory.name, self.N, self.n,
+                        batch_size, self.trace_memory, results
+                    ),
+                    daemon=True
+                )
+                workers[algo_name].start()
+
+            reports = _collect(workers, results)
+            for worker in workers.values():
+                worker.join()
+        finally:
+            for worker in workers.values():
+                if worker.is_alive():
+                    worker.terminate()
+            memory.close()
+            memory.unlink()
+
+        self._merge(reports)
+
+    def _merge(self, reports: Dict[str, Dict[str, Any]]):
+        """Add measurements of worker processes to metrics
+
+        :param reports: report of every algorithm, see _run_worker
+        """
+        true = np.array(reports[self.ground_truth]['queries'])
+        for algo_name, report in reports.items():
+            self.memory[algo_name].extend(report['memory'])
+            self.add_time[algo_name].extend(report['add_time'])
+            self.query_time[algo_name].extend(report['query_time'])
+            self.wall_time[algo_name] = report['wall_time']
+
+            for res, true_res in zip(report['queries'], true):
+                err = np.power((true_res - np.array(res)), 2)
+                self.query_errors[algo_name].append(np.mean(err))
+
+        if self.trace_memory:
+            # run_simulation holds all structures in one process,
+            # so bytes of every file are summed over workers
+            for snapshots in zip(*(r['traced_memory'] for r in reports.values())):
+                total = {}
+                for snapshot in snapshots:
+                    for filename, size in snapshot.items():
+                        total[filename] = total.get(filename, 0) + size
+                self.traced_memory.append(total)
+
+    @staticmethod
+    def _snapshot() -> Dict[str, int]:
+        """Take tracemalloc snapshot of structures package
+
+        :return: allocated bytes by source file
+        """
+        package = list(structures.__path__)[0]
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(True, os.path.join(package, '*'))
+        ])
+
+        return {
+            os.path.relpath(stat.traceback[0].filename, package): stat.size
+            for stat in snapshot.statistics('filename')
+        }
 
     def generate_report(self) -> Dict:
         return {
             'memory': self.memory,
             'add_time': self.add_time,
             'query_time': self.query_time,
-            'query_errors': self.query_errors
+            'query_errors': self.query_errors,
+            'traced_memory': self.traced_memory
+        }
+
+
+def _run_worker(
+    algo_name: str,
+    algo: Any,
+    memory_name: str,
+    N: int,
+    n: int,
+    batch_size: int,
+    trace_memory: bool,
+    results: multiprocessing.Queue
+):
+    """Feed stream from shared memory to one algorithm, target of
+    worker process. Report or traceback of failure is put to results
+
+    :param algo_name: algorithm name
+    :param algo: algorithm
+    :param memory_name: name of shared memory with points and timestamps
+    :param N: number of points
+    :param n: number of most recent points to query
+    :param batch_size: number of points added at once
+    :param trace_memory: take tracemalloc snapshot after every batch
+    :param results: queue for report
+    """
+    try:
+        memory = shared_memory.SharedMemory(name=memory_name)
+        stream = np.ndarray((2, N), dtype=np.float64, buffer=memory.buf)
+        report = {
+            'name': algo_name,
+            'memory': [],
+            'add_time': [],
+            'query_time': [],
+            'queries': [],
+            'traced_memory': []
         }
+        if trace_memory:
+            tracemalloc.start()
+
+        begin = time.perf_counter()
+        for start in range(0, N, batch_size):
+            points = stream[0, start:start + batch_size]
+            timestamps = stream[1, start:start + batch_size]
+
+            tic = time.perf_counter()
+            algo.add_batch(points, timestamps)
+            report['add_time'].append((time.perf_counter() - tic) / len(points))
+
+            report['memory'].append(algo.memory_usage())
+            if trace_memory:
+                report['traced_memory'].append(Monitor._snapshot())
+
+            if start + len(points) > n:
+                tic = time.perf_counter()
+                res = algo.query_many(QUANTILES, last_n=True)
+                report['query_time'].append((time.perf_counter() - tic) / len(QUANTILES))
+                report['queries'].append(np.asarray(res, dtype=float).tolist())
+
+        report['wall_time'] = time.perf_counter() - begin
+
+        # views have to be released before shared memory is closed
+        del points, timestamps, stream
+        memory.close()
+        results.put(report)
+    except Exception:
+        results.put({'name': algo_name, 'error': traceback.format_exc()})
+
+
+def _collect(
+    workers: Dict[str, multiprocessing.Process],
+    results: multiprocessing.Queue
+) -> Dict[str, Dict[str, Any]]:
+    """Wait for reports of all workers
+
+    :param workers: worker process of every algorithm
+    :param results: queue workers put reports to
+    :raises Exception: If algorithm failed or its worker process died
+    :return: report of every algorithm
+    """
+    reports = {}
+    while len(reports) < len(workers):
+        try:
+            report = results.get(timeout=1)
+        except queue.Empty:
+            # worker that exited normally has put its report already
+            for algo_name, worker in workers.items():
+                if algo_name not in reports and worker.exitcode not in (None, 0):
+                    raise Exception(
+                        f'Worker process of {algo_name} died with exit code {worker.exitcode}.'
+                    )
+            continue
+
+        if 'error' in report:
+            raise Exception(
+                f'Algorithm {report["name"]} failed in worker process:\n{report["error"]}'
+            )
+        reports[report['name']] = report
+
+    return reports
 
@@ -0,0 +1,144 @@
+"""
+Seeded, vectorized stream sources for simulations and benchmarks
+
+Streams are generated as whole numpy arrays (or chunks of them) from
+np.random.default_rng(seed), so the same seed always gives the same stream.
+Orders other than 'random' rearrange generated values to stress
+insert positions of GK sketches. Recorded streams are replayed
+from memory-mapped .npy files.
+"""
+from typing import Callable, Dict, Iterator
+import numpy as np
+
+DEFAULT_SEED = 2022
+DEFAULT_PERIOD = 1000
+
+# name -> generator(rng, size)
+DISTRIBUTIONS: Dict[str, Callable] = {
+    'normal': lambda rng, size: rng.normal(0, 1, size),
+    'lognormal': lambda rng, size: rng.lognormal(0, 1, size),
+    'uniform': lambda rng, size: rng.uniform(0, 1, size),
+    # heavy tail, shape 1.5 has finite mean but infinite variance
+    'pareto': lambda rng, size: rng.pareto(1.5, size) + 1,
+    'bimodal': lambda rng, size: np.where(
+        rng.random(size) < 0.7, rng.normal(0, 1, size), rng.normal(8, 0.5, size)
+    ),
+    # integer milliseconds, a few hundred distinct values
+    'latency': lambda rng, size: np.rint(rng.lognormal(3, 0.6, size)).astype(np.int64)
+}
+
+ORDERS = ('random', 'sorted', 'reverse', 'sawtooth')
+
+
+def generate(
+    distribution: str,
+    size: int,
+    seed: int = DEFAULT_SEED,
+    order: str = 'random',
+    period: int = DEFAULT_PERIOD
+) -> np.ndarray:
+    """Generate whole stream
+
+    :param distribution: name from DISTRIBUTIONS
+    :param size: number of points
+    :param seed: random seed
+    :param order: 'random' - as generated, 'sorted' - increasing,
+        'reverse' - decreasing, 'sawtooth' - increasing runs of 'period' points,
+        every run spans the whole value range
+    :param period: length of sawtooth run
+    :raises Exception: If distribution or order is unknown
+    :return: 1-d array of points
+    """
+    _validate(distribution, order)
+    rng = np.random.default_rng(seed)
+    points = DISTRIBUTIONS[distribution](rng, size)
+
+    if order == 'sorted':
+        points = np.sort(points)
+    elif order == 'reverse':
+        points = np.sort(points)[::-1].copy()
+    elif order == 'sawtooth':
+        runs = -(-size // period)
+        padded = np.full(runs * period, np.inf)
+        padded[:size] = points
+        padded = np.sort(padded.reshape(runs, period), axis=1).ravel()
+        # padding of the last run sorts to its end
+        points = padded[:size].astype(points.dtype)
+
+    return points
+
+
+def chunks(
+    distribution: str,
+    size: int,
+    chunk_size: int,
+    seed: int = DEFAULT_SEED,
+    order: str = 'random',
+    period: int = DEFAULT_PERIOD
+) -> Iterator[np.ndarray]:
+    """Generate stream chunk by chunk. Random order streams are generated
+    lazily, so size may exceed memory. Other orders need the whole stream
+
+    :param distribution: name from DISTRIBUTIONS
+    :param size: number of points
+    :param chunk_size: number of points per chunk
+    :param seed: random seed
+    :param order: see generate
+    :param period: see generate
+    :return: iterator over 1-d arrays
+    """
+    if order != 'random':
+        points = generate(distribution, size, seed, order, period)
+        for start in range(0, size, chunk_size):
+            yield points[start:start + chunk_size]
+        return
+
+    # independent generator per chunk, same seed and chunk size
+    # give the same stream
+    _validate(distribution, order)
+    children = np.random.SeedSequence(seed).spawn(-(-size // chunk_size))
+    for i, child in enumerate(children):
+        count = min(chunk_size, size - i * chunk_size)
+        yield DISTRIBUTIONS[distribution](np.random.default_rng(child), count)
+
+
+def _validate(distribution: str, order: str) -> None:
+    """Check stream parameters
+
+    :param distribution: name from DISTRIBUTIONS
+    :param order: name from ORDERS
+    :raises Exception: If distribution or order is unknown
+    """
+    if distribution not in DISTRIBUTIONS:
+        raise Exception(
+            f'Distribution should be one of {tuple(DISTRIBUTIONS)}. Got {distribution}.'
+        )
+    if order not in ORDERS:
+        raise Exception(
+            f'Order should be one of {ORDERS}. Got {order}.'
+        )
+
+
+def record(path: str, points: np.ndarray) -> None:
+    """Store stream to .npy file for replay
+
+    :param path: file path
+    :param points: 1-d array of points
+    """
+    np.save(path, np.asarray(points))
+
+
+def replay(path: str, chunk_size: int = None) -> Iterator[np.ndarray]:
+    """Replay recorded stream from memory-mapped .npy file,
+    chunks are read-only views into the mapping
+
+    :param path: file path
+    :param chunk_size: number of points per chunk, whole stream by default
+    :return: iterator over 1-d arrays
+    """
+    points = np.load(path, mmap_mode='r')
+    if chunk_size is None:
+        chunk_size = max(len(points), 1)
+
+    for start in range(0, len(points), chunk_size):
+        yield points[start:start + chunk_size]
@@ -0,0 +1,45 @@
+from test.accuracy import check, make_budget
+
+
+def record(algorithm: str, throughput: float, latency: float, spread: float = 1.2, **metrics):
+    return {
+        'algorithm': algorithm, 'ingest': 'batch', 'reference': 'Numpy', 'distribution': 'normal',
+        'epsilon': 0.1, 'N': 1000, 'n': 100,
+        'metrics': {
+            'exceptions': [], 'violations': 0, 'bound': 0.1, 'max_rank_error': 0.05,
+            'relative': {'add_throughput': throughput, 'query_p50_ns': latency},
+            'spread': {'add_throughput': spread, 'query_p50_ns': spread},
+            **metrics
+        }
+    }
+
+
+def test_budget_takes_worst_record_and_spread_of_repeats():
+    budget = make_budget([
+        record('Numpy', 1.0, 1.0),
+        record('SW n-of-N', 0.002, 10.0, spread=1.1),
+        record('SW n-of-N', 0.001, 12.0, spread=1.2)
+    ], 1.5)
+
+    assert 'Numpy' not in budget
+    limits = budget['SW n-of-N']['batch']['normal eps=0.1 N=1000 n=100']
+    assert limits['add_throughput'] == round(0.001 / 1.8, 7)
+    assert limits['query_p50_ns'] == 21.6
+
+
+def test_check_fails_on_twice_slower_ingest():
+    budget = make_budget([record('SW n-of-N', 0.001, 10.0)], 1.5)
+
+    assert check(record('SW n-of-N', 0.0009, 11.0), budget) == []
+    failures = check(record('SW n-of-N', 0.0005, 30.0), budget)
+    assert len(failures) == 2
+    assert failures[0].startswith('add throughput')
+    assert failures[1].startswith('query p50')
+
+
+def test_check_reports_bound_violations_and_exceptions():
+    failing = record('SW n-of-N', 0.001, 10.0, violations=3, exceptions=['after 100 points: boom'])
+
+    failures = check(failing, {})
+    assert failures[0] == 'query raised after 100 points: boom'
+    assert failures[1].startswith('3 answers exceed rank error bound')
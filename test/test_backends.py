@@ -0,0 +1,137 @@
+import numpy as np
+import pytest
+
+from structures.sw import SW_n_of_N, SUFFIX_MODE, SEGMENT_MODE
+from structures.sketches.backends import KLL_BACKEND, DDSKETCH_BACKEND
+from structures.sketches.ddsketch import DDSketch, MAX_BUCKETS
+from structures.sketches.kll import KLLSketch
+from test.benchmark import rank_error, value_error
+from test.test_sw import QUANTILES
+
+EPSILON = 0.05
+
+
+def sketch_quantiles(sketch, qs: np.ndarray) -> np.ndarray:
+    """Values of the first items whose estimated rank reaches ⌈φn⌉"""
+    values, rmin, _ = sketch.get_rmin_rmax()
+    ranks = np.ceil(qs * rmin[-1])
+
+    return values[np.searchsorted(rmin, ranks, side='left')]
+
+
+def signed_lognormal(seed: int, size: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return rng.lognormal(size=size) * np.where(rng.random(size) < 0.3, -1, 1)
+
+
+def test_kll_keeps_weight_and_bounded_size():
+    points = np.random.default_rng(40).normal(size=20000)
+    sketch = KLLSketch(EPSILON / 2)
+    for nb, point in enumerate(points):
+        sketch.add(point, nb)
+        if (nb + 1) % 20 == 0:
+            sketch.compress(nb + 1)
+
+    values, gaps, deltas = sketch._columns()
+    # weights are powers of two and sum to number of points
+    assert gaps.sum() == len(points)
+    assert (gaps & (gaps - 1) == 0).all() and not deltas.any()
+    assert (np.diff(values) >= 0).all()
+    assert sketch.len() <= 3 * sketch.k
+
+
+def test_kll_merge_all_keeps_weight():
+    points = np.random.default_rng(41).normal(size=6000)
+    parts = []
+    for part in np.array_split(points, 3):
+        sketch = KLLSketch(EPSILON / 2)
+        sketch.add_batch(np.sort(part), 0)
+        sketch.compress(len(part))
+        parts.append(sketch)
+
+    merged = KLLSketch.merge_all(parts)
+    merged.compress(len(points))
+
+    assert merged._columns()[1].sum() == len(points)
+    assert merged.len() <= 3 * merged.k
+    errors = rank_error(np.sort(points), QUANTILES, sketch_quantiles(merged, QUANTILES))
+    assert errors.max() <= 2 * EPSILON
+
+
+@pytest.mark.parametrize('alpha', [0.01, 0.05])
+def test_ddsketch_value_error_within_alpha(alpha):
+    points = signed_lognormal(42, 20000)
+    sketch = DDSketch(alpha)
+    sketch.add_batch(points, 0)
+
+    assert sketch._columns()[1].sum() == len(points)
+    errors = value_error(np.sort(points), QUANTILES, sketch_quantiles(sketch, QUANTILES))
+    assert errors.max() <= alpha + 1e-9
+
+
+def test_ddsketch_points_and_batch_give_same_buckets():
+    points = signed_lognormal(43, 5000)
+    single, batched = DDSketch(0.01), DDSketch(0.01)
+    for point in points:
+        single.add(point, 0)
+    batched.add_batch(points, 0)
+
+    # scalar and vectorized log differ in the last bits only
+    np.testing.assert_allclose(single._columns()[0], batched._columns()[0], rtol=1e-9)
+    np.testing.assert_array_equal(single._columns()[1], batched._columns()[1])
+
+
+def test_ddsketch_merge_all_sums_counts():
+    points = signed_lognormal(44, 6000)
+    parts = []
+    for part in np.array_split(points, 4):
+        sketch = DDSketch(0.02)
+        sketch.add_batch(part, 0)
+        parts.append(sketch)
+    whole = DDSketch(0.02)
+    whole.add_batch(points, 0)
+
+    merged = DDSketch.merge_all(parts)
+    for a, b in zip(merged._columns(), whole._columns()):
+        np.testing.assert_array_equal(a, b)
+
+
+def test_ddsketch_collapses_lowest_buckets():
+    # every point gets its own bucket
+    points = 1.1 ** np.arange(MAX_BUCKETS + 100)
+    sketch = DDSketch(0.01)
+    sketch.add_batch(points, 0)
+    sketch.compress(len(points))
+
+    values, gaps, _ = sketch._columns()
+    assert len(values) == MAX_BUCKETS
+    assert gaps.sum() == len(points) and gaps[0] == 101
+
+
+def test_ddsketch_rounds_integer_values():
+    sketch = DDSketch(0.05, dtype=np.int64)
+    sketch.add_batch(np.arange(1, 1000), 0)
+
+    values = sketch._columns()[0]
+    assert values.dtype == np.int64
+    assert len(np.unique(values)) == len(values)
+
+
+@pytest.mark.parametrize('alpha', [0, 1, -0.1])
+def test_ddsketch_accuracy_should_be_in_unit_interval(alpha):
+    with pytest.raises(Exception):
+        DDSketch(alpha)
+
+
+@pytest.mark.parametrize('mode', [SUFFIX_MODE, SEGMENT_MODE])
+@pytest.mark.parametrize('backend', [KLL_BACKEND, DDSKETCH_BACKEND])
+def test_sw_backends_answer_last_n(mode, backend):
+    points = np.abs(signed_lognormal(45, 8000))
+    sw = SW_n_of_N(2000, EPSILON, mode=mode, backend=backend, verbose=False)
+    for start in range(0, len(points), 500):
+        sw.add_batch(points[start:start + 500], float(start))
+
+    for n in (100, 1000, 2000):
+        answers = np.asarray(sw.query_many(QUANTILES, n=n))
+        assert rank_error(np.sort(points[-n:]), QUANTILES, answers).max() <= EPSILON
+
@@ -0,0 +1,45 @@
+from test.benchmark import compare
+
+
+def record(algorithm: str, throughput: float, latency: float, error: float = 0.01):
+    return {
+        'algorithm': algorithm, 'distribution': 'normal', 'order': 'random',
+        'epsilon': 0.1, 'N': 1000, 'n': 250,
+        'metrics': {
+            'add_throughput': throughput,
+            'add_p50_ns': latency,
+            'peak_memory_bytes': 5000,
+            'max_rank_error': error
+        }
+    }
+
+
+def regressions(diff):
+    return {(entry['key'][0], entry['metric']) for entry in diff if entry['regression']}
+
+
+def test_slower_machine_is_not_a_regression():
+    baseline = [record('Numpy', 1e6, 1000), record('SW n-of-N', 1e4, 100000)]
+    # every algorithm is three times slower
+    results = [record('Numpy', 3.3e5, 3000), record('SW n-of-N', 3.3e3, 300000)]
+
+    assert regressions(compare(results, baseline, 0.5, 0.005)) == set()
+
+
+def test_slower_algorithm_is_a_regression():
+    baseline = [record('Numpy', 1e6, 1000), record('SW n-of-N', 1e4, 100000)]
+    results = [record('Numpy', 1e6, 1000), record('SW n-of-N', 4e3, 250000, 0.02)]
+
+    assert regressions(compare(results, baseline, 0.5, 0.005)) == {
+        ('SW n-of-N', 'add_throughput'),
+        ('SW n-of-N', 'add_p50_ns'),
+        ('SW n-of-N', 'max_rank_error')
+    }
+
+
+def test_timings_without_reference_are_skipped():
+    baseline = [record('SW n-of-N', 1e4, 100000)]
+    results = [record('SW n-of-N', 1e3, 900000)]
+
+    metrics = {entry['metric'] for entry in compare(results, baseline, 0.5, 0.005)}
+    assert metrics == {'peak_memory_bytes', 'max_rank_error'}
@@ -0,0 +1,124 @@
+import numpy as np
+import pytest
+
+from structures.sw import SW_n_of_N, SUFFIX_MODE, SEGMENT_MODE, _max_buckets
+from test.benchmark import rank_error
+from test.test_sw import QUANTILES
+
+N, EPSILON = 1000, 0.1
+CHUNK = 100
+
+
+def feed(sw: SW_n_of_N, points: np.ndarray, ingest: str, start: int):
+    """Add chunk of points one by one or at once"""
+    if ingest == 'point':
+        for i, point in enumerate(points):
+            sw.add(point, float(start + i))
+    else:
+        sw.add_batch(points, float(start))
+
+
+@pytest.mark.parametrize('ingest', ['point', 'batch'])
+@pytest.mark.parametrize('mode', [SUFFIX_MODE, SEGMENT_MODE])
+def test_approximate_bytes_follow_memory_usage(mode, ingest):
+    points = np.random.default_rng(50).normal(size=3 * N)
+    sw = SW_n_of_N(N, EPSILON, mode=mode, verbose=False)
+    for start in range(0, len(points), CHUNK):
+        feed(sw, points[start:start + CHUNK], ingest, start)
+        # query caches count as well
+        sw.query_many(QUANTILES, n=N // 2)
+
+        # per-point adds of suffix mode share point objects between buckets,
+        # the estimate counts them for every bucket
+        ratio = sw._approximate_bytes() / sw.memory_usage()
+        assert 0.95 <= ratio <= 1.25
+
+
+@pytest.mark.parametrize('ingest', ['point', 'batch'])
+@pytest.mark.parametrize('mode, max_bytes', [(SUFFIX_MODE, 253000), (SEGMENT_MODE, 177000)])
+def test_byte_budget_bounds_memory_usage(mode, max_bytes, ingest):
+    points = np.random.default_rng(51).normal(size=3 * N)
+    sw = SW_n_of_N(N, EPSILON / 2, mode=mode, verbose=False, max_bytes=max_bytes)
+    for start in range(0, len(points), CHUNK):
+        feed(sw, points[start:start + CHUNK], ingest, start)
+        assert sw.memory_usage() <= max_bytes
+
+        end = start + CHUNK
+        if end >= N:
+            answers = np.asarray(sw.query_many(QUANTILES, n=N))
+            errors = rank_error(np.sort(points[end - N:end]), QUANTILES, answers)
+            assert errors.max() <= sw.error_bound() + 1e-9
+
+    stats = sw.stats()
+    assert not stats['over_budget']
+    assert stats['approximate_bytes'] <= max_bytes
+
+
+def test_spare_capacity_is_released_before_coarsening():
+    points = np.random.default_rng(53).normal(size=3 * N)
+    free = SW_n_of_N(N, EPSILON / 2, verbose=False)
+    budgeted = SW_n_of_N(N, EPSILON / 2, verbose=False, max_bytes=300000)
+    for start in range(0, len(points), CHUNK):
+        free.add_batch(points[start:start + CHUNK], float(start))
+        budgeted.add_batch(points[start:start + CHUNK], float(start))
+
+    assert free.memory_usage() > 300000 >= budgeted.memory_usage()
+    assert budgeted.stats()['coarsenings'] == 0
+    assert budgeted.error_bound() == EPSILON / 2
+
+
+@pytest.mark.parametrize('seed', [53, 54, 55])
+def test_points_lose_no_more_accuracy_than_batches(seed):
+    points = np.random.default_rng(seed).normal(size=3 * N)
+    budgeted = {
+        ingest: SW_n_of_N(N, EPSILON / 2, verbose=False, max_bytes=260000)
+        for ingest in ('point', 'batch')
+    }
+    for start in range(0, len(points), CHUNK):
+        for ingest, sw in budgeted.items():
+            feed(sw, points[start:start + CHUNK], ingest, start)
+            assert sw.memory_usage() <= 260000
+
+    # python lists of single points are released before sketches are coarsened
+    assert budgeted['point'].error_bound() <= budgeted['batch'].error_bound()
+    # enforcing budget on every add would compress every bucket after every point
+    sw = budgeted['point']
+    assert sw.stats()['compressions'] < len(points) * len(sw._ordered) / 4
+
+
+def test_tuple_budget_bounds_tuples():
+    points = np.random.default_rng(52).normal(size=3 * N)
+    sw = SW_n_of_N(N, EPSILON, verbose=False, max_tuples=600)
+    for start in range(0, len(points), CHUNK):
+        sw.add_batch(points[start:start + CHUNK], float(start))
+        assert sw.stats()['tuples'] <= 600
+
+    assert sw.error_bound() > EPSILON
+
+
+@pytest.mark.parametrize('budget', [{'max_bytes': 20000}, {'max_bytes': 100000}, {'max_tuples': 200}])
+def test_budget_below_bucket_skeleton_is_refused(budget):
+    with pytest.raises(Exception, match='cannot be met'):
+        SW_n_of_N(10000, 0.01, verbose=False, **budget)
+
+
+@pytest.mark.parametrize('n, epsilon', [(1000, 0.1), (777, 0.2), (5000, 0.05), (100, 0.3), (50, 0.01)])
+def test_max_buckets_bounds_live_buckets(n, epsilon):
+    sw = SW_n_of_N(n, epsilon, verbose=False)
+    most = 0
+    # bucket bookkeeping of add without sketches
+    for _ in range(3 * n):
+        sw._create_new_sketch(0.0)
+        sw._drop_sketches()
+        sw._count += 1
+        most = max(most, len(sw._ordered))
+
+    assert most <= _max_buckets(n, sw._capacity)
+
+
+def test_merged_budget_is_sum_of_shards():
+    shards = [SW_n_of_N(N, EPSILON, verbose=False, max_bytes=200000) for _ in range(2)]
+    for k, shard in enumerate(shards):
+        shard.add_batch(np.arange(500.0), float(k))
+
+    assert SW_n_of_N.merge_all(shards).stats()['max_bytes'] == 400000
@@ -0,0 +1,113 @@
+import numpy as np
+import pytest
+
+from structures.gk import GK
+from structures.registry import SWRegistry
+from structures.sw import SW_n_of_N, SUFFIX_MODE, SEGMENT_MODE
+from structures.sketches.backends import BACKENDS, GK_BACKEND
+from test.test_sw import QUANTILES, partition
+
+
+def sketches(sw: SW_n_of_N):
+    """Tuples of every bucket sketch as lists"""
+    return [
+        [column.tolist() for column in bucket.sketch._columns()]
+        for bucket in sw._ordered
+    ]
+
+
+@pytest.mark.parametrize('mmap', [True, False])
+@pytest.mark.parametrize('mode', [SUFFIX_MODE, SEGMENT_MODE])
+@pytest.mark.parametrize('backend', list(BACKENDS))
+def test_sw_round_trip(tmp_path, mmap, mode, backend):
+    points = np.random.default_rng(20).normal(size=1300)
+    sw = SW_n_of_N(500, 0.1, mode=mode, window_seconds=400, backend=backend, verbose=False)
+    # single points stay in sketch lists, batches go to columns
+    for i, point in enumerate(points[:100]):
+        sw.add(point, ts=float(i))
+    sw.add_batch(points[100:], np.arange(100, len(points), dtype=float))
+
+    path = tmp_path / 'sw.ckpt'
+    sw.save(path)
+    restored = SW_n_of_N.load(path, mmap=mmap)
+
+    assert partition(restored) == partition(sw)
+    assert sketches(restored) == sketches(sw)
+    assert restored._count == sw._count
+    for n in (10, 200, 500):
+        np.testing.assert_array_equal(
+            restored.query_many(QUANTILES, n=n), sw.query_many(QUANTILES, n=n)
+        )
+    np.testing.assert_array_equal(
+        restored.query_many(QUANTILES, window_seconds=100),
+        sw.query_many(QUANTILES, window_seconds=100)
+    )
+
+
+@pytest.mark.parametrize('mmap', [True, False])
+def test_sw_keeps_ingesting_after_load(tmp_path, mmap):
+    rng = np.random.default_rng(21)
+    points = rng.normal(size=2000)
+    sw = SW_n_of_N(500, 0.1, backend=GK_BACKEND, verbose=False)
+    sw.add_batch(points[:1000], 0.0)
+
+    path = tmp_path / 'sw.ckpt'
+    sw.save(path)
+    restored = SW_n_of_N.load(path, mmap=mmap)
+    for structure in (sw, restored):
+        for point in points[1000:1100]:
+            structure.add(point, ts=1.0)
+        structure.add_batch(points[1100:], 2.0)
+
+    assert partition(restored) == partition(sw)
+    assert sketches(restored) == sketches(sw)
+    # the file is mapped copy-on-write and stays as saved
+    assert partition(SW_n_of_N.load(path, mmap=mmap)) != partition(sw)
+
+
+@pytest.mark.parametrize('mmap', [True, False])
+def test_gk_round_trip(tmp_path, mmap):
+    gk = GK(0.01)
+    gk.add_batch(np.random.default_rng(22).normal(size=3000))
+
+    path = tmp_path / 'gk.ckpt'
+    gk.save(path)
+    restored = GK.load(path, mmap=mmap)
+
+    assert restored.n == gk.n
+    np.testing.assert_array_equal(restored.query_many(QUANTILES), gk.query_many(QUANTILES))
+
+
+@pytest.mark.parametrize('mmap', [True, False])
+def test_registry_round_trip(tmp_path, mmap):
+    registry = SWRegistry(300, 0.1, max_live_keys=2)
+    rng = np.random.default_rng(23)
+    keys = rng.choice(['a', 'b', 7, 8], size=2000).tolist()
+    keys = [int(key) if key.isdigit() else key for key in keys]
+    registry.add_batch(keys, rng.normal(size=len(keys)), np.arange(len(keys), dtype=float))
+
+    path = tmp_path / 'registry.ckpt'
+    registry.save(path)
+    restored = SWRegistry.load(path, mmap=mmap)
+
+    assert restored.keys() == registry.keys()
+    assert restored.max_live_keys == 2
+    assert restored._last_seen == registry._last_seen
+    for key in registry.keys():
+        np.testing.assert_array_equal(
+            restored.query_many(key, QUANTILES), registry.query_many(key, QUANTILES)
+        )
+
+
+def test_load_checks_kind_of_structure(tmp_path):
+    gk = GK(0.1)
+    gk.add_batch(np.arange(10.0))
+    path = tmp_path / 'gk.ckpt'
+    gk.save(path)
+
+    with pytest.raises(Exception, match='Expected SW_n_of_N'):
+        SW_n_of_N.load(path)
+
+    path.write_bytes(b'not a checkpoint file')
+    with pytest.raises(Exception, match='not a checkpoint'):
+        GK.load(path)
@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+from structures import exact_quantile
+from structures.exact_quantile import ExactQuantile, SortedBlocks
+from test.test_sw import QUANTILES
+
+N = 200
+
+
+@pytest.fixture(params=[4, 512])
+def block_size(request, monkeypatch):
+    """Small blocks split and merge after a few updates"""
+    monkeypatch.setattr(exact_quantile, 'BLOCK_SIZE', request.param)
+    return request.param
+
+
+def assert_sorted_as(blocks: SortedBlocks, values: list, block_size: int):
+    """Blocks keep values in order with right maxima and bounded sizes"""
+    expected = sorted(values)
+    assert blocks.size == len(expected)
+    assert blocks.select(list(range(len(expected)))) == expected
+    assert blocks.maxes == [block[-1] for block in blocks.blocks]
+    assert all(0 < len(block) <= 2 * block_size for block in blocks.blocks)
+
+
+def test_inserts_and_removes_keep_order(block_size):
+    rng = np.random.default_rng(70)
+    # repeated values land in different blocks
+    values = rng.integers(0, 50, size=10 * block_size).tolist()
+    blocks = SortedBlocks()
+    for value in values:
+        blocks.insert(value)
+    assert_sorted_as(blocks, values, block_size)
+    assert len(blocks.blocks) > 1
+
+    rng.shuffle(values)
+    while len(values) > 1:
+        blocks.remove(values.pop())
+        if len(values) % 7 == 0:
+            assert_sorted_as(blocks, values, block_size)
+
+
+def test_reset_splits_values_into_blocks(block_size):
+    values = np.random.default_rng(71).normal(size=3 * block_size + 1).tolist()
+    blocks = SortedBlocks(values)
+
+    assert_sorted_as(blocks, values, block_size)
+    assert len(blocks.blocks) == 4
+
+
+def test_window_evicts_oldest_points(block_size):
+    algo = ExactQuantile(N)
+    stream = np.random.default_rng(72).normal(size=5 * N).tolist()
+    for i, point in enumerate(stream):
+        algo.add(point)
+        if i % 13 == 0:
+            window = stream[max(i + 1 - N, 0):i + 1]
+            np.testing.assert_array_equal(
+                algo.query_many(QUANTILES),
+                np.quantile(window, QUANTILES, method='inverted_cdf')
+            )
+
+    assert_sorted_as(algo._sorted, stream[-N:], block_size)
+
+
+@pytest.mark.parametrize('chunk', [N // 8 - 1, N // 8, N + 3])
+def test_batches_answer_as_points(block_size, chunk):
+    batched = ExactQuantile(N)
+    single = ExactQuantile(N)
+    rng = np.random.default_rng(73)
+    for _ in range(5):
+        points = rng.normal(size=chunk)
+        batched.add_batch(points)
+        for point in points:
+            single.add(point)
+
+        np.testing.assert_array_equal(
+            batched.query_many(QUANTILES), single.query_many(QUANTILES)
+        )
+        assert list(batched._fifo) == list(single._fifo)
+        assert_sorted_as(batched._sorted, list(single._fifo), block_size)
+
+
+def test_quantile_fraction_out_of_range_raises():
+    algo = ExactQuantile(N)
+    algo.add(1.0)
+    with pytest.raises(Exception, match='Quantile fraction'):
+        algo.query(0)
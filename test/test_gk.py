@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from structures.gk import GK
+from test.test_sw import QUANTILES
+
+
+def linear_scan(gk: GK, q: float):
+    """Quantile lookup of the original implementation: scan of all tuples
+    for the fitting one with rank bounds centered closest to the rank"""
+    rank = q * (gk.n - 1) + 1
+    margin = np.ceil(gk.epsilon * gk.n)
+
+    best_index, best_dist = -1, float('inf')
+    rmin = 0
+    for i, summary in enumerate(gk.summaries):
+        rmin += summary.gap
+        rmax = rmin + summary.delta
+        if rank - margin <= rmin and rmax <= rank + margin:
+            dist = abs(rank - (rmin + rmax) / 2)
+            if dist < best_dist:
+                best_index, best_dist = i, dist
+
+    assert best_index != -1
+    return gk.summaries[best_index].value
+
+
+@pytest.mark.parametrize('epsilon', [0.1, 0.01])
+@pytest.mark.parametrize('seed', [80, 81])
+def test_binary_search_answers_as_linear_scan(epsilon, seed):
+    gk = GK(epsilon)
+    rng = np.random.default_rng(seed)
+    # repeated values give equal rank bounds of neighbouring tuples
+    stream = np.concatenate((rng.normal(size=2000), rng.integers(0, 10, size=1000)))
+    qs = np.concatenate((QUANTILES, np.linspace(0, 1, 41)))
+    for i, point in enumerate(stream):
+        gk.add(point)
+        if i % 97 == 0:
+            np.testing.assert_array_equal(
+                gk.query_many(qs), [linear_scan(gk, q) for q in qs]
+            )
+
+
+def test_query_without_points_raises():
+    with pytest.raises(Exception, match='No elements'):
+        GK(0.1).query(0.5)
+
+
+def test_broken_sketch_raises_instead_of_answering():
+    gk = GK(0.1)
+    gk.add_batch(np.arange(100.0))
+    # tuple with rank uncertainty beyond epsilon
+    gk.sketch.flush()
+    gk.sketch.deltas[1:gk.sketch.size - 1] = gk.n
+    gk.sketch.version += 1
+
+    with pytest.raises(Exception, match='epsilon guarantee is violated'):
+        gk.query(0.5)
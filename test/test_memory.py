@@ -0,0 +1,42 @@
+import sys
+from collections import deque
+
+import numpy as np
+
+from structures.exact_quantile import ExactQuantile
+from structures.memory import deep_sizeof
+
+
+def test_deque_items_are_counted():
+    items = [float(i) + 0.5 for i in range(100)]
+    window = deque(items)
+
+    assert deep_sizeof(window) == sys.getsizeof(window) + sum(sys.getsizeof(x) for x in items)
+    assert deep_sizeof(window) == deep_sizeof(deque(items, maxlen=100))
+
+
+def test_shared_objects_are_counted_once():
+    items = [float(i) + 0.5 for i in range(100)]
+    both = (deque(items), list(items))
+
+    assert deep_sizeof(both) == (
+        sys.getsizeof(both) + sys.getsizeof(both[0]) + sys.getsizeof(both[1])
+        + sum(sys.getsizeof(x) for x in items)
+    )
+
+
+def test_views_count_header_only():
+    data = np.arange(1000.0)
+
+    assert deep_sizeof(data) >= data.nbytes
+    assert deep_sizeof(data[10:20]) < data.nbytes
+
+
+def test_exact_window_counts_points_of_fifo():
+    algo = ExactQuantile(100)
+    for point in np.random.default_rng(95).normal(size=300).tolist():
+        algo.add(point)
+
+    points = sum(sys.getsizeof(point) for point in algo._fifo)
+    assert deep_sizeof(algo._fifo) == sys.getsizeof(algo._fifo) + points
+    assert algo.memory_usage() > points
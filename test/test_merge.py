@@ -0,0 +1,112 @@
+import numpy as np
+import pytest
+
+from structures.sw import SW_n_of_N, SUFFIX_MODE, SEGMENT_MODE
+from structures.sketches.sketch import Sketch
+from test.benchmark import rank_error
+from test.test_sketch import EPSILON, check_bounds, feed
+from test.test_sw import QUANTILES, bursty_stream
+
+N = 1000
+
+
+def shard_stream(points, timestamps, shards: int, seed: int, **kwargs):
+    """Send every point to a random shard, merge shards.
+    Also return order of points in the union: by timestamp, then by shard
+    """
+    owner = np.random.default_rng(seed).integers(0, shards, size=len(points))
+    structures = []
+    for shard in range(shards):
+        sw = SW_n_of_N(N, EPSILON, verbose=False, **kwargs)
+        sw.add_batch(points[owner == shard], timestamps[owner == shard])
+        structures.append(sw)
+
+    order = np.lexsort((owner, timestamps))
+    return structures, SW_n_of_N.merge_all(structures), order
+
+
+def max_error(merged: SW_n_of_N, points, timestamps, shards: int) -> float:
+    """Largest rank error of last-n and last-T queries over the union"""
+    errors = []
+    for n in (50, 300, 800, shards * N):
+        answers = np.asarray(merged.query_many(QUANTILES, n=n))
+        errors.append(rank_error(np.sort(points[-n:]), QUANTILES, answers).max())
+
+    for window in (100.0, 700.0):
+        inside = points[timestamps >= timestamps[-1] - window]
+        answers = np.asarray(merged.query_many(QUANTILES, window_seconds=window))
+        errors.append(rank_error(np.sort(inside), QUANTILES, answers).max())
+
+    return max(errors)
+
+
+def test_sketch_merge_all_keeps_rank_bounds():
+    points = np.random.default_rng(30).normal(size=3000)
+    parts = np.array_split(points, 4)
+    sketches = []
+    for part in parts:
+        sketch = Sketch(EPSILON / 2)
+        feed(sketch, part)
+        sketches.append(sketch)
+
+    check_bounds(Sketch.merge_all(sketches), points)
+
+
+@pytest.mark.parametrize('mode', [SUFFIX_MODE, SEGMENT_MODE])
+@pytest.mark.parametrize('shards', [1, 2, 4])
+@pytest.mark.parametrize('seed', [0, 1])
+def test_merged_queries_within_documented_bound(mode, shards, seed):
+    points = np.random.default_rng(seed).normal(size=6000)
+    timestamps = np.arange(len(points), dtype=float)
+    _, merged, _ = shard_stream(points, timestamps, shards, seed, mode=mode)
+
+    lam = EPSILON / (EPSILON + 2)
+    assert merged._count == len(points)
+    assert max_error(merged, points, timestamps, shards) <= EPSILON + lam + 1e-9
+
+
+@pytest.mark.parametrize('shards', [2, 3])
+def test_merged_queries_with_shared_timestamps(shards):
+    # bursts of equal timestamps are spread over shards
+    points, timestamps = bursty_stream(31, 6000, 30)
+    _, merged, order = shard_stream(points, timestamps, shards, 31)
+
+    lam = EPSILON / (EPSILON + 2)
+    error = max_error(merged, points[order], timestamps[order], shards)
+    assert error <= EPSILON + lam + 1e-9
+
+
+def test_merged_bound_of_coarsened_shards():
+    points = np.random.default_rng(32).normal(size=6000)
+    timestamps = np.arange(len(points), dtype=float)
+    structures, merged, _ = shard_stream(points, timestamps, 3, 32, max_tuples=500)
+
+    bound = max(sw.error_bound() for sw in structures)
+    assert bound > EPSILON
+    assert merged.error_bound() <= bound
+    lam = EPSILON / (EPSILON + 2)
+    assert max_error(merged, points, timestamps, 3) <= bound + lam + 1e-9
+
+
+def test_merged_structure_keeps_ingesting():
+    points = np.random.default_rng(33).normal(size=4000)
+    timestamps = np.arange(len(points), dtype=float)
+    _, merged, _ = shard_stream(points[:3000], timestamps[:3000], 2, 33)
+    merged.add_batch(points[3000:], timestamps[3000:])
+
+    lam = EPSILON / (EPSILON + 2)
+    for n in (100, 1000, 2000):
+        answers = np.asarray(merged.query_many(QUANTILES, n=n))
+        assert rank_error(np.sort(points[-n:]), QUANTILES, answers).max() <= EPSILON + lam + 1e-9
+
+
+def test_merge_all_checks_parameters():
+    with pytest.raises(Exception, match='same epsilon'):
+        SW_n_of_N.merge_all([
+            SW_n_of_N(N, 0.1, verbose=False), SW_n_of_N(N, 0.2, verbose=False)
+        ])
+    with pytest.raises(Exception, match='same dtype'):
+        SW_n_of_N.merge_all([
+            SW_n_of_N(N, 0.1, verbose=False),
+            SW_n_of_N(N, 0.1, dtype=np.float32, verbose=False)
+        ])
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from structures.sw import SW_n_of_N
+from structures.np_quantile import NumpyQuantile
+from structures.exact_quantile import ExactQuantile
+from test.data_generator import Generator
+from test.metric_monitor import Monitor
+from test.utils import epsilon_validator, DEFAULT_EPSILON_PARAMETER
+
+N, BATCH_SIZE = 2000, 500
+
+
+class FailingQuantile(NumpyQuantile):
+    def add_batch(self, points, timestamps):
+        raise Exception('out of paper')
+
+
+def monitor(algos) -> Monitor:
+    return Monitor(
+        algorithms=algos, data_generator=Generator(), N=N, n=N // 10,
+        ground_truth='Exact'
+    )
+
+
+@pytest.mark.parametrize('value', ['0.00005', 0.00005, '1e-5'])
+def test_epsilon_validator_returns_value(value):
+    assert epsilon_validator(value) == float(value)
+
+
+def test_epsilon_validator_falls_back_to_default():
+    with pytest.warns(UserWarning):
+        assert epsilon_validator('0.1') == DEFAULT_EPSILON_PARAMETER
+
+
+@pytest.mark.parametrize('value', ['abc', '0'])
+def test_epsilon_validator_refuses_bad_values(value):
+    with pytest.raises(TypeError):
+        epsilon_validator(value)
+
+
+def test_run_parallel_reports_every_algorithm():
+    run = monitor({
+        'Exact': ExactQuantile(n=N // 10),
+        'Numpy': NumpyQuantile(n=N // 10),
+        'SW n-of-N': SW_n_of_N(n=N // 10, epsilon=0.00005, verbose=False)
+    })
+    run.run_parallel(batch_size=BATCH_SIZE)
+    report = run.generate_report()
+
+    batches = N // BATCH_SIZE
+    for algo_name in ('Exact', 'Numpy', 'SW n-of-N'):
+        assert len(report['memory'][algo_name]) == batches
+        assert len(report['add_time'][algo_name]) == batches
+        assert len(report['query_errors'][algo_name]) == batches
+        assert run.wall_time[algo_name] > 0
+    # ground truth is compared with itself
+    assert not np.any(report['query_errors']['Exact'])
+
+
+def test_run_parallel_raises_failure_of_worker():
+    run = monitor({
+        'Exact': ExactQuantile(n=N // 10),
+        'Broken': FailingQuantile(n=N // 10)
+    })
+
+    with pytest.raises(Exception, match='out of paper'):
+        run.run_parallel(batch_size=BATCH_SIZE)
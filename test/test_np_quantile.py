@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from structures.np_quantile import NumpyQuantile
+from test.test_sw import QUANTILES
+
+N = 100
+
+
+def assert_window(algo: NumpyQuantile, stream: list):
+    """Answers for the whole buffer and the latest n points match np.quantile"""
+    np.testing.assert_allclose(
+        algo.query_many(QUANTILES), np.quantile(stream[-algo.capacity:], QUANTILES)
+    )
+    np.testing.assert_allclose(
+        algo.query_many(QUANTILES, last_n=True), np.quantile(stream[-algo.n:], QUANTILES)
+    )
+
+
+@pytest.mark.parametrize('cache', [False, True])
+@pytest.mark.parametrize('capacity', [None, 3 * N])
+def test_points_after_wrap_around(cache, capacity):
+    algo = NumpyQuantile(N, capacity=capacity, cache=cache)
+    stream = np.random.default_rng(60).normal(size=7 * N + 13).tolist()
+    for point in stream:
+        algo.add(point)
+
+    assert_window(algo, stream)
+
+
+@pytest.mark.parametrize('cache', [False, True])
+def test_interleaved_adds_and_queries(cache):
+    algo = NumpyQuantile(N, capacity=2 * N, cache=cache)
+    # repeated values check removal of expired duplicates from cached window
+    points = np.random.default_rng(61).integers(0, 20, size=5 * N).astype(float)
+    stream = []
+    for i, point in enumerate(points):
+        algo.add(point)
+        stream.append(point)
+        if i % 7 == 0:
+            assert_window(algo, stream)
+
+
+@pytest.mark.parametrize('cache', [False, True])
+@pytest.mark.parametrize('chunk', [N // 3, N + 1, 5 * N])
+def test_batches_larger_than_window(cache, chunk):
+    algo = NumpyQuantile(N, capacity=2 * N, cache=cache)
+    stream = []
+    rng = np.random.default_rng(62)
+    for _ in range(6):
+        points = rng.normal(size=chunk)
+        algo.add_batch(points)
+        stream.extend(points.tolist())
+        assert_window(algo, stream)
+
+    assert algo.stats()['count'] == 6 * chunk
+
+
+def test_query_without_points_raises():
+    with pytest.raises(Exception, match='No elements'):
+        NumpyQuantile(N).query(0.5)
+
+
+def test_capacity_below_n_is_refused():
+    with pytest.raises(Exception):
+        NumpyQuantile(N, capacity=N - 1)
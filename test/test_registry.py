@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+
+from structures.memory import deep_sizeof
+from structures.registry import SWRegistry
+from test.test_sw import QUANTILES
+
+N, EPSILON = 500, 0.1
+
+
+def fill(registry: SWRegistry, keys: int, points: int, seed: int = 0):
+    """Add points to every key in one batch, return points of every key"""
+    rng = np.random.default_rng(seed)
+    key_column = np.repeat(np.arange(keys), points)
+    values = rng.normal(size=len(key_column))
+    registry.add_batch(key_column, values, 0.0)
+
+    return {key: values[key_column == key] for key in range(keys)}
+
+
+def test_idle_keys_are_packed_and_answer_as_live():
+    live = SWRegistry(N, EPSILON)
+    packed = SWRegistry(N, EPSILON, max_live_keys=3)
+    fill(live, 40, 300)
+    fill(packed, 40, 300)
+
+    assert packed.stats()['pending'] == 37
+    assert packed.memory < live.memory / 2
+    assert packed.memory_usage() < live.memory_usage() / 2
+
+    for key in range(40):
+        np.testing.assert_array_equal(
+            packed.query_many(key, QUANTILES), live.query_many(key, QUANTILES)
+        )
+        assert len(packed._live) <= 3
+
+
+def test_packed_key_keeps_accepting_points():
+    live = SWRegistry(N, EPSILON)
+    packed = SWRegistry(N, EPSILON, max_live_keys=1)
+    rng = np.random.default_rng(1)
+    for i, point in enumerate(rng.normal(size=900)):
+        live.add(i % 3, point, ts=float(i))
+        packed.add(i % 3, point, ts=float(i))
+
+    assert list(packed._live) == [2]
+    for key in range(3):
+        np.testing.assert_array_equal(
+            packed.query_many(key, QUANTILES), live.query_many(key, QUANTILES)
+        )
+
+
+def test_memory_accounting_follows_packing():
+    registry = SWRegistry(N, EPSILON, max_live_keys=2)
+    fill(registry, 10, 200)
+    assert registry.memory == sum(registry._sizes.values())
+
+    for key in range(10):
+        registry.query(key, 0.5)
+    registry.remove(9)
+    assert registry.memory == sum(registry._sizes.values())
+    assert 9 not in registry._live and len(registry) == 9
+
+
+def test_memory_accounting_follows_points_added_one_by_one():
+    registry = SWRegistry(N, EPSILON)
+    rng = np.random.default_rng(2)
+    for i, point in enumerate(rng.normal(size=20 * 150)):
+        registry.add(i % 20, point, ts=float(i))
+
+    measured = sum(deep_sizeof(stream) for stream in registry._streams.values())
+    assert 0.9 <= registry.memory / measured <= 1.25
+
+
+def test_memory_budget_evicts_least_recently_updated_keys():
+    # a live key with 100 points takes about 65 KB
+    registry = SWRegistry(N, EPSILON, memory_budget=200000, max_live_keys=2)
+    for key in range(30):
+        registry.add_batch([key] * 100, np.arange(100.0), 0.0)
+
+    assert registry.evicted > 0
+    assert registry.memory <= 200000
+    assert registry.keys() == list(range(registry.evicted, 30))
+
+
+def test_max_live_keys_should_be_positive():
+    with pytest.raises(Exception):
+        SWRegistry(N, EPSILON, max_live_keys=0)
+
+
+def test_add_batch_keeps_keys_of_different_types():
+    registry = SWRegistry(N, EPSILON)
+    registry.add_batch([1, '1', 1, (2, 3)], [1.0, 10.0, 2.0, 5.0], 0.0)
+
+    assert registry.keys() == [1, '1', (2, 3)]
+    assert registry.query(1, 1.0) == 2.0
+    assert registry.query('1', 1.0) == 10.0
@@ -0,0 +1,177 @@
+import asyncio
+import json
+
+import numpy as np
+
+from structures.registry import SWRegistry
+from structures.server import (
+    SWServer, BINARY_PROTOCOL, LINE_PROTOCOL, decode_frame, encode_frame, _LENGTH
+)
+
+
+def serve(test, **kwargs):
+    """Run coroutine test(server, port) against a server on a free TCP port"""
+    async def run(protocol):
+        server = SWServer(SWRegistry(1000, 0.1), **kwargs)
+        listener = await server.start(host='127.0.0.1', port=0, protocol=protocol)
+        try:
+            await test(server, listener.sockets[0].getsockname()[1])
+        finally:
+            await server.close()
+
+    return run
+
+
+async def request_lines(port: int, requests):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    responses = []
+    for request in requests:
+        writer.write(json.dumps(request).encode('utf-8') + b'\n')
+        await writer.drain()
+        responses.append(json.loads(await reader.readline()))
+    writer.close()
+
+    return responses
+
+
+def test_int_and_str_keys_stay_different():
+    async def test(server, port):
+        responses = await request_lines(port, [
+            {'op': 'add', 'key': 1, 'points': [1.0, 2.0, 3.0], 'timestamps': 0},
+            {'op': 'add', 'key': '1', 'points': [10.0, 20.0, 30.0], 'timestamps': 0},
+            {'op': 'query', 'key': 1, 'qs': [1.0]},
+            {'op': 'query', 'key': '1', 'qs': [1.0]}
+        ])
+
+        assert [r['ok'] for r in responses] == [True] * 4
+        assert responses[2]['values'] == [3.0]
+        assert responses[3]['values'] == [30.0]
+        assert sorted(server.registry.keys(), key=str) == [1, '1']
+
+    asyncio.run(serve(test)(LINE_PROTOCOL))
+
+
+def test_non_scalar_key_is_refused_and_server_keeps_flushing():
+    async def test(server, port):
+        responses = await request_lines(port, [
+            {'op': 'add', 'key': ['a'], 'points': [1.0]},
+            {'op': 'add', 'key': True, 'points': [1.0]},
+            {'op': 'add', 'key': 'a', 'points': [1.0, 2.0], 'timestamps': 0},
+            {'op': 'query', 'key': 'a', 'qs': [0.5]}
+        ])
+
+        assert not responses[0]['ok'] and 'Key should be str or int' in responses[0]['error']
+        assert not responses[1]['ok']
+        assert responses[3] == {'ok': True, 'values': [1.0]}
+        assert server._flusher is not None and not server._flusher.done()
+
+    asyncio.run(serve(test)(LINE_PROTOCOL))
+
+
+def test_failed_flush_drops_batch_and_releases_waiters():
+    async def test(server, port):
+        add_batch = server.registry.add_batch
+
+        def failing(*args):
+            raise Exception('disk on fire')
+
+        server.registry.add_batch = failing
+        # second add waits for flush of the first one
+        first, second = await asyncio.gather(
+            server.add('a', [1.0, 2.0], 0.0),
+            server.add('b', [3.0], 0.0)
+        )
+        assert (first, second) == (2, 1)
+
+        server.registry.add_batch = add_batch
+        responses = await request_lines(port, [
+            {'op': 'flush'},
+            {'op': 'add', 'key': 'c', 'points': [4.0], 'timestamps': 0},
+            {'op': 'query', 'key': 'c', 'qs': [1.0]},
+            {'op': 'stats'}
+        ])
+
+        # only the batch of 'a' was lost, it is reported once
+        assert not responses[0]['ok']
+        assert responses[0]['error'].startswith('2 points dropped: Exception: disk on fire')
+        assert responses[2] == {'ok': True, 'values': [4.0]}
+        assert server.registry.keys() == ['b', 'c']
+        stats = responses[3]['stats']
+        assert stats['dropped'] == 2
+        assert stats['flush_errors'] == 1
+        assert 'disk on fire' in stats['last_flush_error']
+        assert not server._flusher.done()
+        assert (await request_lines(port, [{'op': 'flush'}])) == [{'ok': True}]
+
+    asyncio.run(serve(test, max_pending=2, flush_interval=0.01)(LINE_PROTOCOL))
+
+
+def test_line_longer_than_default_stream_limit():
+    async def test(server, port):
+        points = np.random.default_rng(0).normal(size=10000).tolist()
+        responses = await request_lines(port, [
+            {'op': 'add', 'key': 'a', 'points': points, 'timestamps': 0},
+            {'op': 'query', 'key': 'a', 'qs': [1.0]}
+        ])
+
+        assert responses[0] == {'ok': True, 'accepted': 10000}
+        assert responses[1] == {'ok': True, 'values': [max(points)]}
+
+    asyncio.run(serve(test)(LINE_PROTOCOL))
+
+
+def test_line_over_limit_is_refused_and_connection_kept():
+    async def test(server, port):
+        responses = await request_lines(port, [
+            {'op': 'add', 'key': 'a', 'points': list(range(100000)), 'timestamps': 0},
+            {'op': 'add', 'key': 'a', 'points': [1.0, 2.0], 'timestamps': 0},
+            {'op': 'query', 'key': 'a', 'qs': [1.0]}
+        ])
+
+        assert responses[0] == {'ok': False, 'error': 'Request line is longer than 65536 bytes'}
+        assert responses[1] == {'ok': True, 'accepted': 2}
+        assert responses[2] == {'ok': True, 'values': [2.0]}
+
+    asyncio.run(serve(test, max_line=2 ** 16)(LINE_PROTOCOL))
+
+
+def test_binary_protocol_with_timestamps():
+    async def test(server, port):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        points = np.arange(1.0, 101.0)
+        frames = [
+            encode_frame(
+                {'op': 'add', 'key': 7, 'timestamps': True},
+                np.concatenate([points, np.zeros_like(points)])
+            ),
+            encode_frame({'op': 'query', 'key': 7, 'qs': [0.5, 1.0]})
+        ]
+        responses = []
+        for frame in frames:
+            writer.write(frame)
+            await writer.drain()
+            size = _LENGTH.unpack(await reader.readexactly(_LENGTH.size))[0]
+            responses.append(decode_frame(await reader.readexactly(size))[0])
+        writer.close()
+
+        assert responses[0] == {'ok': True, 'accepted': 100}
+        assert responses[1]['ok']
+        assert abs(responses[1]['values'][0] - 50) <= 10
+        assert responses[1]['values'][1] >= 90
+
+    asyncio.run(serve(test)(BINARY_PROTOCOL))
+
+
+def test_binary_odd_payload_with_timestamps_is_refused():
+    async def test(server, port):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(encode_frame({'op': 'add', 'key': 7, 'timestamps': True}, np.arange(5.0)))
+        await writer.drain()
+        size = _LENGTH.unpack(await reader.readexactly(_LENGTH.size))[0]
+        response = decode_frame(await reader.readexactly(size))[0]
+        writer.close()
+
+        assert not response['ok'] and 'even number of values' in response['error']
+        assert server.registry.keys() == []
+
+    asyncio.run(serve(test)(BINARY_PROTOCOL))
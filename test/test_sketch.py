@@ -0,0 +1,165 @@
+import numpy as np
+import pytest
+
+from structures.sketches import sketch as sketch_module
+from structures.sketches.sketch import Sketch, _band, _bands, coerce_value, coerce_values
+
+EPSILON = 0.05
+
+
+def feed(sketch: Sketch, points) -> None:
+    """Add points one by one with compress every 1/epsilon points, as buckets do"""
+    for nb, point in enumerate(points):
+        sketch.add(point, nb)
+        if (nb + 1) % int(1 / EPSILON) == 0:
+            sketch.compress(nb + 1)
+
+
+def check_bounds(sketch: Sketch, points) -> None:
+    """Every tuple brackets true rank of its value and keeps GK invariant"""
+    values, rmin, rmax = sketch.get_rmin_rmax()
+    ordered = np.sort(points)
+    assert rmin[-1] == len(points)
+    for value, low, high in zip(values, rmin, rmax):
+        first = np.searchsorted(ordered, value, side='left') + 1
+        last = np.searchsorted(ordered, value, side='right')
+        assert low <= last and first <= high
+
+    _, gaps, deltas = sketch._columns()
+    assert (gaps + deltas).max() <= max(2 * sketch.epsilon * len(points), 1) + 1
+
+
+def test_band_matches_bands():
+    for p in range(300):
+        deltas = np.arange(p + 3)
+        expected = _bands(deltas, p).tolist()
+        assert [_band(delta, p) for delta in deltas.tolist()] == expected
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_lists_and_columns_give_same_tuples(monkeypatch, seed):
+    points = np.random.default_rng(seed).normal(size=2000)
+
+    lists = Sketch(EPSILON / 2)
+    feed(lists, points)
+    monkeypatch.setattr(sketch_module, 'LIST_CAPACITY', 0)
+    columns = Sketch(EPSILON / 2)
+    feed(columns, points)
+
+    for a, b in zip(lists._columns(), columns._columns()):
+        np.testing.assert_array_equal(a, b)
+
+
+@pytest.mark.parametrize('dtype', [np.float32, np.float64, np.int32, np.int64])
+def test_rank_bounds_hold(dtype):
+    points = (np.random.default_rng(3).normal(size=3000) * 100).astype(dtype)
+    sketch = Sketch(EPSILON / 2, dtype=dtype)
+    feed(sketch, points)
+
+    check_bounds(sketch, points)
+    assert sketch.values.dtype == dtype
+
+
+def test_readers_see_points_kept_in_lists():
+    points = np.random.default_rng(4).normal(size=15)
+    sketch = Sketch(EPSILON / 2)
+    for nb, point in enumerate(points):
+        sketch.add(point, nb)
+
+    assert sketch._lists is not None
+    assert sketch.len() == len(points)
+    assert sketch.copy().len() == len(points)
+    np.testing.assert_array_equal(sketch.get_rmin_rmax()[0], np.sort(points))
+    assert sketch._lists is None and sketch.size == len(points)
+
+
+def test_large_sketch_moves_to_columns():
+    points = np.random.default_rng(5).normal(size=sketch_module.LIST_CAPACITY + 10)
+    sketch = Sketch(EPSILON / 2)
+    for nb, point in enumerate(points):
+        sketch.add(point, nb)
+
+    assert sketch._lists is None
+    check_bounds(sketch, points)
+
+
+def test_add_batch_after_single_points():
+    rng = np.random.default_rng(6)
+    points = rng.normal(size=300)
+    sketch = Sketch(EPSILON / 2)
+    feed(sketch, points[:100])
+    sketch.add_batch(np.sort(points[100:]), 100)
+    sketch.compress(len(points))
+
+    check_bounds(sketch, points)
+
+
+def test_merge_all_flushes_lists():
+    points = np.random.default_rng(7).normal(size=400)
+    left, right = Sketch(EPSILON / 2), Sketch(EPSILON / 2)
+    feed(left, points[:210])
+    feed(right, points[210:])
+
+    merged = Sketch.merge_all([left, right])
+    check_bounds(merged, points)
+
+
+@pytest.mark.parametrize('points, dtype', [
+    ([1.0, np.nan], np.float64),
+    ([np.inf], np.float64),
+    ([-np.inf], np.float32),
+    # overflows float32 to inf
+    ([1e39], np.float32),
+    (['a', 'b'], np.float64),
+    ([1 + 2j], np.float64),
+    ([1.5], np.int64),
+    ([2 ** 31], np.int32),
+    (np.array([2 ** 63], dtype=np.uint64), np.int64),
+    ([1.0], np.float16)
+])
+def test_coerce_values_refuses(points, dtype):
+    with pytest.raises(Exception):
+        coerce_values(points, dtype)
+
+
+@pytest.mark.parametrize('point, dtype', [
+    (np.nan, np.float64), (np.inf, np.float32), (1e39, np.float32),
+    ('abc', np.float64), (None, np.float64), ([1.0], np.float64),
+    (1.5, np.int64), (2 ** 31, np.int32), (np.float64(2.5), np.int32)
+])
+def test_coerce_value_refuses(point, dtype):
+    with pytest.raises(Exception):
+        coerce_value(point, dtype)
+
+
+@pytest.mark.parametrize('points, dtype, expected', [
+    ([1, 2, 3], np.float64, [1.0, 2.0, 3.0]),
+    (np.array([0.5, 1.5], dtype=np.float32), np.float64, [0.5, 1.5]),
+    (np.array([1.0, 2.0]), np.int32, [1, 2]),
+    (np.array([3, 4], dtype=np.uint8), np.int64, [3, 4]),
+    (np.array([2 ** 40], dtype=np.int64), np.float64, [2.0 ** 40]),
+    (7, np.int64, [7]),
+    ([[1.0, 2.0], [3.0, 4.0]], np.float32, [1.0, 2.0, 3.0, 4.0])
+])
+def test_coerce_values_converts(points, dtype, expected):
+    values = coerce_values(points, dtype)
+
+    assert values.dtype == np.dtype(dtype) and values.ndim == 1
+    np.testing.assert_array_equal(values, expected)
+
+
+def test_coerce_values_does_not_copy_array_of_dtype():
+    points = np.arange(10.0)
+    assert np.shares_memory(coerce_values(points, np.float64), points)
+
+
+@pytest.mark.parametrize('point, dtype, expected', [
+    (3, np.float64, 3.0), (np.float32(0.1), np.float64, float(np.float32(0.1))),
+    (0.1, np.float32, float(np.float32(0.1))), (4.0, np.int64, 4),
+    (np.int64(-5), np.int32, -5), ('2.5', np.float64, 2.5)
+])
+def test_coerce_value_converts_to_python_number(point, dtype, expected):
+    value = coerce_value(point, np.dtype(dtype))
+
+    assert value == expected
+    assert type(value) is (int if np.dtype(dtype).kind == 'i' else float)
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from test import streams
+from test.data_generator import Generator
+
+SIZE, CHUNK, PERIOD = 2500, 300, 400
+
+
+@pytest.mark.parametrize('order', streams.ORDERS)
+@pytest.mark.parametrize('distribution', list(streams.DISTRIBUTIONS))
+def test_same_seed_gives_same_stream(distribution, order):
+    points = streams.generate(distribution, SIZE, 90, order, PERIOD)
+
+    np.testing.assert_array_equal(points, streams.generate(distribution, SIZE, 90, order, PERIOD))
+    assert not np.array_equal(points, streams.generate(distribution, SIZE, 91, order, PERIOD))
+    assert points.shape == (SIZE,)
+    assert np.isfinite(points).all()
+    # orders only rearrange generated values
+    np.testing.assert_array_equal(np.sort(points), np.sort(streams.generate(distribution, SIZE, 90)))
+
+
+@pytest.mark.parametrize('distribution', list(streams.DISTRIBUTIONS))
+def test_orders_arrange_values(distribution):
+    increasing = streams.generate(distribution, SIZE, order='sorted')
+    decreasing = streams.generate(distribution, SIZE, order='reverse')
+    sawtooth = streams.generate(distribution, SIZE, order='sawtooth', period=PERIOD)
+
+    assert (np.diff(increasing) >= 0).all()
+    assert (np.diff(decreasing) <= 0).all()
+    for start in range(0, SIZE, PERIOD):
+        assert (np.diff(sawtooth[start:start + PERIOD]) >= 0).all()
+
+
+def test_latency_stream_is_integer():
+    assert streams.generate('latency', SIZE).dtype == np.int64
+
+
+@pytest.mark.parametrize('order', streams.ORDERS)
+@pytest.mark.parametrize('distribution', ['normal', 'latency'])
+def test_chunks_are_deterministic(distribution, order):
+    parts = list(streams.chunks(distribution, SIZE, CHUNK, 92, order, PERIOD))
+
+    assert [len(part) for part in parts] == [CHUNK] * (SIZE // CHUNK) + [SIZE % CHUNK]
+    for a, b in zip(parts, streams.chunks(distribution, SIZE, CHUNK, 92, order, PERIOD)):
+        np.testing.assert_array_equal(a, b)
+    if order != 'random':
+        np.testing.assert_array_equal(
+            np.concatenate(parts), streams.generate(distribution, SIZE, 92, order, PERIOD)
+        )
+
+
+def test_recorded_stream_is_replayed(tmp_path):
+    points = streams.generate('bimodal', SIZE)
+    path = str(tmp_path / 'stream.npy')
+    streams.record(path, points)
+
+    parts = list(streams.replay(path, CHUNK))
+    assert len(parts) == -(-SIZE // CHUNK)
+    np.testing.assert_array_equal(np.concatenate(parts), points)
+    np.testing.assert_array_equal(next(streams.replay(path)), points)
+
+
+@pytest.mark.parametrize('distribution, order', [('cauchy', 'random'), ('normal', 'shuffled')])
+def test_unknown_parameters_are_refused(distribution, order):
+    with pytest.raises(Exception):
+        streams.generate(distribution, SIZE, order=order)
+    with pytest.raises(Exception):
+        next(streams.chunks(distribution, SIZE, CHUNK, order=order))
+
+
+def test_batch_data_is_seeded_with_increasing_timestamps():
+    samples, timestamps = Generator(93).batch_data(SIZE)
+    again, _ = Generator(93).batch_data(SIZE)
+
+    np.testing.assert_array_equal(samples, again)
+    assert samples.shape == timestamps.shape == (SIZE,)
+    assert (np.diff(timestamps) >= 0).all()
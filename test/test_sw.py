@@ -0,0 +1,155 @@
+import numpy as np
+import pytest
+
+from structures.sw import SW_n_of_N, SUFFIX_MODE, SEGMENT_MODE
+from test.benchmark import rank_error
+
+QUANTILES = np.array([0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99])
+
+
+def partition(sw: SW_n_of_N):
+    """Levels of EH partition as (start, timestamp, Nb) of every bucket"""
+    return [
+        [(bucket.start, bucket.timestamp, bucket.Nb) for bucket in level]
+        for level in sw._levels
+    ]
+
+
+def assert_within_bound(sw: SW_n_of_N, points: np.ndarray, n: int, epsilon: float):
+    window = np.sort(points[-n:])
+    errors = rank_error(window, QUANTILES, np.asarray(sw.query_many(QUANTILES, n=n)))
+    assert errors.max() <= epsilon + 1e-9
+
+
+@pytest.mark.parametrize('mode', [SUFFIX_MODE, SEGMENT_MODE])
+@pytest.mark.parametrize('chunk', [1, 7, 100, 1000])
+def test_batch_gives_same_partition_as_points(mode, chunk):
+    N, epsilon = 500, 0.1
+    points = np.random.default_rng(chunk).normal(size=1500)
+    timestamps = np.arange(len(points), dtype=float)
+
+    single = SW_n_of_N(N, epsilon, mode=mode, verbose=False)
+    for point, ts in zip(points, timestamps):
+        single.add(point, ts=ts)
+
+    batched = SW_n_of_N(N, epsilon, mode=mode, verbose=False)
+    for start in range(0, len(points), chunk):
+        batched.add_batch(points[start:start + chunk], timestamps[start:start + chunk])
+
+    assert partition(batched) == partition(single)
+    assert batched._count == single._count
+    for n in (50, N):
+        assert_within_bound(single, points, n, epsilon)
+        assert_within_bound(batched, points, n, epsilon)
+
+
+@pytest.mark.parametrize('mode', [SUFFIX_MODE, SEGMENT_MODE])
+def test_batch_gives_same_partition_with_time_window(mode):
+    N, epsilon = 400, 0.1
+    rng = np.random.default_rng(11)
+    points = rng.normal(size=1200)
+    # bursts of points with equal timestamps and gaps between them
+    timestamps = np.repeat(np.arange(120, dtype=float) * 3, 10)
+
+    single = SW_n_of_N(N, epsilon, mode=mode, window_seconds=60, verbose=False)
+    for point, ts in zip(points, timestamps):
+        single.add(point, ts=ts)
+
+    batched = SW_n_of_N(N, epsilon, mode=mode, window_seconds=60, verbose=False)
+    for start in range(0, len(points), 64):
+        batched.add_batch(points[start:start + 64], timestamps[start:start + 64])
+
+    assert partition(batched) == partition(single)
+
+
+def test_empty_batch_is_ignored():
+    sw = SW_n_of_N(100, 0.1, verbose=False)
+    sw.add_batch(np.zeros(0), 0.0)
+
+    assert sw._count == 0 and sw._ordered == []
+
+
+@pytest.mark.parametrize('mode', [SUFFIX_MODE, SEGMENT_MODE])
+def test_stats_count_lift_cache_use(mode):
+    sw = SW_n_of_N(200, 0.1, mode=mode, verbose=False)
+    sw.add_batch(np.random.default_rng(12).normal(size=300), 0.0)
+
+    for _ in range(3):
+        sw.query_many(QUANTILES, n=100)
+    sw.add(0.5, ts=1.0)
+    sw.query_many(QUANTILES, n=100)
+
+    stats = sw.stats()
+    assert stats['lift_misses'] == 2
+    assert stats['lift_hits'] == 2
+
+
+def test_default_timestamp_is_time_of_add(monkeypatch):
+    sw = SW_n_of_N(100, 0.1, verbose=False)
+    monkeypatch.setattr('structures.sw.time.time', lambda: 1000.0)
+    sw.add(1.0)
+    monkeypatch.setattr('structures.sw.time.time', lambda: 2000.0)
+    sw.add(2.0)
+
+    assert sw._timestamps == [1000.0, 2000.0]
+
+
+def bursty_stream(seed: int, size: int, burst: int):
+    """Points and timestamps where runs of points share a timestamp"""
+    rng = np.random.default_rng(seed)
+    points = rng.normal(size=size)
+    lengths = rng.geometric(1 / burst, size=size)
+    timestamps = np.repeat(np.arange(size, dtype=float), lengths)[:size]
+
+    return points, timestamps
+
+
+@pytest.mark.parametrize('mode', [SUFFIX_MODE, SEGMENT_MODE])
+def test_time_window_keeps_bucket_straddling_border(mode):
+    N, epsilon, window = 2000, 0.05, 8.0
+    points, timestamps = bursty_stream(13, 4000, 40)
+    lam = epsilon / (epsilon + 2)
+
+    sw = SW_n_of_N(N, epsilon, mode=mode, window_seconds=window, verbose=False)
+    for i, (point, ts) in enumerate(zip(points, timestamps)):
+        sw.add(point, ts=ts)
+        if i % 97 != 0 or i < 200:
+            continue
+
+        inside = points[:i + 1][timestamps[:i + 1] >= ts - window]
+        assert len(inside) <= N
+        # points of the window are never dropped
+        assert sw._count - sw._starts[0] >= len(inside)
+
+        # count queries over the window keep their guarantee
+        for n in (len(inside), len(inside) // 3 + 1):
+            assert_within_bound(sw, inside, n, epsilon)
+
+        # time queries miss at most the straddling part of the oldest bucket
+        errors = rank_error(
+            np.sort(inside), QUANTILES,
+            np.asarray(sw.query_many(QUANTILES, window_seconds=window))
+        )
+        assert errors.max() <= epsilon + lam + 1e-9
+
+
+@pytest.mark.parametrize('mode', [SUFFIX_MODE, SEGMENT_MODE])
+def test_quantile_has_rank_ceil_phi_n(mode):
+    # epsilon * n < 1, so answers are exact
+    n = 100
+    sw = SW_n_of_N(n, 0.005, mode=mode, verbose=False)
+    points = np.random.default_rng(14).permutation(300)
+    sw.add_batch(points, 0.0)
+
+    qs = np.array([0.001, 0.01, 0.015, 0.29, 0.333, 0.5, 0.999, 1.0])
+    expected = np.sort(points[-n:])[np.ceil(qs * n).astype(int) - 1]
+    np.testing.assert_array_equal(sw.query_many(qs), expected)
+
+
+def test_query_answers_for_added_points_while_less_than_n():
+    sw = SW_n_of_N(1000, 0.1, verbose=False)
+    points = np.random.default_rng(15).normal(size=37)
+    sw.add_batch(points, 0.0)
+
+    assert_within_bound(sw, points, 37, 0.1)
+    np.testing.assert_array_equal(sw.query_many(QUANTILES), sw.query_many(QUANTILES, n=37))
@@ -9,6 +9,14 @@ id2key = {
 }
 
 def epsilon_validator(value):
+    # command line values come as strings
+    try:
+        value = float(value)
+    except ValueError:
+        raise TypeError(
+            f'Epsilon value should be float. Got {value}'
+        )
+
     if value > DEFAULT_EPSILON_PARAMETER:
         warnings.warn(
             f'Epsilon value is too high.' \
@@ -27,8 +35,18 @@ def epsilon_validator(value):
                 f'Epsilon value should be float. Got {value}'
             )
 
+        return value
+
 
 def number_of_points_validator(value):
+    # command line values come as strings
+    try:
+        value = int(value)
+    except ValueError:
+        raise TypeError(
+            f'Number of points should be int. Got {value}'
+        )
+
     if value < DEFAULT_NUMBER_OF_POINTS:
         warnings.warn(
             f'Number of points too low.' \